@@ -0,0 +1,412 @@
+"""
+This module defines an asyncio native audit pipeline, for aiohttp and ASGI applications.
+
+Records are captured by a middleware, queued on an `asyncio.Queue` and uploaded in batches by a
+task running on the application event loop, using an `aiohttp.ClientSession`.
+"""
+
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from starlette.datastructures import URL, Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .audit_queue import DEFAULT_MAX_QUEUE_RECORDS
+from .auditor import DEFAULT_LOG_ENDPOINT, CapturedExchange, cloud_logger
+from .body_capture import BodyRecorder, CapturedBody
+from .compression import BatchEncoder
+from .retry import (
+    FATAL,
+    SUCCESS,
+    RetryPolicy,
+    classify_status,
+    get_circuit_breaker,
+    parse_retry_after,
+)
+from .sender import MAX_BULK_SIZE_IN_BYTES
+
+# Queued by `close` to send the last batch without waiting for it to linger
+_FLUSH = object()
+
+
+class AsyncAuditor(cloud_logger):
+    """
+    Audit pipeline running on the event loop.
+
+    Payloads are built and scrubbed exactly like `cloud_logger` does, only capture and upload
+    differ. Use `aiohttp_middleware` with `AioHttpApi` (or pass the auditor as the ``auditor``
+    option) and `asgi_middleware` with `FiretailMiddleware`.
+    """
+
+    def __init__(
+        self,
+        url=DEFAULT_LOG_ENDPOINT,
+        token=None,
+        custom_backend=False,
+        debug=False,
+        network_timeout=10.0,
+        number_of_retries=4,
+        retry_timeout=2,
+        max_retry_delay=60,
+        logs_drain_timeout=5,
+        flush_linger=None,
+        max_queue_records=DEFAULT_MAX_QUEUE_RECORDS,
+        max_batch_bytes=MAX_BULK_SIZE_IN_BYTES,
+        max_batch_records=None,
+        compression=None,
+        compression_level=None,
+        circuit_breaker_threshold=5,
+        circuit_breaker_reset_timeout=30,
+        sink=None,
+        **kwargs
+    ):
+        super().__init__(
+            None,
+            url=url,
+            debug=debug,
+            custom_backend=custom_backend,
+            token=token,
+            network_timeout=network_timeout,
+            number_of_retries=number_of_retries,
+            retry_timeout=retry_timeout,
+            logs_drain_timeout=logs_drain_timeout,
+            **kwargs,
+        )
+        self.flush_linger = logs_drain_timeout if flush_linger is None else flush_linger
+        self.max_queue_records = max_queue_records
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_records = max_batch_records
+        self.compression = compression
+        self.compression_level = compression_level
+        # Fail early on an unknown or unavailable compression
+        BatchEncoder(compression, compression_level)
+        self.retry_policy = RetryPolicy(base_delay=retry_timeout, max_delay=max_retry_delay)
+        # Batches are posted with aiohttp, unless written to another sink from the default executor
+        self.sink = sink
+        self.circuit_breaker = get_circuit_breaker(
+            sink.name if sink is not None else url, circuit_breaker_threshold, circuit_breaker_reset_timeout
+        )
+
+        self.dropped = 0
+        self._queue = None
+        self._upload_task = None
+        # Encoded record that did not fit in the previous batch, sent first in the next one
+        self._carried = None
+        self.metrics.gauge(
+            "queue_records", lambda: self._queue.qsize() if self._queue is not None else 0, "Audit records queued."
+        )
+        self.metrics.gauge(
+            "circuit_open", lambda: int(self.circuit_breaker.is_open()), "Whether uploads are currently refused."
+        )
+        self.metrics.counter("records_dropped", lambda: self.dropped, "Audit records dropped by the full queue.")
+
+    def _ensure_uploader(self):
+        if self._upload_task is None or self._upload_task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue_records)
+            self._upload_task = asyncio.get_running_loop().create_task(self._upload_loop())
+
+    def capture(self, exchange):
+        """
+        Queue a captured exchange for upload. Never blocks: records are dropped if the queue is full.
+
+        :type exchange: CapturedExchange
+        """
+        if self.collector_socket:
+            # The collector of the host uploads the record, there is nothing to queue here
+            self._ensure_sink(self.token)
+            self.sender.append_encoded(self.encode(exchange))
+            return
+        if not (self.token or self.custom_backend or self.sink is not None):
+            return
+        self._ensure_uploader()
+        try:
+            self._queue.put_nowait(exchange)
+            self.metrics.inc("records_enqueued")
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.stdout_logger.debug("Audit queue is full, dropped log (%s dropped so far)", self.dropped)
+
+    async def _next_batch(self):
+        """
+        Wait for a first record, then gather more until the batch is full or has lingered long enough.
+
+        :return: The records, the body of the batch, and the number of queued exchanges it completes.
+        :rtype: tuple[list[bytes], bytes, int]
+        """
+        loop = asyncio.get_running_loop()
+        logs_list = []
+        batch = BatchEncoder(self.compression, self.compression_level)
+        done = 0
+        deadline = None
+
+        if self._carried is not None:
+            log, self._carried = self._carried, None
+            batch.write(log)
+            logs_list.append(log)
+            done += 1
+            deadline = loop.time() + self.flush_linger
+
+        while batch.size < self.max_batch_bytes and (
+            self.max_batch_records is None or batch.records < self.max_batch_records
+        ):
+            if deadline is None:
+                exchange = await self._queue.get()
+                deadline = loop.time() + self.flush_linger
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    exchange = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            if exchange is _FLUSH:
+                done += 1
+                break
+            try:
+                log = self.encode(exchange)
+            except Exception as e:
+                self.stdout_logger.debug("Could not encode audit record, dropping it. Exception: %s", e)
+                done += 1
+                continue
+
+            # A record always makes it into an empty batch, even if it is bigger than the limit on
+            # its own. The extra byte is the newline.
+            if logs_list and batch.size + len(log) + 1 > self.max_batch_bytes:
+                self._carried = log
+                break
+            batch.write(log)
+            logs_list.append(log)
+            done += 1
+        return logs_list, batch.finish(), done
+
+    async def _upload_loop(self):
+        if self.sink is not None:
+            await self._upload_batches(None)
+            return
+        timeout = aiohttp.ClientTimeout(total=self.network_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await self._upload_batches(session)
+
+    async def _upload_batches(self, session):
+        while True:
+            logs_list, body, done = await self._next_batch()
+            if logs_list:
+                try:
+                    await self._send_batch(session, logs_list, body)
+                except Exception as e:
+                    self.stdout_logger.debug(
+                        "Unexpected exception while sending logs to firetail, swallowing. Exception: %s", e
+                    )
+            # Only now that they are sent, so that `close` waits for the records it flushes
+            for _ in range(done):
+                self._queue.task_done()
+
+    async def _post(self, session, logs_list, body):
+        """
+        :return: Status code, text and Retry-After delay of the response.
+        :rtype: tuple[int, str, float | None]
+        """
+        if self.sink is not None:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, self.sink.send, body, logs_list, self.compression)
+            return response.status_code, response.text, parse_retry_after(response.headers.get("Retry-After"))
+
+        headers = {"Content-type": "application/x-ndjson", "x-ft-api-key": self.token or ""}
+        if self.compression:
+            headers["Content-Encoding"] = self.compression
+        async with session.post(self.url, data=body, headers=headers) as response:
+            return response.status, await response.text(), parse_retry_after(response.headers.get("Retry-After"))
+
+    async def _send_batch(self, session, logs_list, body):
+        for current_try in range(self.number_of_retries):
+            if not self.circuit_breaker.allow_request():
+                break
+
+            retry_after = None
+            started_at = time.monotonic()
+            try:
+                status, text, retry_after = await self._post(session, logs_list, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                self.metrics.inc("upload_errors")
+                self.stdout_logger.warning(
+                    "Got exception while sending logs to firetail, Try (%s/%s). Message: %s",
+                    current_try + 1,
+                    self.number_of_retries,
+                    e,
+                )
+                self.circuit_breaker.record_failure()
+            else:
+                self.metrics.observe_response(status, time.monotonic() - started_at)
+                outcome = classify_status(status)
+                if outcome == SUCCESS:
+                    self.stdout_logger.debug("Successfully sent bulk of %s logs to firetail", len(logs_list))
+                    self.circuit_breaker.record_success()
+                    self.metrics.inc("batches_sent")
+                    self.metrics.inc("records_sent", len(logs_list))
+                    self.metrics.inc("bytes_sent", len(body))
+                    return True
+                if outcome == FATAL:
+                    self.circuit_breaker.record_success()
+                    self.metrics.inc("batches_failed")
+                    self.stdout_logger.debug("Got %s while sending logs to firetail, dropping them: %s", status, text)
+                    return False
+                self.stdout_logger.debug(
+                    "Got %s while sending logs to firetail, Try (%s/%s). Response: %s",
+                    status,
+                    current_try + 1,
+                    self.number_of_retries,
+                    text,
+                )
+                self.circuit_breaker.record_failure()
+
+            if current_try + 1 < self.number_of_retries:
+                self.metrics.inc("retries")
+                await asyncio.sleep(self.retry_policy.backoff(current_try, retry_after))
+
+        self.stdout_logger.error("Could not send %s logs to firetail, dropping them", len(logs_list))
+        self.metrics.inc("batches_failed")
+        return False
+
+    async def close(self, timeout=None):
+        """Upload the records still queued, then stop the upload task."""
+        if self._upload_task is None:
+            return
+        try:
+            await asyncio.wait_for(self._flush(), timeout)
+        except asyncio.TimeoutError:
+            self.stdout_logger.warning("Timed out while flushing %s audit records", self._queue.qsize())
+        self._upload_task.cancel()
+        try:
+            await self._upload_task
+        except asyncio.CancelledError:
+            pass
+        self._upload_task = None
+
+    async def _flush(self):
+        await self._queue.put(_FLUSH)
+        await self._queue.join()
+
+    @web.middleware
+    async def aiohttp_middleware(self, request, handler):
+        start = time.time()
+        try:
+            response = await handler(request)
+        except web.HTTPException as exc:
+            await self._capture_aiohttp(request, exc, start)
+            raise
+        except Exception:
+            # Turned into a 500 by aiohttp, which is recorded as such
+            await self._capture_aiohttp(request, web.HTTPInternalServerError(), start)
+            raise
+        await self._capture_aiohttp(request, response, start)
+        return response
+
+    async def _capture_aiohttp(self, request, response, start):
+        diff = round((time.time() - start) * 1000, 2)
+        route = request.match_info.route
+        resource = route.resource.canonical if route.resource is not None else request.path
+        if not self.sampling.should_sample(request.method, resource, response.status):
+            return
+        try:
+            request_body = await self.body_capture.aiohttp_request(request)
+        except Exception:
+            request_body = CapturedBody()
+
+        # Header names are multidict.istr, which is not serialized like a plain str
+        self.capture(
+            CapturedExchange(
+                uri=str(request.url),
+                resource=resource,
+                method=request.method,
+                request_headers=[(str(k), v) for k, v in request.headers.items()],
+                request_body=request_body,
+                status_code=response.status,
+                response_headers=[(str(k), v) for k, v in response.headers.items()],
+                response_body=self.body_capture.aiohttp_response(response),
+                ip=request.remote,
+                http_protocol="HTTP/{}.{}".format(*request.version),
+                authorization=request.headers.get("Authorization"),
+                diff=diff,
+            )
+        )
+
+    def asgi_middleware(self, app):
+        """
+        Wrap an ASGI app so its requests are audited, usable in the `FiretailMiddleware` middleware list.
+        """
+        return AuditMiddleware(app, self)
+
+
+class AuditMiddleware:
+    def __init__(self, app: ASGIApp, auditor) -> None:
+        """Middleware that captures every HTTP request and response for the audit pipeline.
+
+        :param app: app to wrap in middleware.
+        :param auditor: `AsyncAuditor` receiving the captured exchanges.
+        """
+        self.app = app
+        self.auditor = auditor
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.time()
+        body_capture = self.auditor.body_capture
+        request_headers = Headers(scope=scope)
+        request_content_type = request_headers.get("content-type")
+        request_body = BodyRecorder(
+            body_capture.max_request_body_bytes,
+            body_capture.omit_reason(request_content_type),
+            body_capture.keeps_whole(request_content_type),
+        )
+        response = {"status": 500, "headers": [], "body": BodyRecorder(body_capture.max_response_body_bytes)}
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.write(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+                content_type = Headers(raw=response["headers"]).get("content-type")
+                response["body"].omitted = body_capture.omit_reason(content_type)
+                response["body"].whole = body_capture.keeps_whole(content_type)
+            elif message["type"] == "http.response.body":
+                # Only up to the cap is kept, unless the body is kept whole to be redacted first
+                response["body"].write(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            if self.auditor.sampling.should_sample(scope["method"], route, response["status"]):
+                self.auditor.capture(self._exchange(scope, route, request_headers, request_body, response, start))
+
+    @staticmethod
+    def _exchange(scope: Scope, route, request_headers, request_body, response, start) -> CapturedExchange:
+        client = scope.get("client")
+        return CapturedExchange(
+            uri=str(URL(scope=scope)),
+            resource=route,
+            method=scope["method"],
+            request_headers=request_headers.items(),
+            request_body=request_body.body(),
+            status_code=response["status"],
+            response_headers=Headers(raw=response["headers"]).items(),
+            response_body=response["body"].body(),
+            ip=client[0] if client else None,
+            http_protocol="HTTP/{}".format(scope.get("http_version", "1.1")),
+            authorization=request_headers.get("Authorization"),
+            diff=round((time.time() - start) * 1000, 2),
+        )
@@ -11,6 +11,7 @@ import warnings
 from enum import Enum
 
 from ..decorators.produces import NoContent
+from ..decorators.validation import COLLECT_ALL, VALIDATION_ERROR_MODES
 from ..exceptions import ResolverError
 from ..http_facts import METHODS
 from ..jsonifier import Jsonifier
@@ -120,6 +121,17 @@ class AbstractAPI(metaclass=AbstractAPIMeta):
         logger.debug("Strict Request Validation: %s", str(strict_validation))
         self.strict_validation = strict_validation
 
+        if self.options.validation_error_mode not in VALIDATION_ERROR_MODES:
+            raise ValueError(
+                "Unknown validation error mode {!r}, expected one of {}".format(
+                    self.options.validation_error_mode, ", ".join(VALIDATION_ERROR_MODES)
+                )
+            )
+        # Errors reported per request, the fail-fast mode stops at the first one
+        self.max_validation_errors = (
+            self.options.max_validation_errors if self.options.validation_error_mode == COLLECT_ALL else 1
+        )
+
         logger.debug("Pythonic params: %s", str(pythonic_params))
         self.pythonic_params = pythonic_params
 
@@ -135,6 +147,9 @@ class AbstractAPI(metaclass=AbstractAPIMeta):
         if self.options.openapi_console_ui_available:
             self.add_swagger_ui()
 
+        if self.options.metrics is not None:
+            self.add_metrics()
+
         self.add_paths()
 
         if auth_all_paths:
@@ -161,6 +176,14 @@ class AbstractAPI(metaclass=AbstractAPIMeta):
         Adds swagger ui to {base_path}/ui/
         """
 
+    def add_metrics(self):
+        """
+        Adds the audit pipeline metrics to {base_path}/metrics
+
+        Only called with the `metrics` option, so APIs without a metrics endpoint need not implement it.
+        """
+        raise NotImplementedError("{} does not support the metrics option".format(type(self).__name__))
+
     @abc.abstractmethod
     def add_auth_on_not_found(self, security, security_definitions):
         """
@@ -200,6 +223,11 @@ class AbstractAPI(metaclass=AbstractAPIMeta):
             pythonic_params=self.pythonic_params,
             uri_parser_class=self.options.uri_parser_class,
             pass_context_arg_name=self.pass_context_arg_name,
+            compile_schemas=self.options.compile_schemas,
+            max_validation_errors=self.max_validation_errors,
+            max_validation_error_length=self.options.max_validation_error_length,
+            stream_json_bodies=self.options.stream_json_bodies,
+            max_json_body_bytes=self.options.max_json_body_bytes,
         )
         self._add_operation_internal(method, path, operation)
 
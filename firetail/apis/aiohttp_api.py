@@ -4,6 +4,7 @@ Firetail requests / responses.
 """
 
 import asyncio
+import functools
 import logging
 import re
 import traceback
@@ -21,11 +22,12 @@ from werkzeug.exceptions import HTTPException as werkzeug_HTTPException
 from firetail.apis.abstract import AbstractAPI
 from firetail.exceptions import ProblemException
 from firetail.handlers import AuthErrorHandler
+from firetail.json_stream import STREAMED_JSON_KEY
 from firetail.jsonifier import JSONEncoder, Jsonifier
 from firetail.lifecycle import FiretailRequest, FiretailResponse
 from firetail.problem import problem
 from firetail.security import AioHttpSecurityHandlerFactory
-from firetail.utils import yamldumper
+from firetail.utils import is_json_mimetype, yamldumper
 
 logger = logging.getLogger("firetail.apis.aiohttp_api")
 
@@ -104,6 +106,12 @@ class AioHttpApi(AbstractAPI):
         aiohttp_jinja2.setup(self.subapp, loader=jinja2.FileSystemLoader(str(self.options.openapi_console_ui_from_dir)))
         middlewares = self.options.as_dict().get("middlewares", [])
         self.subapp.middlewares.extend(middlewares)
+        if self.options.auditor is not None:
+            # Outermost, so the audit record holds the response produced by the problems middleware
+            auditor = self.options.auditor
+            self.subapp.middlewares.insert(0, auditor.aiohttp_middleware)
+            # Upload the records still queued or lingering when the app shuts down
+            self.subapp.on_cleanup.append(lambda app: auditor.close(auditor.logs_drain_timeout))
 
     @staticmethod
     def make_security_handler_factory(pass_context_arg_name):
@@ -166,6 +174,17 @@ class AioHttpApi(AbstractAPI):
     async def _get_openapi_yaml(self, request):
         return web.Response(status=200, content_type="text/yaml", body=yamldumper(self._spec_for_prefix(request)))
 
+    def add_metrics(self):
+        """
+        Adds the audit pipeline metrics to {base_path}/metrics
+        """
+        logger.debug("Adding metrics: %s/%s", self.base_path, self.options.metrics_path)
+        self.subapp.router.add_route("GET", self.options.metrics_path, self._get_metrics)
+
+    async def _get_metrics(self, request):
+        body, content_type = self.options.metrics.render(request.headers.get("Accept"), request.query.get("format"))
+        return web.Response(status=200, body=body.encode("utf-8"), headers={"Content-Type": content_type})
+
     def add_swagger_ui(self):
         """
         Adds swagger ui to {base_path}/ui/
@@ -240,10 +259,12 @@ class AioHttpApi(AbstractAPI):
             self.subapp.router.add_route(method, path + "/", handler, name=endpoint_name + "_")
 
     @classmethod
-    async def get_request(cls, req):
+    async def get_request(cls, req, stream_body=False):
         """Convert aiohttp request to firetail
 
         :param req: instance of aiohttp.web.Request
+        :param stream_body: Leave JSON bodies unread, for the body validator to parse them from the stream.
+        :type stream_body: bool
         :return: firetail request instance
         :rtype: FiretailRequest
         """
@@ -265,6 +286,7 @@ class AioHttpApi(AbstractAPI):
         query = parse_qs(req.rel_url.query_string)
         headers = req.headers
         body = None
+        stream = None
 
         # Note: if request is not 'application/x-www-form-urlencoded' nor 'multipart/form-data',
         #       then `post_data` will be left an empty dict and the stream will not be consumed.
@@ -292,6 +314,9 @@ class AioHttpApi(AbstractAPI):
                     # and that's what Firetail expects in its processing functions
                     form[k] = [v]
             body = b""
+        elif stream_body and is_json_mimetype(req.content_type):
+            logger.debug("Leaving data to be streamed from request")
+            stream = req.content
         else:
             logger.debug("Reading data from request")
             body = await req.read()
@@ -308,8 +333,15 @@ class AioHttpApi(AbstractAPI):
             files=files,
             context=req,
             cookies=req.cookies,
+            stream=stream,
+            json_setter=functools.partial(cls._set_streamed_json, req),
         )
 
+    @staticmethod
+    def _set_streamed_json(req, data):
+        # The payload is consumed, the audit capture gets the parsed body from the request instead
+        req[STREAMED_JSON_KEY] = data
+
     @classmethod
     async def get_response(cls, response, mimetype=None, request=None):
         """Get response.
@@ -3,6 +3,7 @@ This module defines a Flask Firetail API which implements translations between F
 Firetail requests / responses.
 """
 
+import functools
 import logging
 import pathlib
 import warnings
@@ -15,6 +16,7 @@ from werkzeug.local import LocalProxy
 from firetail.apis import flask_utils
 from firetail.apis.abstract import AbstractAPI
 from firetail.handlers import AuthErrorHandler
+from firetail.json_stream import STREAMED_JSON_KEY
 from firetail.jsonifier import Jsonifier
 from firetail.lifecycle import FiretailRequest, FiretailResponse
 from firetail.security import FlaskSecurityHandlerFactory
@@ -63,6 +65,14 @@ class FlaskApi(AbstractAPI):
         endpoint_name = f"{self.blueprint.name}_openapi_yaml"
         self.blueprint.add_url_rule(openapi_spec_path_yaml, endpoint_name, self._handlers.get_yaml_spec)
 
+    def add_metrics(self):
+        """
+        Adds the audit pipeline metrics to {base_path}/metrics
+        """
+        logger.debug("Adding metrics: %s/%s", self.base_path, self.options.metrics_path)
+        endpoint_name = f"{self.blueprint.name}_metrics"
+        self.blueprint.add_url_rule(self.options.metrics_path, endpoint_name, self._handlers.get_metrics)
+
     def add_swagger_ui(self):
         """
         Adds swagger ui to {base_path}/ui/
@@ -227,19 +237,29 @@ class FlaskApi(AbstractAPI):
             headers=flask_request.headers,
             form=flask_request.form,
             query=flask_request.args,
-            body=flask_request.get_data(),
+            body_getter=flask_request.get_data,
             json_getter=lambda: flask_request.get_json(silent=True),
             files=flask_request.files,
             path_params=params,
             context=context_dict,
             cookies=flask_request.cookies,
+            stream=flask_request.stream,
+            json_setter=functools.partial(cls._set_streamed_json, flask_request),
         )
+        # The body is read when first accessed, streaming validators may read it from the stream instead
         logger.debug(
             "Getting data and status code",
-            extra={"data": request.body, "data_type": type(request.body), "url": request.url},
+            extra={"content_length": flask_request.content_length, "url": request.url},
         )
         return request
 
+    @staticmethod
+    def _set_streamed_json(flask_request, data):
+        # The stream is consumed: views calling `get_json` get the parsed body from the cache of
+        # werkzeug, and the audit capture from the environ
+        flask_request._cached_json = (data, data)
+        flask_request.environ[STREAMED_JSON_KEY] = data
+
     @classmethod
     def _set_jsonifier(cls):
         """
@@ -299,6 +319,12 @@ class InternalHandlers:
         static_dir = str(self.options.openapi_console_ui_from_dir)
         return flask.send_from_directory(static_dir, filename)
 
+    def get_metrics(self):
+        body, content_type = self.options.metrics.render(
+            flask.request.headers.get("Accept"), flask.request.args.get("format")
+        )
+        return flask.Response(body, content_type=content_type)
+
     def get_json_spec(self):
         return flask.jsonify(self._spec_for_prefix())
 
@@ -0,0 +1,183 @@
+"""
+This module defines the self-metrics of the audit pipeline, and their Prometheus and JSON renderings.
+"""
+
+import bisect
+import json
+import threading
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+JSON_CONTENT_TYPE = "application/json"
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Name, help
+COUNTERS = (
+    ("records_enqueued", "Audit records accepted by the queue."),
+    ("bytes_enqueued", "Bytes of audit records accepted by the queue."),
+    ("batches_sent", "Batches delivered to the logging endpoint."),
+    ("records_sent", "Audit records delivered to the logging endpoint."),
+    ("bytes_sent", "Bytes of batch bodies delivered to the logging endpoint."),
+    ("retries", "Upload attempts retried after a transient failure."),
+    ("upload_errors", "Upload attempts that failed without a response."),
+    ("batches_failed", "Batches that could not be delivered."),
+    ("records_backed_up", "Audit records spilled to disk."),
+    ("records_replayed", "Spilled audit records delivered after a replay."),
+)
+
+
+class Histogram:
+    """Cumulative histogram, with the bucket layout of Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :rtype: list[tuple[str, int]]
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+
+class PipelineMetrics:
+    """
+    Counters, gauges and upload latency of an audit pipeline.
+
+    Counters are incremented by the pipeline with `inc`. Values the pipeline already tracks, such
+    as the queue depth or the records dropped by the queue, are registered with `gauge` or
+    `counter` as functions and only evaluated when the metrics are read.
+    """
+
+    def __init__(self, namespace="firetail_audit", latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        self.namespace = namespace
+        self._counters = {name: 0 for name, _ in COUNTERS}
+        self._help = dict(COUNTERS)
+        self._functions = {}
+        self._status_codes = {}
+        self._latency = Histogram(latency_buckets)
+        self._lock = threading.Lock()
+
+    def after_fork(self):
+        """Replace the lock, which may have been held by another thread of the parent when it forked."""
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name, function, help_text=""):
+        """
+        Register a gauge, read by calling `function` with no arguments.
+        """
+        with self._lock:
+            self._functions[name] = (function, "gauge")
+            self._help[name] = help_text
+
+    def counter(self, name, function, help_text=""):
+        """
+        Register a counter maintained elsewhere, read by calling `function` with no arguments.
+        """
+        with self._lock:
+            self._functions[name] = (function, "counter")
+            self._help[name] = help_text
+
+    def observe_response(self, status_code, latency):
+        """
+        Count an upload response by status code, and record how long it took in seconds.
+        """
+        with self._lock:
+            self._status_codes[status_code] = self._status_codes.get(status_code, 0) + 1
+            self._latency.observe(latency)
+
+    def snapshot(self):
+        """
+        :rtype: dict
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            functions = dict(self._functions)
+            status_codes = dict(self._status_codes)
+            latency = {
+                "count": self._latency.count,
+                "sum": self._latency.sum,
+                "buckets": dict(self._latency.cumulative()),
+            }
+        gauges = {}
+        for name, (function, kind) in functions.items():
+            try:
+                value = function()
+            except Exception:
+                value = None
+            (counters if kind == "counter" else gauges)[name] = value
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "status_codes": {str(code): count for code, count in sorted(status_codes.items())},
+            "upload_latency_seconds": latency,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """
+        :rtype: str
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full_name = "{}_{}".format(self.namespace, name)
+            if help_text:
+                lines.append("# HELP {} {}".format(full_name, help_text))
+            lines.append("# TYPE {} {}".format(full_name, kind))
+            for suffix, labels, value in samples:
+                label_text = "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}" if labels else ""
+                lines.append("{}{}{} {}".format(full_name, suffix, label_text, value))
+
+        for name, value in snapshot["counters"].items():
+            if value is not None:
+                metric(name + "_total", "counter", self._help.get(name), [("", (), value)])
+        for name, value in snapshot["gauges"].items():
+            if value is not None:
+                metric(name, "gauge", self._help.get(name), [("", (), value)])
+        metric(
+            "responses_total",
+            "counter",
+            "Upload responses by HTTP status code.",
+            [("", (("code", code),), count) for code, count in snapshot["status_codes"].items()],
+        )
+        latency = snapshot["upload_latency_seconds"]
+        metric(
+            "upload_latency_seconds",
+            "histogram",
+            "Duration of upload requests.",
+            [("_bucket", (("le", bound),), count) for bound, count in latency["buckets"].items()]
+            + [("_sum", (), latency["sum"]), ("_count", (), latency["count"])],
+        )
+        return "\n".join(lines) + "\n"
+
+    def render(self, accept=None, query_format=None):
+        """
+        Render the metrics for an HTTP endpoint, as JSON if asked for either by the ``format`` query
+        parameter or by the Accept header, in the Prometheus text format otherwise.
+
+        :rtype: tuple[str, str]
+        :return: The body and its content type.
+        """
+        if query_format == "json" or (query_format is None and accept and JSON_CONTENT_TYPE in accept):
+            return self.to_json(), JSON_CONTENT_TYPE
+        return self.to_prometheus(), PROMETHEUS_CONTENT_TYPE
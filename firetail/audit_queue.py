@@ -0,0 +1,251 @@
+"""
+This module defines the bounded queue that holds audit records until the sender ships them.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+SPILL = "spill"
+
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK, SPILL)
+
+DEFAULT_MAX_QUEUE_BYTES = 64 * 1024 * 1024  # 64 MB
+DEFAULT_MAX_QUEUE_RECORDS = 100000
+
+
+class AuditQueue:
+    """
+    Thread safe FIFO queue bounded by both the total size of its records and their number.
+
+    When a record does not fit, the overflow policy decides what happens:
+
+    - ``drop_newest``: the incoming record is discarded.
+    - ``drop_oldest``: the oldest records are evicted until the incoming one fits.
+    - ``block``: the producer waits up to `block_timeout` seconds for room, then drops the record.
+    - ``spill``: the incoming record is handed to `spill_handler` (usually written to disk).
+
+    Every discarded record is counted in `dropped`, every spilled one in `spilled`.
+    """
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_MAX_QUEUE_BYTES,
+        max_records=DEFAULT_MAX_QUEUE_RECORDS,
+        overflow_policy=DROP_NEWEST,
+        block_timeout=1.0,
+        spill_handler=None,
+    ):
+        """
+        :param max_bytes: Maximum total size of the queued records.
+        :type max_bytes: int
+        :param max_records: Maximum number of queued records.
+        :type max_records: int
+        :param overflow_policy: One of `OVERFLOW_POLICIES`.
+        :type overflow_policy: str
+        :param block_timeout: Seconds a producer waits for room with the ``block`` policy.
+        :type block_timeout: float
+        :param spill_handler: Callable receiving the list of records that overflowed with the ``spill`` policy.
+        :type spill_handler: callable | None
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Unknown overflow policy {!r}, expected one of {}".format(overflow_policy, ", ".join(OVERFLOW_POLICIES))
+            )
+        if overflow_policy == SPILL and spill_handler is None:
+            raise ValueError("The 'spill' overflow policy requires a spill handler")
+
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.spill_handler = spill_handler
+
+        self.dropped = 0
+        self.spilled = 0
+        self.closed = False
+
+        self._records = collections.deque()
+        self._bytes = 0
+        # When the oldest record currently queued arrived
+        self._first_queued_at = None
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._not_empty = threading.Condition(self._lock)
+
+    @staticmethod
+    def record_size(record):
+        # Records are encoded bytes, so this is their exact size on the wire
+        return len(record)
+
+    def _fits(self, size):
+        # An empty queue always takes the record, so a single oversized record
+        # is still shipped (and rejected by the backend if it really is too big).
+        if not self._records:
+            return True
+        return self._bytes + size <= self.max_bytes and len(self._records) < self.max_records
+
+    def _push(self, record, size):
+        if not self._records:
+            self._first_queued_at = time.monotonic()
+        self._records.append(record)
+        self._bytes += size
+        self._not_empty.notify()
+
+    def _pop(self):
+        record = self._records.popleft()
+        self._bytes -= self.record_size(record)
+        self._not_full.notify()
+        if not self._records:
+            self._first_queued_at = None
+        return record
+
+    def put(self, record):
+        """
+        Add a record to the queue, applying the overflow policy if it is full.
+
+        :return: True if the record was queued, False if it was dropped or spilled.
+        :rtype: bool
+        """
+        size = self.record_size(record)
+        with self._lock:
+            if self._fits(size):
+                self._push(record, size)
+                return True
+
+            if self.overflow_policy == DROP_OLDEST:
+                while not self._fits(size):
+                    self._pop()
+                    self.dropped += 1
+                self._push(record, size)
+                return True
+
+            if self.overflow_policy == BLOCK:
+                deadline = time.monotonic() + self.block_timeout
+                while not self._fits(size):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.closed:
+                        break
+                    self._not_full.wait(remaining)
+                else:
+                    self._push(record, size)
+                    return True
+
+            if self.overflow_policy != SPILL:
+                self.dropped += 1
+                return False
+
+        # Spill outside of the lock, writing to disk should not stall consumers
+        try:
+            self.spill_handler([record])
+        except Exception:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.spilled += 1
+        return False
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return the oldest record. Mirrors `queue.Queue.get`.
+
+        :raises queue.Empty: if no record is available.
+        """
+        with self._not_empty:
+            if block and timeout is None:
+                while not self._records:
+                    self._not_empty.wait()
+            elif block:
+                deadline = time.monotonic() + timeout
+                while not self._records:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            elif not self._records:
+                raise queue.Empty
+            return self._pop()
+
+    def get_up_to(self, max_size=None):
+        """
+        Remove and return the oldest record if its size is at most `max_size`, without blocking.
+
+        :return: The record, or None if it is bigger than `max_size` (it is left in the queue).
+        :raises queue.Empty: if the queue is empty.
+        """
+        with self._lock:
+            if not self._records:
+                raise queue.Empty
+            if max_size is not None and self.record_size(self._records[0]) > max_size:
+                return None
+            return self._pop()
+
+    def wait_for_batch(self, max_bytes, max_records=None, linger=0, idle_timeout=None):
+        """
+        Block until a batch is ready to be sent, without polling.
+
+        A batch is ready as soon as the queued records reach `max_bytes` or `max_records`, or once the
+        oldest record has waited `linger` seconds. Waiting stops right away once the queue is closed.
+
+        :param idle_timeout: Maximum time to wait for a first record when the queue is empty.
+        :return: True if records are ready, False if the queue stayed empty.
+        :rtype: bool
+        """
+
+        def batch_full():
+            return self._bytes >= max_bytes or (max_records is not None and len(self._records) >= max_records)
+
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._records or self.closed, idle_timeout):
+                return False
+            while self._records and not batch_full() and not self.closed:
+                remaining = self._first_queued_at + linger - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+            return bool(self._records)
+
+    def close(self):
+        """
+        Wake up every consumer waiting for a batch and every producer waiting for room. The queue
+        still accepts records, but nobody waits on it anymore.
+        """
+        with self._lock:
+            self.closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def drain(self):
+        """
+        Remove and return every queued record.
+
+        :rtype: list
+        """
+        with self._lock:
+            records = list(self._records)
+            self._records.clear()
+            self._bytes = 0
+            self._first_queued_at = None
+            self._not_full.notify_all()
+            return records
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        with self._lock:
+            return not self._records
+
+    def qsize(self):
+        with self._lock:
+            return len(self._records)
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return self._bytes
@@ -1,16 +1,117 @@
-import hashlib
+import atexit
 import json
 import logging
 import logging.config
+import os
+import queue
+import threading
 import time
 
-import jwt
 import requests
 from flask import g, request
 
+from .audit_metrics import PipelineMetrics
+from .audit_queue import (
+    DEFAULT_MAX_QUEUE_BYTES,
+    DEFAULT_MAX_QUEUE_RECORDS,
+    DROP_NEWEST,
+    AuditQueue,
+)
+from .body_capture import (
+    DEFAULT_DENIED_CONTENT_TYPES,
+    DEFAULT_MAX_BODY_BYTES,
+    BodyCapture,
+    CapturedBody,
+)
+from .claims import (
+    DEFAULT_CLAIMS_CACHE_SIZE,
+    DEFAULT_CLAIMS_CACHE_TTL,
+    ClaimsCache,
+    decode_unverified,
+)
+from .collector import CollectorClient
 from .logger import get_stdout_logger
+from .record_encoder import RecordEncoder, environ_headers
+from .redaction import DEFAULT_SCRUB_HEADERS, Redactor, sha_hash
+from .sampling import SamplingPolicy
+from .sender import FiretailSender
 
 DEFAULT_LOG_ENDPOINT = "https://api.logging.eu-west-1.prod.firetail.app/logs/bulk"
+# Estimated size of the headers and other fields of a captured exchange, on top of its bodies
+EXCHANGE_OVERHEAD_BYTES = 1024
+
+
+def flask_route(request):
+    return request.url_rule.rule if request.url_rule is not None else request.path
+
+
+class CapturedExchange:
+    """
+    Raw snapshot of a request/response pair, taken on the request thread.
+
+    Only references and cheap copies are stored here; decoding, scrubbing and
+    serialization happen later in `cloud_logger.build_payload`. Bodies are
+    `CapturedBody` instances, plain bytes are wrapped as fully captured bodies.
+    Headers are mappings or lists of (name, value) pairs.
+    """
+
+    def __init__(
+        self,
+        uri,
+        resource,
+        method,
+        request_headers,
+        request_body,
+        status_code,
+        response_headers,
+        response_body,
+        ip=None,
+        http_protocol="HTTP/1.1",
+        authorization=None,
+        diff=-1,
+    ):
+        self.date_created = int(time.time() * 1000)
+        self.execution_time = diff
+        self.http_protocol = http_protocol
+        self.uri = uri
+        self.resource = resource
+        self.method = method
+        self.ip = ip
+        self.request_headers = request_headers
+        self.authorization = authorization
+        self.request_body = request_body if isinstance(request_body, CapturedBody) else CapturedBody(request_body)
+        self.status_code = status_code
+        self.response_headers = response_headers
+        self.response_body = response_body if isinstance(response_body, CapturedBody) else CapturedBody(response_body)
+
+    @classmethod
+    def from_flask(cls, request, response, diff=-1, body_capture=None):
+        if body_capture is None:
+            body_capture = BodyCapture()
+        return cls(
+            uri=request.url,
+            resource=flask_route(request),
+            method=request.method,
+            request_headers=environ_headers(request.environ),
+            request_body=body_capture.flask_request(request),
+            status_code=response.status_code,
+            response_headers=response.headers.to_wsgi_list(),
+            response_body=body_capture.flask_response(response),
+            ip=request.remote_addr,
+            http_protocol=request.environ.get("SERVER_PROTOCOL", "HTTP/1.1"),
+            authorization=request.headers.get("Authorization"),
+            diff=diff,
+        )
+
+
+class CaptureQueue(AuditQueue):
+    """
+    Bounded queue of the exchanges waiting for the capture workers, sized by their captured bodies.
+    """
+
+    @staticmethod
+    def record_size(exchange):
+        return len(exchange.request_body.data) + len(exchange.response_body.data) + EXCHANGE_OVERHEAD_BYTES
 
 
 class cloud_logger(object):
@@ -26,16 +127,28 @@ class cloud_logger(object):
         number_of_retries=4,
         retry_timeout=2,
         logs_drain_timeout=5,
-        scrub_headers=[
-            "set-cookie",
-            "cookie",
-            "authorization",
-            "x-api-key",
-            "token",
-            "api-token",
-            "api-key",
-        ],
+        scrub_headers=list(DEFAULT_SCRUB_HEADERS),
         enrich_oauth=True,
+        background_capture=False,
+        capture_workers=2,
+        use_logging_handler=False,
+        sender_options=None,
+        max_request_body_bytes=DEFAULT_MAX_BODY_BYTES,
+        max_response_body_bytes=DEFAULT_MAX_BODY_BYTES,
+        allowed_content_types=None,
+        denied_content_types=DEFAULT_DENIED_CONTENT_TYPES,
+        sample_rate=1.0,
+        route_sample_rates=None,
+        method_sample_rates=None,
+        keep_errors=True,
+        max_records_per_second=None,
+        redact_body_paths=None,
+        redact_body_patterns=None,
+        oauth_claims=None,
+        oauth_cache_size=DEFAULT_CLAIMS_CACHE_SIZE,
+        oauth_cache_ttl=DEFAULT_CLAIMS_CACHE_TTL,
+        metrics=None,
+        collector_socket=None,
     ):
         self.startThread = True
         self.custom_backend = custom_backend
@@ -43,6 +156,7 @@ class cloud_logger(object):
         self.url = url
         self.token = token
         self.logs_drain_timeout = logs_drain_timeout
+        self.debug = debug
         self.stdout_logger = get_stdout_logger(debug)
         self.backup_logs = backup_logs
         self.network_timeout = network_timeout
@@ -51,8 +165,49 @@ class cloud_logger(object):
         self.retry_timeout = retry_timeout
         self.oauth = False
         self.logger = None
+        self.sender = None
+        self.use_logging_handler = use_logging_handler
+        self.sender_options = sender_options or {}
+        # Records are sent to the collector of the host instead of being uploaded by this process
+        self.collector_socket = collector_socket
         self.enrich_oauth = enrich_oauth
+        self.oauth_claims = list(oauth_claims or [])
+        self.claims_cache = ClaimsCache(
+            claims=["sub"] + self.oauth_claims, max_size=oauth_cache_size, ttl=oauth_cache_ttl, decode=self.decode_token
+        )
         self.scrub_headers = scrub_headers
+        self.redact_body_paths = redact_body_paths
+        self.redact_body_patterns = redact_body_patterns
+        self.redactor = Redactor(scrub_headers, redact_body_paths, redact_body_patterns)
+        self.encoder = RecordEncoder(self.redactor)
+        self.background_capture = background_capture
+        self.capture_workers = capture_workers
+        self.body_capture = BodyCapture(
+            max_request_body_bytes=max_request_body_bytes,
+            max_response_body_bytes=max_response_body_bytes,
+            allowed_content_types=allowed_content_types,
+            denied_content_types=denied_content_types,
+            # JSON paths are redacted in the whole document, before it is cut to its cap
+            whole_json_bodies=bool(redact_body_paths),
+        )
+        self.sampling = SamplingPolicy(
+            sample_rate=sample_rate,
+            route_rates=route_sample_rates,
+            method_rates=method_sample_rates,
+            keep_errors=keep_errors,
+            max_records_per_second=max_records_per_second,
+        )
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.metrics.counter(
+            "records_sampled_out", lambda: self.sampling.sampled_out, "Requests left out by the sample rates."
+        )
+        self.metrics.counter(
+            "records_rate_limited", lambda: self.sampling.rate_limited, "Requests left out by the rate limit."
+        )
+        self._capture_queue = None
+        self._capture_threads = []
+        self._capture_pid = None
+        self._logger_lock = threading.Lock()
         self.LOGGING = {
             "version": 1,
             "disable_existing_loggers": False,
@@ -73,6 +228,7 @@ class cloud_logger(object):
                     "url": self.url,
                     "retries_no": 4,
                     "retry_timeout": 2,
+                    **self.sender_options,
                 }
             },
             "loggers": {"": {"level": "DEBUG", "handlers": ["firetail"], "propagate": True}},
@@ -91,87 +247,226 @@ class cloud_logger(object):
 
     @staticmethod
     def sha_hash(value):
-        hash_object = hashlib.sha256(value.encode("utf-8"))
-        return "sha256:" + hash_object.hexdigest()
+        return sha_hash(value)
 
     @staticmethod
     def decode_token(auth_token):
-        return jwt.decode(
-            auth_token.encode(),
-            options={"verify_signature": False, "verify_exp": False},
-        )
+        return decode_unverified(auth_token)
 
-    def clean_pii(self, payload):
-        oauth = False
-        auth_token = None
+    def oauth_enrichment(self, auth_header):
+        """
+        OAuth section of the record for a bearer token, None if there is nothing to enrich it with.
+        """
+        if not (self.enrich_oauth and auth_header and auth_header[:7].lower() == "bearer "):
+            return None
+        auth_token = auth_header[7:].strip()
+        claims = self.claims_cache.get(auth_token) if auth_token else None
+        if not claims:
+            return None
+        oauth = {"subject": claims["sub"]} if "sub" in claims else {}
+        for name in self.oauth_claims:
+            if name in claims:
+                oauth[name] = claims[name]
+        return oauth
 
-        if auth_header := request.headers.get("Authorization", request.headers.get("authorization")):
+    def clean_pii(self, payload, auth_header=None):
+        if auth_header is None:
+            # Werkzeug headers are case-insensitive
+            auth_header = request.headers.get("Authorization")
 
-            if "bearer " in auth_header.lower():
-                oauth = True
-                auth_token = auth_header.split(" ")[1] if " " in auth_header else None
+        redactor = self.redactor
+        redactor.redact_headers(payload["request"].get("headers", {}))
+        redactor.redact_headers(payload["response"].get("headers", {}))
 
-        for k, v in payload["request"].get("headers", {}).items():
-            if k.lower() in self.scrub_headers:
-                payload["request"]["headers"][k] = ["{SANITIZED_HEADER:" + self.sha_hash(item) + "}" for item in v]
-
-        for k, v in payload["response"].get("headers", {}).items():
-            if k.lower() in self.scrub_headers:
-
-                payload["response"]["headers"][k] = ["{SANITIZED_HEADER:" + self.sha_hash(item) + "}" for item in v]
-        if auth_token not in [None, ""] and oauth and self.enrich_oauth:
-            try:
-                jwt_decoded = self.decode_token(auth_token)
-                payload["oauth"] = {"subject": jwt_decoded["sub"]}
-            except jwt.exceptions.DecodeError:
-                pass
+        oauth = self.oauth_enrichment(auth_header)
+        if oauth is not None:
+            payload["oauth"] = oauth
         return payload
 
     def format_headers(self, req_headers):
         result = {}
-        for x, y in req_headers.items():
-            result[x] = [y]
+        for x, y in req_headers.items() if hasattr(req_headers, "items") else req_headers:
+            result.setdefault(x, []).append(y)
         return result
 
+    def _ensure_sink(self, token):
+        with self._logger_lock:
+            if self.use_logging_handler:
+                # Legacy path: records go through the stdlib logging machinery
+                # and the FiretailHandler installed on the root logger.
+                if not self.logger:
+                    self.LOGGING["handlers"]["firetail"]["token"] = token
+                    self.LOGGING["handlers"]["firetail"]["metrics"] = self.metrics
+                    logging.config.dictConfig(self.LOGGING)
+                    self.logger = logging.getLogger("firetailLogger")
+            elif self.sender is None and self.collector_socket:
+                self.sender = CollectorClient(self.collector_socket, debug=self.debug, metrics=self.metrics)
+            elif self.sender is None:
+                self.sender = FiretailSender(
+                    token=token,
+                    url=self.url,
+                    logs_drain_timeout=self.logs_drain_timeout,
+                    debug=self.debug,
+                    backup_logs=self.backup_logs,
+                    network_timeout=self.network_timeout,
+                    number_of_retries=self.number_of_retries,
+                    retry_timeout=self.retry_timeout,
+                    metrics=self.metrics,
+                    **self.sender_options,
+                )
+
+    def _get_capture_queue(self):
+        with self._logger_lock:
+            # Capture workers do not survive a fork, a forked child starts its own
+            if self._capture_queue is None or self._capture_pid != os.getpid():
+                # Bounded like the sender queue, with the same overflow policy. Exchanges cannot be
+                # spilled before they are encoded, so the spill policy processes them right away.
+                options = self.sender_options
+                capture_queue = CaptureQueue(
+                    max_bytes=options.get("max_queue_bytes", DEFAULT_MAX_QUEUE_BYTES),
+                    max_records=options.get("max_queue_records", DEFAULT_MAX_QUEUE_RECORDS),
+                    overflow_policy=options.get("overflow_policy", DROP_NEWEST),
+                    block_timeout=options.get("queue_block_timeout", 1.0),
+                    spill_handler=self._capture_inline,
+                )
+                if self._capture_queue is None:
+                    self.metrics.counter(
+                        "captures_dropped",
+                        lambda: self._capture_queue.dropped,
+                        "Captured requests dropped by the full capture queue.",
+                    )
+                    atexit.register(self.close_captures, self.logs_drain_timeout)
+                self._capture_queue = capture_queue
+                self._capture_pid = os.getpid()
+                self._capture_threads = []
+                for index in range(max(self.capture_workers, 1)):
+                    thread = threading.Thread(
+                        target=self._capture_loop,
+                        args=(capture_queue,),
+                        name="firetail-capture-{}".format(index),
+                        daemon=True,
+                    )
+                    thread.start()
+                    self._capture_threads.append(thread)
+            return self._capture_queue
+
+    def _capture_loop(self, capture_queue):
+        # Runs until the queue is closed and every exchange left in it is processed
+        while capture_queue.wait_for_batch(1):
+            try:
+                exchange = capture_queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._process_in_background(exchange)
+
+    def _capture_inline(self, exchanges):
+        for exchange in exchanges:
+            self._process_in_background(exchange)
+
+    def close_captures(self, timeout=None):
+        """
+        Process the exchanges still waiting for the capture workers, then stop the workers.
+
+        :param timeout: Maximum number of seconds to wait for the workers, None to wait until they are done.
+        :type timeout: float | None
+        :return: True if every captured exchange was processed.
+        :rtype: bool
+        """
+        if self._capture_queue is None or self._capture_pid != os.getpid():
+            return True
+        self._capture_queue.close()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._capture_threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not any(thread.is_alive() for thread in self._capture_threads)
+
     def create(self, response, token, diff=-1, scrub_headers=None, debug=False):
+        """
+        Capture the current Flask request and its response as an audit record.
+
+        :return: The record as it is shipped: the payload dictionary when `use_logging_handler` is
+            set, the encoded JSON otherwise. None when the request is sampled out, when there is no
+            token or sink to ship the record to, and with `background_capture`, where the record is
+            built later by the capture workers.
+        :rtype: dict | bytes | None
+        """
         if debug:
             self.stdout_logger = get_stdout_logger(True)
-        if scrub_headers and isinstance(scrub_headers, list):
+        if scrub_headers and isinstance(scrub_headers, list) and scrub_headers != self.scrub_headers:
             self.scrub_headers = scrub_headers
+            self.redactor = Redactor(scrub_headers, self.redact_body_paths, self.redact_body_patterns)
+            self.encoder = RecordEncoder(self.redactor)
         self.token = token
-        if not self.logger:
-            self.LOGGING["handlers"]["firetail"]["token"] = token
-            logging.config.dictConfig(self.LOGGING)
-            self.logger = logging.getLogger("firetailLogger")
-        try:
-            response_data = response.get_data(as_text=True)
-        except Exception:
-            response_data = ""
-        payload = {
+        if not self.sampling.should_sample(request.method, flask_route(request), response.status_code):
+            return None
+        self._ensure_sink(token)
+        exchange = CapturedExchange.from_flask(request, response, diff, self.body_capture)
+        if self.background_capture:
+            capture_queue = self._get_capture_queue()
+            if not capture_queue.closed:
+                # Only the snapshot above runs on the request thread, the rest is done by the
+                # capture workers so the response is not held back.
+                capture_queue.put(exchange)
+                return None
+        return self.process(exchange)
+
+    def build_payload(self, exchange):
+        """
+        Audit record of an exchange, with its bodies already redacted since they must be redacted
+        before they are cut to their cap. Headers are scrubbed by `clean_pii`.
+
+        :type exchange: CapturedExchange
+        :rtype: dict
+        """
+        redact_body = self.redactor.redact_body
+        return {
             "version": "1.0.0-alpha",
-            "dateCreated": int(time.time() * 1000),
-            "executionTime": diff,
+            "dateCreated": exchange.date_created,
+            "executionTime": exchange.execution_time,
             "request": {
-                "httpProtocol": request.environ.get("SERVER_PROTOCOL", "HTTP/1.1"),
-                "uri": request.url,
-                "headers": self.format_headers(dict(request.headers)),
-                "resource": request.url_rule.rule if request.url_rule is not None else request.path,
-                "method": request.method,
-                "body": request.get_data(as_text=True),
-                "ip": request.remote_addr,
+                "httpProtocol": exchange.http_protocol,
+                "uri": exchange.uri,
+                "headers": self.format_headers(exchange.request_headers),
+                "resource": exchange.resource,
+                "method": exchange.method,
+                "body": exchange.request_body.render(redact=redact_body),
+                "ip": exchange.ip,
             },
             "response": {
-                "statusCode": response.status_code,
-                "body": response_data,
-                "headers": self.format_headers(dict(response.headers)),
+                "statusCode": exchange.status_code,
+                "body": exchange.response_body.render(strict=True, redact=redact_body),
+                "headers": self.format_headers(exchange.response_headers),
             },
         }
+
+    def encode(self, exchange):
+        """
+        Scrubbed audit record of an exchange, encoded as JSON.
+
+        :type exchange: CapturedExchange
+        :rtype: bytes
+        """
+        return self.encoder.encode(exchange, self.oauth_enrichment(exchange.authorization))
+
+    def process(self, exchange):
+        if not (self.token or self.custom_backend or self.collector_socket or self.sender_options.get("sink")):
+            return None
         try:
-            if self.token or self.custom_backend:
-                self.logger.info(json.dumps(self.clean_pii(payload)))
+            if self.use_logging_handler:
+                payload = self.clean_pii(self.build_payload(exchange), exchange.authorization or "")
+                self.logger.info(json.dumps(payload))
+                return payload
+            record = self.encode(exchange)
+            self.sender.append_encoded(record)
+            return record
         except TypeError:
             pass
-        return payload
+
+    def _process_in_background(self, exchange):
+        try:
+            return self.process(exchange)
+        except Exception as e:
+            self.stdout_logger.debug("Unexpected exception while capturing audit record, swallowing. Exception: %s", e)
 
 
 def make_after_request_function(cl, token):
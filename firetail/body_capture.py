@@ -0,0 +1,281 @@
+"""
+This module defines how much of the request and response bodies ends up in audit records.
+"""
+
+import json
+
+from .json_stream import STREAMED_JSON_KEY
+
+DEFAULT_MAX_BODY_BYTES = 64 * 1024  # 64 KB
+
+# Binary and multipart payloads are never worth auditing verbatim.
+DEFAULT_DENIED_CONTENT_TYPES = (
+    "application/octet-stream",
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "multipart/",
+    "image/",
+    "audio/",
+    "video/",
+    "font/",
+)
+
+
+def _media_type(content_type):
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def _is_json(content_type):
+    media_type = _media_type(content_type)
+    return media_type == "application/json" or (media_type.startswith("application/") and media_type.endswith("+json"))
+
+
+class CapturedBody:
+    """
+    A body, as much of it as was captured.
+
+    :param data: Captured bytes, at most the configured cap unless `limit` is set.
+    :param size: Size of the full body, None when it is not known.
+    :param truncated: Whether `data` is only the beginning of the body.
+    :param omitted: Reason the body was not captured at all, None if it was.
+    :param limit: Cap of a body kept whole so that it is redacted before being cut, applied when rendered.
+    """
+
+    def __init__(self, data=b"", size=None, truncated=False, omitted=None, limit=None):
+        self.data = data
+        self.size = len(data) if size is None and not truncated else size
+        self.truncated = truncated
+        self.omitted = omitted
+        self.limit = limit
+
+    def render(self, strict=False, redact=None):
+        """
+        Text of the body for the audit record, with a marker if it was truncated or omitted.
+
+        :param strict: Render undecodable bodies as an empty string instead of replacing invalid bytes.
+        :param redact: Scrubs the text of the body, before it is cut to its `limit`.
+        :type redact: types.FunctionType | None
+        :rtype: str
+        """
+        if self.omitted:
+            return "{OMITTED_BODY:" + self.omitted + "}"
+        try:
+            # A truncated body may be cut in the middle of a multi-byte character
+            text = self.data.decode("utf-8", "strict" if strict and not self.truncated else "replace")
+        except UnicodeDecodeError:
+            return ""
+        if redact is not None:
+            text = redact(text)
+            if text.startswith("{OMITTED_BODY:"):
+                # Left out by the redaction, there is nothing left to cut
+                return text
+        truncated = self.truncated
+        if self.limit is not None and len(self.data) > self.limit:
+            encoded = text.encode("utf-8")
+            if len(encoded) > self.limit:
+                text = encoded[: self.limit].decode("utf-8", "ignore")
+                truncated = True
+        if truncated:
+            text += "{TRUNCATED_BODY:" + (str(self.size) if self.size is not None else "unknown") + " bytes}"
+        return text
+
+
+class BodyCapture:
+    """
+    Per-direction body caps and content-type allow/deny lists.
+
+    Content types are matched case-insensitively by prefix, so "image/" covers every image type. A
+    body is captured if its content type is in `allowed_content_types` (any type when None) and not
+    in `denied_content_types`.
+
+    With `whole_json_bodies`, JSON bodies are kept whole and only cut to their cap when rendered, so
+    that JSON-path redaction sees the complete document.
+    """
+
+    def __init__(
+        self,
+        max_request_body_bytes=DEFAULT_MAX_BODY_BYTES,
+        max_response_body_bytes=DEFAULT_MAX_BODY_BYTES,
+        allowed_content_types=None,
+        denied_content_types=DEFAULT_DENIED_CONTENT_TYPES,
+        whole_json_bodies=False,
+    ):
+        """
+        :param max_request_body_bytes: Bytes of request body kept, None for no limit.
+        :type max_request_body_bytes: int | None
+        :param max_response_body_bytes: Bytes of response body kept, None for no limit.
+        :type max_response_body_bytes: int | None
+        :type allowed_content_types: list[str] | None
+        :type denied_content_types: list[str] | None
+        :param whole_json_bodies: Keep JSON bodies whole until they are redacted, then cut them to their cap.
+        :type whole_json_bodies: bool
+        """
+        self.max_request_body_bytes = max_request_body_bytes
+        self.max_response_body_bytes = max_response_body_bytes
+        self.allowed_content_types = (
+            tuple(t.lower() for t in allowed_content_types) if allowed_content_types is not None else None
+        )
+        self.denied_content_types = tuple(t.lower() for t in denied_content_types or ())
+        self.whole_json_bodies = whole_json_bodies
+
+    def allows(self, content_type):
+        media_type = _media_type(content_type)
+        if self.allowed_content_types is not None and not media_type.startswith(self.allowed_content_types):
+            return False
+        return not (media_type and media_type.startswith(self.denied_content_types))
+
+    def omit_reason(self, content_type):
+        """
+        :return: The reason a body of this content type is omitted, None if it is captured.
+        :rtype: str | None
+        """
+        if self.allows(content_type):
+            return None
+        return _media_type(content_type) or "unknown content type"
+
+    def keeps_whole(self, content_type):
+        """
+        :return: Whether a body of this content type is kept whole, to be cut once redacted.
+        :rtype: bool
+        """
+        return self.whole_json_bodies and _is_json(content_type)
+
+    @staticmethod
+    def clip(data, limit, size=None, whole=False):
+        """
+        :param size: Size of the full body, when `data` may already have been cut short.
+        :param whole: Keep the body whole, the limit is then applied when it is rendered.
+        :rtype: CapturedBody
+        """
+        data = bytes(data)
+        if size is None:
+            size = len(data)
+        if whole:
+            return CapturedBody(data, size, limit=limit)
+        if limit is not None and size > limit:
+            return CapturedBody(data[:limit], size, truncated=True)
+        return CapturedBody(data, size)
+
+    def flask_request(self, request):
+        """
+        :rtype: CapturedBody
+        """
+        omitted = self.omit_reason(request.content_type)
+        if omitted:
+            return CapturedBody(size=request.content_length, omitted=omitted)
+        limit = self.max_request_body_bytes
+        whole = self.keeps_whole(request.content_type)
+        if STREAMED_JSON_KEY in request.environ:
+            # Parsed while it was validated, which consumed the stream
+            data = json.dumps(request.environ[STREAMED_JSON_KEY]).encode("utf-8")
+        else:
+            # The view may already have buffered the body, in which case the stream is exhausted
+            data = getattr(request, "_cached_data", None)
+        if data is None:
+            if limit is None or whole:
+                data = request.get_data()
+            else:
+                # Read one byte more than the cap, to know whether the body was truncated
+                data = request.stream.read(limit + 1)
+                if len(data) > limit:
+                    return CapturedBody(data[:limit], request.content_length, truncated=True)
+        return self.clip(data, limit, whole=whole)
+
+    def flask_response(self, response):
+        """
+        :rtype: CapturedBody
+        """
+        omitted = self.omit_reason(response.content_type)
+        if omitted:
+            return CapturedBody(size=response.content_length, omitted=omitted)
+        if response.is_streamed or response.direct_passthrough:
+            # Buffering the body would consume the stream before it is sent
+            return CapturedBody(size=response.content_length, omitted="streamed")
+        try:
+            data = response.get_data()
+        except Exception:
+            data = b""
+        return self.clip(data, self.max_response_body_bytes, whole=self.keeps_whole(response.content_type))
+
+    async def aiohttp_request(self, request):
+        """
+        :rtype: CapturedBody
+        """
+        if not request.body_exists:
+            return CapturedBody()
+        # `content_type` defaults to application/octet-stream when the header is missing
+        omitted = self.omit_reason(request.headers.get("Content-Type"))
+        if omitted:
+            return CapturedBody(size=request.content_length, omitted=omitted)
+        limit = self.max_request_body_bytes
+        whole = self.keeps_whole(request.headers.get("Content-Type"))
+        if STREAMED_JSON_KEY in request:
+            # Parsed while it was validated, which consumed the payload
+            data = json.dumps(request[STREAMED_JSON_KEY]).encode("utf-8")
+        else:
+            # The handler may already have read the body, in which case the payload is exhausted
+            data = getattr(request, "_read_bytes", None)
+        if data is None:
+            if limit is None or whole:
+                data = await request.read()
+            else:
+                data = b""
+                while len(data) <= limit:
+                    chunk = await request.content.read(limit + 1 - len(data))
+                    if not chunk:
+                        break
+                    data += chunk
+                if len(data) > limit:
+                    return CapturedBody(data[:limit], request.content_length, truncated=True)
+        return self.clip(data, limit, whole=whole)
+
+    def aiohttp_response(self, response):
+        """
+        :rtype: CapturedBody
+        """
+        omitted = self.omit_reason(response.headers.get("Content-Type"))
+        if omitted:
+            return CapturedBody(size=response.content_length, omitted=omitted)
+        data = getattr(response, "body", None)
+        if not isinstance(data, (bytes, bytearray)):
+            # Streamed responses have no body to capture
+            return CapturedBody(size=response.content_length, omitted="streamed")
+        return self.clip(
+            data, self.max_response_body_bytes, whole=self.keeps_whole(response.headers.get("Content-Type"))
+        )
+
+
+class BodyRecorder:
+    """
+    Accumulates a body sent in chunks, keeping no more than `limit` bytes of it, unless it is kept
+    `whole` to be cut once redacted.
+    """
+
+    def __init__(self, limit, omitted=None, whole=False):
+        self.limit = limit
+        self.omitted = omitted
+        self.whole = whole
+        self.chunks = []
+        self.size = 0
+        self.kept = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.omitted:
+            return
+        if self.limit is not None and not self.whole:
+            chunk = chunk[: self.limit - self.kept]
+        if chunk:
+            self.chunks.append(chunk)
+            self.kept += len(chunk)
+
+    def body(self):
+        """
+        :rtype: CapturedBody
+        """
+        if self.omitted:
+            return CapturedBody(size=self.size, omitted=self.omitted)
+        if self.whole:
+            return CapturedBody(b"".join(self.chunks), self.size, limit=self.limit)
+        return CapturedBody(b"".join(self.chunks), self.size, truncated=self.kept < self.size)
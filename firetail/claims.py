@@ -0,0 +1,92 @@
+"""
+This module defines the cache of claims extracted from bearer tokens, used to enrich audit records.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+DEFAULT_CLAIMS_CACHE_SIZE = 1024
+DEFAULT_CLAIMS_CACHE_TTL = 300  # 5 minutes
+
+
+def decode_unverified(token):
+    return jwt.decode(token.encode(), options={"verify_signature": False, "verify_exp": False})
+
+
+class ClaimsCache:
+    """
+    Bounded LRU cache of the claims of bearer tokens, keyed by the SHA-256 digest of the token.
+
+    Tokens are reused for their whole lifetime, so they are decoded once and their claims kept for
+    `ttl` seconds, or until the token expires if that is sooner. Expired tokens are still decoded,
+    but never cached. Tokens that cannot be decoded are cached too, as having no claims.
+    """
+
+    def __init__(self, claims=("sub",), max_size=DEFAULT_CLAIMS_CACHE_SIZE, ttl=DEFAULT_CLAIMS_CACHE_TTL, decode=None):
+        """
+        :param claims: Names of the claims extracted from the tokens.
+        :type claims: list[str]
+        :param max_size: Maximum number of tokens cached.
+        :type max_size: int
+        :param ttl: Maximum number of seconds the claims of a token are cached.
+        :type ttl: float
+        :param decode: Function decoding a token into its claims, without verifying it.
+        """
+        self.claims = tuple(claims)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.decode = decode or decode_unverified
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        Claims of a token, limited to the configured ones.
+
+        :rtype: dict | None
+        :return: None if the token cannot be decoded.
+        """
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+
+        expires_at = now + self.ttl
+        try:
+            decoded = self.decode(token)
+        except jwt.exceptions.DecodeError:
+            claims = None
+        else:
+            claims = {name: decoded[name] for name in self.claims if name in decoded}
+            exp = decoded.get("exp")
+            if isinstance(exp, (int, float)):
+                expires_at = min(expires_at, exp)
+
+        if expires_at > now:
+            with self._lock:
+                self._entries[key] = (claims, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
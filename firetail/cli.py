@@ -4,6 +4,7 @@ starting point for developing your API with Firetail.
 """
 
 import logging
+import signal
 import sys
 from os import path
 
@@ -11,7 +12,11 @@ import click
 from clickclick import AliasedGroup, fatal_error
 
 import firetail
+from firetail.auditor import DEFAULT_LOG_ENDPOINT
+from firetail.collector import DEFAULT_COLLECTOR_SOCKET, Collector
+from firetail.compression import available_encodings
 from firetail.mock import MockResolver
+from firetail.sender import MAX_BULK_SIZE_IN_BYTES, FiretailSender
 
 logger = logging.getLogger("firetail.cli")
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -218,5 +223,78 @@ def run(
     app.run(port=port, host=host, server=server, debug=debug)
 
 
+@main.command()
+@click.option(
+    "--socket", "socket_path", default=DEFAULT_COLLECTOR_SOCKET, metavar="PATH", help="Unix socket to listen on."
+)
+@click.option(
+    "--socket-mode",
+    default="660",
+    metavar="MODE",
+    help="Octal permissions of the socket, deciding which users can send records.",
+)
+@click.option("--token", envvar="FIRETAIL_API_TOKEN", help="FireTail API token, defaults to $FIRETAIL_API_TOKEN.")
+@click.option("--url", default=DEFAULT_LOG_ENDPOINT, metavar="URL", help="Endpoint the records are uploaded to.")
+@click.option("--compression", type=click.Choice(sorted(available_encodings())), help="Compression of the batches.")
+@click.option("--max-batch-bytes", default=MAX_BULK_SIZE_IN_BYTES, type=int, help="Maximum size of a batch.")
+@click.option("--upload-workers", default=1, type=int, help="Number of batches uploaded at once.")
+@click.option("--flush-linger", default=5.0, type=float, help="Seconds a partial batch waits for more records.")
+@click.option("--drain-timeout", default=10.0, type=float, help="Seconds given to send queued records on exit.")
+@click.option("--spill-directory", metavar="PATH", help="Directory batches that could not be sent are spilled to.")
+@click.option("--verbose", "-v", help="Show verbose information.", count=True)
+def collector(
+    socket_path,
+    socket_mode,
+    token,
+    url,
+    compression,
+    max_batch_bytes,
+    upload_workers,
+    flush_linger,
+    drain_timeout,
+    spill_directory,
+    verbose,
+):
+    """
+    Runs the collector of the audit records of every app on this host.
+
+    Apps send their records to the collector's socket when created with the ``collector_socket``
+    option, and the collector batches, compresses and uploads them over a single pipeline.
+    """
+    if not token:
+        raise click.UsageError("a FireTail API token is required, use --token or $FIRETAIL_API_TOKEN")
+    try:
+        mode = int(socket_mode, 8)
+    except ValueError:
+        raise click.BadParameter("must be an octal mode, e.g. 660", param_hint="'socket-mode'")
+
+    logging.basicConfig(level=logging.DEBUG if verbose > 1 else logging.INFO if verbose else logging.WARN)
+
+    sender_options = {"spill_directory": spill_directory} if spill_directory else {}
+    sender = FiretailSender(
+        token=token,
+        url=url,
+        debug=verbose > 1,
+        compression=compression,
+        max_batch_bytes=max_batch_bytes,
+        upload_workers=upload_workers,
+        flush_linger=flush_linger,
+        logs_drain_timeout=drain_timeout,
+        **sender_options,
+    )
+    server = Collector(sender, socket_path=socket_path, socket_mode=mode)
+    server.bind()
+    # Interrupt the server on SIGTERM as on Ctrl-C, to send the queued records before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info(f"Collecting audit records on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass
+    finally:
+        if not server.close(drain_timeout):
+            logger.warning("Some audit records could not be sent before exiting")
+
+
 if __name__ == "__main__":  # pragma: no cover
     main()
@@ -0,0 +1,179 @@
+"""
+This module defines the per-host collector of audit records, and the client app processes use to
+send their records to it.
+
+App processes write each encoded record as one datagram to a Unix socket, without batching, retrying
+or keeping a connection of their own. The collector reads the records of every process on the host
+and hands them to a single `FiretailSender`, which batches, compresses and uploads them.
+"""
+
+import errno
+import os
+import socket
+import stat
+
+from .audit_metrics import PipelineMetrics
+from .logger import get_stdout_logger
+
+DEFAULT_COLLECTOR_SOCKET = "/tmp/firetail-collector.sock"
+# Largest record sent as a datagram, above the 2 * 64 KiB of captured bodies with room for headers.
+# Larger records are dropped by the client, and discarded by the collector if they get through.
+MAX_DATAGRAM_BYTES = 256 * 1024
+# Datagrams queued in the kernel while the collector is busy
+SOCKET_BUFFER_BYTES = 4 * 1024 * 1024
+
+# Errors meaning the collector is not running or cannot keep up, the record is dropped
+_UNAVAILABLE = (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+
+class CollectorClient:
+    """
+    Sends audit records to the collector of the host.
+
+    A drop-in replacement for `FiretailSender`: records are sent as they are appended, so there is no
+    thread, queue or connection to manage, and nothing to reset after a fork. Sends never block, a
+    record is dropped when the collector is not running or its socket buffer is full.
+    """
+
+    def __init__(self, socket_path=DEFAULT_COLLECTOR_SOCKET, debug=False, metrics=None):
+        """
+        :param socket_path: Path of the Unix socket the collector listens on.
+        :type socket_path: str
+        :type metrics: firetail.audit_metrics.PipelineMetrics | None
+        """
+        self.socket_path = socket_path
+        self.stdout_logger = get_stdout_logger(debug)
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.dropped = 0
+        self.metrics.counter("records_dropped", lambda: self.dropped, "Audit records the collector did not take.")
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_DATAGRAM_BYTES * 2)
+        except OSError:  # pragma: no cover
+            pass
+
+    def append(self, logs_message):
+        self.append_encoded(logs_message)
+
+    def append_encoded(self, logs_message):
+        """
+        Send a log record that is already serialized to JSON.
+        """
+        if isinstance(logs_message, str):
+            logs_message = logs_message.encode("utf-8")
+        if len(logs_message) > MAX_DATAGRAM_BYTES:
+            # The socket buffer would take it, but the collector would only read part of it
+            self.dropped += 1
+            self.stdout_logger.debug("Log of %s bytes is too big for the collector, dropped", len(logs_message))
+            return
+        try:
+            self._socket.sendto(logs_message, self.socket_path)
+        except OSError as e:
+            self.dropped += 1
+            if e.errno in _UNAVAILABLE:
+                self.stdout_logger.debug("Collector is unavailable, dropped log (%s dropped so far)", self.dropped)
+            elif e.errno == errno.EMSGSIZE:
+                self.stdout_logger.debug("Log of %s bytes is too big for the collector, dropped", len(logs_message))
+            else:
+                self.stdout_logger.debug("Could not send log to the collector, dropped. Exception: %s", e)
+        else:
+            self.metrics.inc("records_enqueued")
+            self.metrics.inc("bytes_enqueued", len(logs_message))
+
+    @property
+    def dropped_records(self):
+        """Number of records the collector did not take."""
+        return self.dropped
+
+    def flush(self):
+        pass
+
+    def close(self, timeout=None):
+        self._socket.close()
+        return True
+
+
+class Collector:
+    """
+    Reads the audit records app processes send to the Unix socket, and queues them on a sender.
+    """
+
+    def __init__(self, sender, socket_path=DEFAULT_COLLECTOR_SOCKET, socket_mode=0o660):
+        """
+        :param sender: Sender batching and uploading the records of every process.
+        :type sender: firetail.sender.FiretailSender
+        :param socket_path: Path of the Unix socket to listen on, replaced if it exists.
+        :type socket_path: str
+        :param socket_mode: Permissions of the socket, deciding which users can send records.
+        :type socket_mode: int
+        """
+        self.sender = sender
+        self.socket_path = socket_path
+        self.socket_mode = socket_mode
+        self.received = 0
+        self.discarded = 0
+        self._socket = None
+        self._closing = False
+        sender.metrics.counter("records_received", lambda: self.received, "Audit records received from apps.")
+        sender.metrics.counter(
+            "records_discarded", lambda: self.discarded, "Audit records discarded for being too big to be read whole."
+        )
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                raise ValueError("{} exists and is not a socket".format(self.socket_path))
+            # Left behind by a collector that did not exit cleanly
+            os.unlink(self.socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_BYTES)
+        except OSError:  # pragma: no cover
+            pass
+        self._socket.bind(self.socket_path)
+        os.chmod(self.socket_path, self.socket_mode)
+
+    def serve_forever(self):
+        """
+        Queue every record received until `close` is called.
+        """
+        if self._socket is None:
+            self.bind()
+        receive = self._socket.recv
+        append = self.sender.append_encoded
+        while not self._closing:
+            try:
+                # One byte more than the largest record, to tell a record that fits from a cut one
+                record = receive(MAX_DATAGRAM_BYTES + 1)
+            except OSError:
+                if self._closing:
+                    break
+                raise
+            if len(record) > MAX_DATAGRAM_BYTES:
+                self.discarded += 1
+            elif record:
+                self.received += 1
+                append(record)
+
+    def close(self, timeout=None):
+        """
+        Stop receiving records, then send the queued ones within `timeout` seconds.
+
+        :rtype: bool
+        :return: True if every queued record was sent.
+        """
+        self._closing = True
+        if self._socket is not None:
+            # Shutting down wakes up `serve_forever`, closing alone would not
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        return self.sender.close(timeout)
@@ -0,0 +1,112 @@
+"""
+This module defines the content encodings available for bulk log uploads.
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from .exceptions import FiretailException
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+DEFAULT_COMPRESSION_LEVELS = {GZIP: 6, ZSTD: 3}
+
+
+def available_encodings():
+    """Content encodings usable in this environment."""
+    encodings = [GZIP]
+    if zstandard is not None:
+        encodings.append(ZSTD)
+    return encodings
+
+
+class BatchEncoder:
+    """
+    Streams newline delimited records into a request body, compressing them on the fly.
+
+    `size` is an upper bound of the final body length, which lets the sender stop filling a batch
+    once the *compressed* body reaches its size limit.
+    """
+
+    def __init__(self, encoding=None, level=None):
+        """
+        :param encoding: Content-Encoding of the body: None, "gzip" or "zstd".
+        :type encoding: str | None
+        :param level: Compression level, the encoding default when None.
+        :type level: int | None
+        """
+        if encoding is not None and encoding not in (GZIP, ZSTD):
+            raise FiretailException("Unsupported compression {!r}, expected gzip or zstd".format(encoding))
+        if encoding == ZSTD and zstandard is None:
+            raise FiretailException("zstandard must be installed to use zstd compression")
+
+        self.encoding = encoding
+        if level is None and encoding is not None:
+            level = DEFAULT_COMPRESSION_LEVELS[encoding]
+
+        if encoding == GZIP:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == ZSTD:
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._compressor = None
+
+        self._chunks = []
+        self._emitted = 0
+        self._pending = 0
+        self.records = 0
+        self.raw_size = 0
+
+    @property
+    def size(self):
+        # Input still buffered inside the compressor is counted as if it did not
+        # compress at all, so the estimate never undershoots the final size.
+        return self._emitted + self._pending
+
+    def write(self, record):
+        """
+        :param record: Encoded record, without trailing newline.
+        :type record: bytes
+        """
+        data = b"\n" + record if self.records else record
+        self.records += 1
+        self.raw_size += len(data)
+
+        if self._compressor is None:
+            self._chunks.append(data)
+            self._emitted += len(data)
+            return
+
+        chunk = self._compressor.compress(data)
+        if chunk:
+            self._chunks.append(chunk)
+            self._emitted += len(chunk)
+            self._pending = 0
+        else:
+            self._pending += len(data)
+
+    def finish(self):
+        """
+        :return: The complete request body.
+        :rtype: bytes
+        """
+        if self._compressor is not None:
+            self._chunks.append(self._compressor.flush())
+            self._compressor = None
+        return b"".join(self._chunks)
+
+
+def compress(data, encoding=None, level=None):
+    """
+    :return: `data` as a complete body of the given encoding.
+    :rtype: bytes
+    """
+    encoder = BatchEncoder(encoding, level)
+    encoder.write(data)
+    return encoder.finish()
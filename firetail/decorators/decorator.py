@@ -33,9 +33,15 @@ class RequestResponseDecorator(BaseDecorator):
     framework specific object.
     """
 
-    def __init__(self, api, mimetype):
+    def __init__(self, api, mimetype, stream_body=False):
+        """
+        :param stream_body: Ask asynchronous APIs to leave JSON bodies unread, for the body validator to
+            parse them from the stream.
+        :type stream_body: bool
+        """
         self.api = api
         self.mimetype = mimetype
+        self.stream_body = stream_body
 
     def __call__(self, function):
         """
@@ -43,9 +49,13 @@ class RequestResponseDecorator(BaseDecorator):
         :rtype: types.FunctionType
         """
         if has_coroutine(function, self.api):
+            # Only asynchronous APIs read the body when building the request
+            stream_body = self.stream_body and asyncio.iscoroutinefunction(self.api.get_request)
 
             @functools.wraps(function)
             async def wrapper(*args, **kwargs):
+                if stream_body:
+                    kwargs["stream_body"] = True
                 firetail_request = self.api.get_request(*args, **kwargs)
                 while asyncio.iscoroutine(firetail_request):
                     firetail_request = await firetail_request
@@ -21,6 +21,27 @@ from .validation import ResponseBodyValidator
 
 logger = logging.getLogger("firetail.decorators.response")
 
+# Bound on the (status code, content type) pairs compiled per operation, responses are validated
+# without caching beyond it
+MAX_COMPILED_RESPONSES = 256
+
+
+class CompiledResponse:
+    """
+    What a response with a given status code and content type is checked against: its definition,
+    the validator of its body, None if it is not validated, and its required headers.
+    """
+
+    def __init__(self, definition, body_validator, required_headers):
+        """
+        :type definition: dict
+        :type body_validator: ResponseBodyValidator | None
+        :type required_headers: set[str]
+        """
+        self.definition = definition
+        self.body_validator = body_validator
+        self.required_headers = required_headers
+
 
 class ResponseValidator(BaseDecorator):
     def __init__(self, operation, mimetype, validator=None):
@@ -34,6 +55,46 @@ class ResponseValidator(BaseDecorator):
         self.operation = operation
         self.mimetype = mimetype
         self.validator = validator
+        # Compiled responses by (status code, content type), filled as responses are validated
+        self.compiled = {}
+        self.schemas_compiled = False
+
+    def compile_schemas(self):
+        """
+        Validate valid response bodies with compiled schemas, and only invalid ones with jsonschema.
+        """
+        self.schemas_compiled = True
+        self.compiled.clear()
+
+    def compile_response(self, status_code, content_type):
+        """
+        :type status_code: str
+        :type content_type: str
+        :rtype: CompiledResponse
+        """
+        response_definition = self.operation.response_definition(status_code, content_type)
+        response_schema = self.operation.response_schema(status_code, content_type)
+        body_validator = None
+        if self.is_json_schema_compatible(response_schema):
+            body_validator = ResponseBodyValidator(response_schema, validator=self.validator)
+            if self.schemas_compiled:
+                body_validator.compile_schemas()
+        required_headers = set()
+        if response_definition and response_definition.get("headers"):
+            required_headers = {k for (k, v) in response_definition.get("headers").items() if v.get("required", False)}
+        return CompiledResponse(response_definition, body_validator, required_headers)
+
+    def get_compiled_response(self, status_code, content_type):
+        """
+        :rtype: CompiledResponse
+        """
+        key = (status_code, content_type)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            compiled = self.compile_response(status_code, content_type)
+            if len(self.compiled) < MAX_COMPILED_RESPONSES:
+                self.compiled[key] = compiled
+        return compiled
 
     def validate_response(self, data, status_code, headers, url):
         """
@@ -48,22 +109,18 @@ class ResponseValidator(BaseDecorator):
         content_type = headers.get("Content-Type", self.mimetype)
         content_type = content_type.rsplit(";", 1)[0]  # remove things like utf8 metadata
 
-        response_definition = self.operation.response_definition(str(status_code), content_type)
-        response_schema = self.operation.response_schema(str(status_code), content_type)
-        if self.is_json_schema_compatible(response_schema):
-            v = ResponseBodyValidator(response_schema, validator=self.validator)
+        compiled = self.get_compiled_response(str(status_code), content_type)
+        response_definition = compiled.definition
+        if compiled.body_validator is not None:
             try:
                 data = self.operation.json_loads(data)
-                v.validate_schema(data, url)
+                compiled.body_validator.validate_schema(data, url)
             except ValidationError as e:
                 raise NonConformingResponseBody(message=str(e))
 
-        if response_definition and response_definition.get("headers"):
-            required_header_keys = {
-                k for (k, v) in response_definition.get("headers").items() if v.get("required", False)
-            }
+        if compiled.required_headers:
             header_keys = set(headers.keys())
-            missing_keys = required_header_keys - header_keys
+            missing_keys = compiled.required_headers - header_keys
             if missing_keys:
                 pretty_list = ", ".join(missing_keys)
                 msg = "Keys in header don't match response specification. Difference: {}".format(pretty_list)
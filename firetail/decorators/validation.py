@@ -2,9 +2,11 @@
 This module defines view function decorators to validate request and response parameters and bodies.
 """
 
+import asyncio
 import collections
-import copy
 import functools
+import inspect
+import itertools
 import logging
 from typing import AnyStr, Union  # noqa
 
@@ -21,11 +23,14 @@ from werkzeug.datastructures import FileStorage
 from ..exceptions import (
     BadRequestProblem,
     ExtraParameterProblem,
+    PayloadTooLargeProblem,
     UnsupportedMediaTypeProblem,
 )
 from ..http_facts import FORM_CONTENT_TYPES
 from ..json_schema import Draft4RequestValidator, Draft4ResponseValidator
+from ..json_stream import DEFAULT_CHUNK_BYTES, BodyTooLarge, JsonStreamParser
 from ..lifecycle import FiretailResponse  # noqa
+from ..schema_compiler import CompiledValidator, compile_validator
 from ..utils import all_json, boolean, is_json_mimetype, is_null, is_nullable
 
 _jsonschema_3_or_newer = Version(version("jsonschema")) >= Version("3.0.0")
@@ -34,6 +39,11 @@ logger = logging.getLogger("firetail.decorators.validation")
 
 TYPE_MAP = {"integer": int, "number": float, "boolean": boolean, "object": dict}
 
+# Validation error modes: stop at the first error, or report several of them at once
+FAIL_FAST = "fail_fast"
+COLLECT_ALL = "collect_all"
+VALIDATION_ERROR_MODES = (FAIL_FAST, COLLECT_ALL)
+
 
 class TypeValidationError(Exception):
     def __init__(self, schema_type, parameter_type, parameter_name):
@@ -54,52 +64,112 @@ class TypeValidationError(Exception):
         return msg.format(**vars(self))
 
 
-def coerce_type(param, value, parameter_type, parameter_name=None):
-    def make_type(value, type_literal):
-        type_func = TYPE_MAP.get(type_literal)
-        return type_func(value)
+def make_type(value, type_literal):
+    type_func = TYPE_MAP.get(type_literal)
+    return type_func(value)
 
-    param_schema = param.get("schema", param)
-    if is_nullable(param_schema) and is_null(value):
-        return None
 
+def make_coercer(param, parameter_type, parameter_name=None):
+    """
+    Build the function converting the raw values of a parameter to its declared type.
+
+    Everything that only depends on the parameter definition is looked up once, here.
+
+    :type param: dict
+    :type parameter_type: str
+    :rtype: types.FunctionType
+    """
+    param_schema = param.get("schema", param)
+    nullable = is_nullable(param_schema)
     param_type = param_schema.get("type")
     parameter_name = parameter_name if parameter_name else param.get("name")
-    if param_type == "array":
-        converted_params = []
-        if parameter_type == "header":
-            value = value.split(",")
-        for v in value:
-            try:
-                converted = make_type(v, param_schema["items"]["type"])
-            except (ValueError, TypeError):
-                converted = v
-            converted_params.append(converted)
-        return converted_params
-    elif param_type == "object":
-        if param_schema.get("properties"):
-
-            def cast_leaves(d, schema):
-                if type(d) is not dict:
-                    try:
-                        return make_type(d, schema["type"])
-                    except (ValueError, TypeError):
-                        return d
-                for k, v in d.items():
-                    if k in schema["properties"]:
-                        d[k] = cast_leaves(v, schema["properties"][k])
-                return d
 
+    if param_type == "array":
+        item_type = TYPE_MAP.get(param_schema.get("items", {}).get("type"))
+        split = parameter_type == "header"
+
+        def coerce(value):
+            if nullable and is_null(value):
+                return None
+            if split:
+                value = value.split(",")
+            converted_params = []
+            for v in value:
+                try:
+                    converted = item_type(v)
+                except (ValueError, TypeError):
+                    converted = v
+                converted_params.append(converted)
+            return converted_params
+
+    elif param_type == "object" and param_schema.get("properties"):
+
+        def cast_leaves(d, schema):
+            if type(d) is not dict:
+                try:
+                    return make_type(d, schema["type"])
+                except (ValueError, TypeError):
+                    return d
+            for k, v in d.items():
+                if k in schema["properties"]:
+                    d[k] = cast_leaves(v, schema["properties"][k])
+            return d
+
+        def coerce(value):
+            if nullable and is_null(value):
+                return None
             return cast_leaves(value, param_schema)
-        return value
-    else:
-        try:
-            return make_type(value, param_type)
-        except ValueError:
-            raise TypeValidationError(param_type, parameter_type, parameter_name)
-        except TypeError:
+
+    elif param_type == "object" or TYPE_MAP.get(param_type) is None:
+
+        def coerce(value):
+            if nullable and is_null(value):
+                return None
             return value
 
+    else:
+        type_func = TYPE_MAP[param_type]
+
+        def coerce(value):
+            if nullable and is_null(value):
+                return None
+            try:
+                return type_func(value)
+            except ValueError:
+                raise TypeValidationError(param_type, parameter_type, parameter_name)
+            except TypeError:
+                return value
+
+    return coerce
+
+
+def coerce_type(param, value, parameter_type, parameter_name=None):
+    return make_coercer(param, parameter_type, parameter_name)(value)
+
+
+def truncate_message(message, max_length=None):
+    """
+    Cut an error message to `max_length` characters, e.g. when it quotes a large request body.
+
+    :type message: str
+    :type max_length: int | None
+    :rtype: str
+    """
+    if max_length is None or len(message) <= max_length:
+        return message
+    return message[:max_length] + "..."
+
+
+def has_refs(schema):
+    """
+    Whether a schema refers to other schemas, which can only be resolved from the root schema.
+    """
+    if isinstance(schema, dict):
+        return "$ref" in schema or any(has_refs(value) for value in schema.values())
+    if isinstance(schema, list):
+        return any(has_refs(value) for value in schema)
+    return False
+
 
 def validate_parameter_list(request_params, spec_params):
     request_params = set(request_params)
@@ -109,6 +179,13 @@ def validate_parameter_list(request_params, spec_params):
 
 
 class RequestBodyValidator:
+    #: Errors reported per request body, 1 stops at the first one.
+    max_errors = 1
+    #: Length error messages are cut to, None keeps them whole.
+    max_error_length = None
+    #: Parse JSON bodies from the request stream instead of buffering them.
+    stream_bodies = False
+
     def __init__(self, schema, consumes, api, is_null_value_valid=False, validator=None, strict_validation=False):
         """
         :param schema: The schema of the request body
@@ -123,11 +200,53 @@ class RequestBodyValidator:
         self.schema = schema
         self.has_default = schema.get("default", False)
         self.is_null_value_valid = is_null_value_valid
-        validatorClass = validator or Draft4RequestValidator
-        self.validator = validatorClass(schema, format_checker=draft4_format_checker)
+        self.validator_class = validator or Draft4RequestValidator
+        self.validator = self.validator_class(schema, format_checker=draft4_format_checker)
         self.api = api
         self.strict_validation = strict_validation
 
+    def compile_schemas(self):
+        """
+        Validate valid bodies with the compiled schema, and only invalid ones with jsonschema.
+        """
+        self.validator = compile_validator(self.validator)
+
+    def limit_errors(self, max_errors=1, max_error_length=None):
+        """
+        Report up to `max_errors` schema errors per request body, each cut to `max_error_length` characters.
+        """
+        self.max_errors = max(max_errors, 1)
+        self.max_error_length = max_error_length
+
+    def stream_json(self, max_body_bytes=None, chunk_size=DEFAULT_CHUNK_BYTES):
+        """
+        Parse JSON bodies from the request stream as they are read.
+
+        When the schema is an array, its items are validated one at a time as they are parsed, and the
+        request is rejected on the first invalid one without reading the rest of the body. The rest of
+        the schema is validated once the whole array is parsed.
+
+        :param max_body_bytes: Size from which bodies are rejected, None for no limit.
+        :type max_body_bytes: int | None
+        :param chunk_size: Bytes read from the stream at once.
+        :type chunk_size: int
+        """
+        self.stream_bodies = True
+        self.max_body_bytes = max_body_bytes
+        self.chunk_size = chunk_size
+        self.items_validator = None
+        self.array_validator = self.validator
+
+        items = self.schema.get("items")
+        if self.schema.get("type") == "array" and isinstance(items, dict) and not has_refs(self.schema):
+            # Draft 4 validates `items` independently of the other keywords of the schema
+            self.items_validator = self.validator_class(items, format_checker=draft4_format_checker)
+            array_schema = {key: value for key, value in self.schema.items() if key != "items"}
+            self.array_validator = self.validator_class(array_schema, format_checker=draft4_format_checker)
+            if isinstance(self.validator, CompiledValidator):
+                self.items_validator = compile_validator(self.items_validator)
+                self.array_validator = compile_validator(self.array_validator)
+
     def validate_formdata_parameter_list(self, request):
         request_params = request.form.keys()
         spec_params = self.schema.get("properties", {}).keys()
@@ -141,6 +260,12 @@ class RequestBodyValidator:
 
         @functools.wraps(function)
         def wrapper(request):
+            if self.streams(request):
+                if inspect.iscoroutinefunction(request.stream.read):
+                    return self._call_streamed(function, request)
+                self.validate_streamed(request, self.read_stream(request))
+                return function(request)
+
             if all_json(self.consumes):
                 data = request.json
 
@@ -201,25 +326,127 @@ class RequestBodyValidator:
         error_path_msg = f" - '{error_path}'" if error_path else ""
         return error_path_msg
 
-    def validate_schema(self, data, url):
-        # type: (dict, AnyStr) -> Union[FiretailResponse, None]
-        if self.is_null_value_valid and is_null(data):
-            return None
+    def streams(self, request):
+        """
+        Whether the JSON body of a request is parsed from its stream.
+        """
+        if not self.stream_bodies or request.stream is None or not all_json(self.consumes):
+            return False
+        try:
+            return is_json_mimetype(request.headers.get("Content-Type", ""))
+        except ValueError:
+            return False
+
+    def _stream_parser(self, request):
+        if self.max_body_bytes is not None:
+            content_length = request.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+                raise PayloadTooLargeProblem(detail=self._too_large_message(int(content_length)))
+        on_item = None
+        if self.items_validator is not None:
+            on_item = functools.partial(self.validate_item, url=request.url)
+        return JsonStreamParser(on_item=on_item, max_bytes=self.max_body_bytes)
+
+    def _too_large_message(self, size):
+        return "Request body of {} bytes exceeds the limit of {} bytes".format(size, self.max_body_bytes)
+
+    def read_stream(self, request):
+        """
+        Parse the JSON body of a request from its stream, validating the items of arrays as they are read.
 
+        :return: The parsed body, None if it is empty.
+        """
+        parser = self._stream_parser(request)
         try:
-            self.validator.validate(data)
-        except ValidationError as exception:
+            while True:
+                chunk = request.stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+            return parser.close()
+        except BodyTooLarge as e:
+            raise PayloadTooLargeProblem(detail=self._too_large_message(e.size))
+        except ValueError:
+            raise BadRequestProblem(detail="Request body is not valid JSON")
+
+    async def read_stream_async(self, request):
+        """
+        Same as `read_stream`, for streams whose `read` method is a coroutine function.
+        """
+        parser = self._stream_parser(request)
+        try:
+            while True:
+                chunk = await request.stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+            return parser.close()
+        except BodyTooLarge as e:
+            raise PayloadTooLargeProblem(detail=self._too_large_message(e.size))
+        except ValueError:
+            raise BadRequestProblem(detail="Request body is not valid JSON")
+
+    async def _call_streamed(self, function, request):
+        self.validate_streamed(request, await self.read_stream_async(request))
+        response = function(request)
+        while asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+    def validate_item(self, item, index, url):
+        """
+        Validate an item of an array body, as soon as it is parsed.
+        """
+        errors = self._errors(self.items_validator, item)
+        for exception in errors:
+            exception.path.appendleft(index)
+        self._raise_errors(errors, url)
+
+    def validate_streamed(self, request, data):
+        """
+        Validate what is left to validate of a body parsed from the stream, once it is complete.
+        """
+        request.json = data
+        request.body = b""
+        logger.debug("%s validating schema...", request.url)
+        if data is None:
+            if not self.has_default:
+                self.validate_schema(data, request.url)
+        elif not (self.is_null_value_valid and is_null(data)):
+            self._raise_errors(self._errors(self.array_validator, data), request.url)
+
+    def _errors(self, validator, data):
+        if self.max_errors == 1:
+            # Fail fast: jsonschema stops at the first error
+            try:
+                validator.validate(data)
+            except ValidationError as exception:
+                return [exception]
+            return []
+        return list(itertools.islice(validator.iter_errors(data), self.max_errors))
+
+    def _raise_errors(self, errors, url):
+        messages = []
+        for exception in errors:
             error_path_msg = self._error_path_message(exception=exception)
+            message = truncate_message(
+                "{message}{error_path_msg}".format(message=exception.message, error_path_msg=error_path_msg),
+                self.max_error_length,
+            )
             logger.error(
-                "{url} validation error: {error}{error_path_msg}".format(
-                    url=url, error=exception.message, error_path_msg=error_path_msg
-                ),
+                "{url} validation error: {error}".format(url=url, error=message),
                 extra={"validator": "body"},
             )
-            raise BadRequestProblem(
-                detail="{message}{error_path_msg}".format(message=exception.message, error_path_msg=error_path_msg)
-            )
+            messages.append(message)
+        if messages:
+            raise BadRequestProblem(detail=messages[0] if self.max_errors == 1 else messages)
 
+    def validate_schema(self, data, url):
+        # type: (dict, AnyStr) -> Union[FiretailResponse, None]
+        if self.is_null_value_valid and is_null(data):
+            return None
+
+        self._raise_errors(self._errors(self.validator, data), url)
         return None
 
 
@@ -234,6 +461,9 @@ class ResponseBodyValidator:
         ValidatorClass = validator or Draft4ResponseValidator
         self.validator = ValidatorClass(schema, format_checker=draft4_format_checker)
 
+    def compile_schemas(self):
+        self.validator = compile_validator(self.validator)
+
     def validate_schema(self, data, url):
         # type: (dict, AnyStr) -> Union[FiretailResponse, None]
         try:
@@ -247,50 +477,60 @@ class ResponseBodyValidator:
         return None
 
 
-class ParameterValidator:
-    def __init__(self, parameters, api, strict_validation=False):
+if _jsonschema_3_or_newer:
+    FileDraft4Validator = extend(
+        Draft4Validator,
+        type_checker=Draft4Validator.TYPE_CHECKER.redefine(
+            "file", lambda checker, instance: isinstance(instance, FileStorage)
+        ),
+    )
+else:  # pragma: no cover
+    FileDraft4Validator = functools.partial(Draft4Validator, types={"file": FileStorage})
+
+
+class CompiledParameter:
+    """
+    A request parameter ready to be validated: its schema stripped of `required`, its validator and
+    its type coercer are built once, when the operation is.
+    """
+
+    def __init__(self, parameter_type, param, param_name=None):
         """
-        :param parameters: List of request parameter dictionaries
-        :param api: api that the validator is attached to
-        :param strict_validation: Flag indicating if parameters not in spec are allowed
+        :param parameter_type: Where the parameter is: query, path, header, cookie or formdata.
+        :type parameter_type: str
+        :param param: The parameter definition.
+        :type param: dict
         """
-        self.parameters = collections.defaultdict(list)
-        for p in parameters:
-            self.parameters[p["in"]].append(p)
-
-        self.api = api
-        self.strict_validation = strict_validation
+        self.parameter_type = parameter_type
+        self.param = param
+        self.required = param.get("required")
+        self.nullable = is_nullable(param)
+        self.coerce = make_coercer(param, parameter_type, param_name)
+
+        schema = param.get("schema", param)
+        # Validators never modify their schema, a shallow copy is enough to drop `required`
+        self.schema = {key: value for key, value in schema.items() if key != "required"}
+        if parameter_type == "formdata" and self.schema.get("type") == "file":
+            self.validator = FileDraft4Validator(self.schema, format_checker=draft4_format_checker)
+        else:
+            self.validator = Draft4Validator(self.schema, format_checker=draft4_format_checker)
 
-    @staticmethod
-    def validate_parameter(parameter_type, value, param, param_name=None):
+    def validate(self, value):
+        """
+        :return: The error message, None if the value is valid.
+        :rtype: str | None
+        """
         if value is not None:
-            if is_nullable(param) and is_null(value):
+            if self.nullable and is_null(value):
                 return
 
             try:
-                converted_value = coerce_type(param, value, parameter_type, param_name)
+                converted_value = self.coerce(value)
             except TypeValidationError as e:
                 return str(e)
 
-            param = copy.deepcopy(param)
-            param = param.get("schema", param)
-            if "required" in param:
-                del param["required"]
             try:
-                if parameter_type == "formdata" and param.get("type") == "file":
-                    if _jsonschema_3_or_newer:
-                        extend(
-                            Draft4Validator,
-                            type_checker=Draft4Validator.TYPE_CHECKER.redefine(
-                                "file", lambda checker, instance: isinstance(instance, FileStorage)
-                            ),
-                        )(param, format_checker=draft4_format_checker).validate(converted_value)
-                    else:
-                        Draft4Validator(
-                            param, format_checker=draft4_format_checker, types={"file": FileStorage}
-                        ).validate(converted_value)
-                else:
-                    Draft4Validator(param, format_checker=draft4_format_checker).validate(converted_value)
+                self.validator.validate(converted_value)
             except ValidationError as exception:
                 debug_msg = (
                     "Error while converting value {converted_value} from param "
@@ -299,14 +539,67 @@ class ParameterValidator:
                 fmt_params = dict(
                     converted_value=str(converted_value),
                     type_converted_value=type(converted_value),
-                    param_type=param.get("type"),
-                    param=param,
+                    param_type=self.schema.get("type"),
+                    param=self.schema,
                 )
                 logger.info(debug_msg.format(**fmt_params))
                 return str(exception)
 
-        elif param.get("required"):
-            return "Missing {parameter_type} parameter '{param[name]}'".format(**locals())
+        elif self.required:
+            return "Missing {parameter_type} parameter '{name}'".format(
+                parameter_type=self.parameter_type, name=self.param["name"]
+            )
+
+
+class ParameterValidator:
+    PARAMETER_TYPES = {"query": "query", "path": "path", "header": "header", "cookie": "cookie", "formData": "formdata"}
+
+    #: Invalid parameters reported per request, 1 stops at the first one.
+    max_errors = 1
+    #: Length error messages are cut to, None keeps them whole.
+    max_error_length = None
+
+    def __init__(self, parameters, api, strict_validation=False):
+        """
+        :param parameters: List of request parameter dictionaries
+        :param api: api that the validator is attached to
+        :param strict_validation: Flag indicating if parameters not in spec are allowed
+        """
+        self.parameters = collections.defaultdict(list)
+        # Compiled parameters, by location and identity of their definition. Subclasses overriding
+        # `validate_parameter` get every parameter passed to their override instead.
+        self.compiled = {}
+        compile_parameters = type(self).validate_parameter is ParameterValidator.validate_parameter
+        for p in parameters:
+            self.parameters[p["in"]].append(p)
+            parameter_type = self.PARAMETER_TYPES.get(p["in"])
+            if parameter_type is not None and compile_parameters:
+                self.compiled[parameter_type, id(p)] = CompiledParameter(parameter_type, p)
+
+        self.api = api
+        self.strict_validation = strict_validation
+
+    def compile_schemas(self):
+        for compiled in self.compiled.values():
+            compiled.validator = compile_validator(compiled.validator)
+
+    def limit_errors(self, max_errors=1, max_error_length=None):
+        """
+        Report up to `max_errors` invalid parameters per request, each cut to `max_error_length` characters.
+        """
+        self.max_errors = max(max_errors, 1)
+        self.max_error_length = max_error_length
+
+    @staticmethod
+    def validate_parameter(parameter_type, value, param, param_name=None):
+        return CompiledParameter(parameter_type, param, param_name).validate(value)
+
+    def _validate(self, parameter_type, value, param):
+        compiled = self.compiled.get((parameter_type, id(param)))
+        if compiled is None:
+            # Not one of the parameters of the operation, or not compiled
+            return self.validate_parameter(parameter_type, value, param)
+        return compiled.validate(value)
 
     def validate_query_parameter_list(self, request):
         request_params = request.query.keys()
@@ -329,19 +622,19 @@ class ParameterValidator:
         :rtype: str
         """
         val = request.query.get(param["name"])
-        return self.validate_parameter("query", val, param)
+        return self._validate("query", val, param)
 
     def validate_path_parameter(self, param, request):
         val = request.path_params.get(param["name"].replace("-", "_"))
-        return self.validate_parameter("path", val, param)
+        return self._validate("path", val, param)
 
     def validate_header_parameter(self, param, request):
         val = request.headers.get(param["name"])
-        return self.validate_parameter("header", val, param)
+        return self._validate("header", val, param)
 
     def validate_cookie_parameter(self, param, request):
         val = request.cookies.get(param["name"])
-        return self.validate_parameter("cookie", val, param)
+        return self._validate("cookie", val, param)
 
     def validate_formdata_parameter(self, param_name, param, request):
         if param.get("type") == "file" or param.get("format") == "binary":
@@ -349,7 +642,38 @@ class ParameterValidator:
         else:
             val = request.form.get(param_name)
 
-        return self.validate_parameter("formdata", val, param)
+        return self._validate("formdata", val, param)
+
+    def iter_errors(self, request):
+        """
+        Error messages of the invalid parameters of a request, in the order they are declared.
+
+        :rtype: collections.abc.Iterator[str]
+        """
+        for param in self.parameters.get("query", []):
+            error = self.validate_query_parameter(param, request)
+            if error:
+                yield error
+
+        for param in self.parameters.get("path", []):
+            error = self.validate_path_parameter(param, request)
+            if error:
+                yield error
+
+        for param in self.parameters.get("header", []):
+            error = self.validate_header_parameter(param, request)
+            if error:
+                yield error
+
+        for param in self.parameters.get("cookie", []):
+            error = self.validate_cookie_parameter(param, request)
+            if error:
+                yield error
+
+        for param in self.parameters.get("formData", []):
+            error = self.validate_formdata_parameter(param["name"], param, request)
+            if error:
+                yield error
 
     def __call__(self, function):
         """
@@ -368,30 +692,11 @@ class ParameterValidator:
                 if formdata_errors or query_errors:
                     raise ExtraParameterProblem(formdata_errors, query_errors)
 
-            for param in self.parameters.get("query", []):
-                error = self.validate_query_parameter(param, request)
-                if error:
-                    raise BadRequestProblem(detail=error)
-
-            for param in self.parameters.get("path", []):
-                error = self.validate_path_parameter(param, request)
-                if error:
-                    raise BadRequestProblem(detail=error)
-
-            for param in self.parameters.get("header", []):
-                error = self.validate_header_parameter(param, request)
-                if error:
-                    raise BadRequestProblem(detail=error)
-
-            for param in self.parameters.get("cookie", []):
-                error = self.validate_cookie_parameter(param, request)
-                if error:
-                    raise BadRequestProblem(detail=error)
-
-            for param in self.parameters.get("formData", []):
-                error = self.validate_formdata_parameter(param["name"], param, request)
-                if error:
-                    raise BadRequestProblem(detail=error)
+            # Parameters are only validated until enough errors are found
+            errors = list(itertools.islice(self.iter_errors(request), self.max_errors))
+            if errors:
+                errors = [truncate_message(error, self.max_error_length) for error in errors]
+                raise BadRequestProblem(detail=errors[0] if self.max_errors == 1 else errors)
 
             return function(request)
 
@@ -113,6 +113,11 @@ class UnsupportedMediaTypeProblem(ProblemException):
         super().__init__(status=415, title=title, detail=detail)
 
 
+class PayloadTooLargeProblem(ProblemException):
+    def __init__(self, title="Payload Too Large", detail=None):
+        super().__init__(status=413, title=title, detail=detail)
+
+
 class NonConformingResponseBody(NonConformingResponse):
     def __init__(self, message, reason="Response body does not conform to specification"):
         super().__init__(reason=reason, message=message)
@@ -8,7 +8,6 @@ import logging.handlers
 import traceback
 
 from .exceptions import AuthenticationProblem, FiretailException, ResolverProblem
-from .logger import get_stdout_logger
 from .operations.secure import SecureOperation
 from .sender import FiretailSender
 
@@ -101,8 +100,9 @@ class FiretailHandler(logging.Handler):
         network_timeout=10.0,
         retries_no=4,
         retry_timeout=2,
+        **sender_options,
     ):
-        if not token and not custom_backend:
+        if not token and not custom_backend and sender_options.get("sink") is None:
             raise FiretailException("firetail Token must be provided")
 
         self.firetail_type = firetail_type
@@ -116,6 +116,7 @@ class FiretailHandler(logging.Handler):
             network_timeout=network_timeout,
             number_of_retries=retries_no,
             retry_timeout=retry_timeout,
+            **sender_options,
         )
         logging.Handler.__init__(self)
 
@@ -204,7 +205,13 @@ class FiretailHandler(logging.Handler):
 
     def emit(self, record):
         message = self.format_message(record)
-        self.stdout_logger = get_stdout_logger(False)
-        # self.stdout_logger.info(record.getMessage())
-        if "ignore" not in message:
+        if "ignore" in message:
+            return
+
+        text = record.getMessage()
+        if "\n" in text or "\r" in text:
+            # Records are shipped one per line, so pretty-printed JSON is serialized again
             self.firetail_sender.append(message)
+        else:
+            # The message is already valid JSON on a single line, no need to serialize it again
+            self.firetail_sender.append_encoded(text)
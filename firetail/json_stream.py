@@ -0,0 +1,155 @@
+"""
+This module defines the incremental parser of JSON request bodies, decoding them from the input
+stream as they are read instead of once fully buffered.
+
+The items of a top-level array are decoded one at a time and handed to a callback, so that bulk
+requests are validated item by item, and rejected on their first invalid item without reading the
+rest of the body. Only the items decoded so far are kept, never the raw body.
+"""
+
+import codecs
+import json
+
+DEFAULT_CHUNK_BYTES = 64 * 1024
+# Key of a body parsed from the input stream, which leaves the stream consumed, in the WSGI environ
+# or the aiohttp request
+STREAMED_JSON_KEY = "firetail.streamed_json"
+
+_WHITESPACE = " \t\n\r"
+_ITEM_ENDS = frozenset(_WHITESPACE + ",]")
+# First characters of a JSON value, anything else cannot be an array item
+_VALUE_STARTS = frozenset('{["-0123456789tfn')
+
+_START = "start"
+_FIRST_ITEM = "first item"
+_ITEM = "item"
+_SEPARATOR = "separator"
+_END = "end"
+_DOCUMENT = "document"
+
+
+class BodyTooLarge(Exception):
+    def __init__(self, size, max_bytes):
+        """
+        Exception raised when a body is larger than the limit of the parser.
+
+        :param size: Bytes read when the limit was exceeded.
+        :type size: int
+        :type max_bytes: int
+        """
+        super().__init__("Body of at least {} bytes exceeds the limit of {} bytes".format(size, max_bytes))
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+class JsonStreamParser:
+    """
+    Parses a JSON document fed in chunks.
+
+    When the document is an array, each item is decoded as soon as it is complete and passed to
+    `on_item`. Any other document is buffered, then decoded once complete. Malformed JSON raises a
+    `ValueError`, at the latest when the parser is closed.
+    """
+
+    def __init__(self, on_item=None, max_bytes=None):
+        """
+        :param on_item: Called with each item of a top-level array and its index, may raise to stop parsing.
+        :type on_item: types.FunctionType | None
+        :param max_bytes: Size from which `feed` raises `BodyTooLarge`, None for no limit.
+        :type max_bytes: int | None
+        """
+        self.on_item = on_item
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = []
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._state = _START
+        # Length the buffer must reach before an incomplete item is decoded again. Waiting for it to
+        # double keeps large items from being decoded from their start on every chunk.
+        self._retry_at = 0
+
+    def feed(self, chunk):
+        """
+        :type chunk: bytes
+        """
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise BodyTooLarge(self.size, self.max_bytes)
+        self._buffer += self._text.decode(chunk)
+        if self._state != _DOCUMENT:
+            self._parse(final=False)
+
+    def close(self):
+        """
+        :return: The decoded document, None if the body is empty.
+        """
+        self._buffer += self._text.decode(b"", final=True)
+        if self._state == _DOCUMENT:
+            return self._decoder.decode(self._buffer)
+        self._parse(final=True)
+        if self._state == _START:
+            return None
+        if self._state != _END:
+            raise json.JSONDecodeError("Expecting ',' delimiter", self._buffer, len(self._buffer))
+        return self.items
+
+    def _parse(self, final):
+        buffer = self._buffer
+        length = len(buffer)
+        pos = 0
+        while True:
+            while pos < length and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == length:
+                break
+
+            state = self._state
+            if state == _START:
+                if buffer[pos] != "[":
+                    self._state = _DOCUMENT
+                    break
+                self._state = _FIRST_ITEM
+                pos += 1
+                continue
+            if state == _END:
+                raise json.JSONDecodeError("Extra data", buffer, pos)
+            if state == _SEPARATOR:
+                if buffer[pos] == ",":
+                    self._state = _ITEM
+                elif buffer[pos] == "]":
+                    self._state = _END
+                else:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos += 1
+                continue
+            if state == _FIRST_ITEM and buffer[pos] == "]":
+                self._state = _END
+                pos += 1
+                continue
+
+            if buffer[pos] not in _VALUE_STARTS:
+                raise json.JSONDecodeError("Expecting value", buffer, pos)
+            if not final and length - pos < self._retry_at:
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                self._retry_at = 2 * (length - pos)
+                break
+            if not final and (end == length or buffer[end] not in _ITEM_ENDS):
+                # A number may go on in the next chunk, e.g. "2." or "1e", wait for the character ending it
+                self._retry_at = length - pos + 1
+                break
+
+            self._retry_at = 0
+            if self.on_item is not None:
+                self.on_item(item, len(self.items))
+            self.items.append(item)
+            self._state = _SEPARATOR
+            pos = end
+
+        self._buffer = buffer[pos:]
@@ -20,18 +20,41 @@ class FiretailRequest:
         files=None,
         context=None,
         cookies=None,
+        body_getter=None,
+        stream=None,
+        json_setter=None,
     ):
+        """
+        :param body_getter: Reads the body when it is first accessed, in place of `body`.
+        :param stream: Unread input stream of the body, for validators parsing it incrementally. Its
+            `read` method may be a coroutine function.
+        :param json_setter: Called with the JSON body parsed from `stream`, to hand it over to the
+            framework request whose stream it consumed.
+        """
         self.url = url
         self.method = method
         self.path_params = path_params or {}
         self.query = query or {}
         self.headers = headers or {}
         self.form = form or {}
-        self.body = body
+        self._body = body
+        self.body_getter = body_getter
         self.json_getter = json_getter
         self.files = files
         self.context = context if context is not None else {}
         self.cookies = cookies or {}
+        self.stream = stream
+        self.json_setter = json_setter
+
+    @property
+    def body(self):
+        if self._body is None and self.body_getter is not None:
+            self._body = self.body_getter()
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
 
     @property
     def json(self):
@@ -39,6 +62,12 @@ class FiretailRequest:
             self._json = self.json_getter()
         return self._json
 
+    @json.setter
+    def json(self, data):
+        self._json = data
+        if self.json_setter is not None:
+            self.json_setter(data)
+
 
 class FiretailResponse:
     """Firetail interface for a response."""
@@ -8,6 +8,7 @@ import logging
 
 from firetail.operations.secure import SecureOperation
 
+from ..decorators.decorator import RequestResponseDecorator
 from ..decorators.metrics import UWSGIMetricsCollector
 from ..decorators.parameter import parameter_to_arg
 from ..decorators.produces import BaseSerializer, Produces
@@ -61,6 +62,11 @@ class AbstractOperation(SecureOperation, metaclass=abc.ABCMeta):
         pythonic_params=False,
         uri_parser_class=None,
         pass_context_arg_name=None,
+        compile_schemas=False,
+        max_validation_errors=1,
+        max_validation_error_length=None,
+        stream_json_bodies=False,
+        max_json_body_bytes=None,
     ):
         """
         :param api: api that this operation is attached to
@@ -94,6 +100,19 @@ class AbstractOperation(SecureOperation, metaclass=abc.ABCMeta):
         :param pass_context_arg_name: If not None will try to inject the request context to the function using this
             name.
         :type pass_context_arg_name: str|None
+        :param compile_schemas: True compiles the request and response schemas into fast checks, falling back to
+            jsonschema to report errors.
+        :type compile_schemas: bool
+        :param max_validation_errors: Errors reported for the parameters, and for the body, of a request. 1 stops at
+            the first one.
+        :type max_validation_errors: int
+        :param max_validation_error_length: Length validation error messages are cut to, None keeps them whole.
+        :type max_validation_error_length: int|None
+        :param stream_json_bodies: True parses JSON request bodies from the input stream, validating the items of
+            top-level arrays as they are read.
+        :type stream_json_bodies: bool
+        :param max_json_body_bytes: Size from which streamed JSON request bodies are rejected, None for no limit.
+        :type max_json_body_bytes: int|None
         """
         self._api = api
         self._method = method
@@ -108,6 +127,11 @@ class AbstractOperation(SecureOperation, metaclass=abc.ABCMeta):
         self._uri_parser_class = uri_parser_class
         self._pass_context_arg_name = pass_context_arg_name
         self._randomize_endpoint = randomize_endpoint
+        self._compile_schemas = compile_schemas
+        self._max_validation_errors = max_validation_errors
+        self._max_validation_error_length = max_validation_error_length
+        self._stream_json_bodies = stream_json_bodies
+        self._max_json_body_bytes = max_json_body_bytes
 
         self._operation_id = self._operation.get("operationId")
         self._resolution = resolver.resolve(self)
@@ -431,14 +455,18 @@ class AbstractOperation(SecureOperation, metaclass=abc.ABCMeta):
         ParameterValidator = self.validator_map["parameter"]
         RequestBodyValidator = self.validator_map["body"]
         if self.parameters:
-            yield ParameterValidator(self.parameters, self.api, strict_validation=self.strict_validation)
+            yield self._configured(
+                ParameterValidator(self.parameters, self.api, strict_validation=self.strict_validation)
+            )
         if self.body_schema:
-            yield RequestBodyValidator(
-                self.body_schema,
-                self.consumes,
-                self.api,
-                is_nullable(self.body_definition),
-                strict_validation=self.strict_validation,
+            yield self._configured(
+                RequestBodyValidator(
+                    self.body_schema,
+                    self.consumes,
+                    self.api,
+                    is_nullable(self.body_definition),
+                    strict_validation=self.strict_validation,
+                )
             )
 
     @property
@@ -448,7 +476,35 @@ class AbstractOperation(SecureOperation, metaclass=abc.ABCMeta):
         :rtype: types.FunctionType
         """
         ResponseValidator = self.validator_map["response"]
-        return ResponseValidator(self, self.get_mimetype())
+        return self._configured(ResponseValidator(self, self.get_mimetype()))
+
+    def _configured(self, validator):
+        # Custom validators from the validator map may not support these options
+        if self._compile_schemas and hasattr(validator, "compile_schemas"):
+            validator.compile_schemas()
+        if hasattr(validator, "limit_errors"):
+            validator.limit_errors(self._max_validation_errors, self._max_validation_error_length)
+        if self._stream_json_bodies and hasattr(validator, "stream_json"):
+            validator.stream_json(self._max_json_body_bytes)
+        return validator
+
+    @property
+    def _request_response_decorator(self):
+        """
+        Guarantees that instead of the internal representation of the
+        operation handler response
+        (firetail.lifecycle.FiretailRequest) a framework specific
+        object is returned.
+        :rtype: types.FunctionType
+        """
+        # Custom body validators may not parse the body from the stream
+        stream_body = (
+            self._stream_json_bodies
+            and bool(self.body_schema)
+            and all_json(self.consumes)
+            and hasattr(self.validator_map["body"], "stream_json")
+        )
+        return RequestResponseDecorator(self.api, self.get_mimetype(), stream_body=stream_body)
 
     def json_loads(self, data):
         """
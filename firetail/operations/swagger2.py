@@ -48,6 +48,11 @@ class Swagger2Operation(AbstractOperation):
         pythonic_params=False,
         uri_parser_class=None,
         pass_context_arg_name=None,
+        compile_schemas=False,
+        max_validation_errors=1,
+        max_validation_error_length=None,
+        stream_json_bodies=False,
+        max_json_body_bytes=None,
     ):
         """
         :param api: api that this operation is attached to
@@ -94,6 +99,19 @@ class Swagger2Operation(AbstractOperation):
         :param pass_context_arg_name: If not None will try to inject the request context to the function using this
             name.
         :type pass_context_arg_name: str|None
+        :param compile_schemas: True compiles the request and response schemas into fast checks, falling back to
+            jsonschema to report errors.
+        :type compile_schemas: bool
+        :param max_validation_errors: Errors reported for the parameters, and for the body, of a request. 1 stops at
+            the first one.
+        :type max_validation_errors: int
+        :param max_validation_error_length: Length validation error messages are cut to, None keeps them whole.
+        :type max_validation_error_length: int|None
+        :param stream_json_bodies: True parses JSON request bodies from the input stream, validating the items of
+            top-level arrays as they are read.
+        :type stream_json_bodies: bool
+        :param max_json_body_bytes: Size from which streamed JSON request bodies are rejected, None for no limit.
+        :type max_json_body_bytes: int|None
         """
         app_security = operation.get("security", app_security)
         uri_parser_class = uri_parser_class or Swagger2URIParser
@@ -115,6 +133,11 @@ class Swagger2Operation(AbstractOperation):
             pythonic_params=pythonic_params,
             uri_parser_class=uri_parser_class,
             pass_context_arg_name=pass_context_arg_name,
+            compile_schemas=compile_schemas,
+            max_validation_errors=max_validation_errors,
+            max_validation_error_length=max_validation_error_length,
+            stream_json_bodies=stream_json_bodies,
+            max_json_body_bytes=max_json_body_bytes,
         )
 
         self._produces = operation.get("produces", app_produces)
@@ -136,6 +136,94 @@ class FiretailOptions:
         """
         return self._options.get("uri_parser_class", None)
 
+    @property
+    def compile_schemas(self):
+        # type: () -> bool
+        """
+        Compile the request and response schemas of every operation into specialized checks,
+        validating valid payloads without jsonschema. Invalid ones are still reported by jsonschema.
+        Default: False
+        """
+        return self._options.get("compile_schemas", False)
+
+    @property
+    def validation_error_mode(self):
+        # type: () -> str
+        """
+        How invalid requests are reported: "fail_fast" stops at the first invalid parameter or
+        body error, "collect_all" reports up to `max_validation_errors` of each at once.
+        Default: "fail_fast"
+        """
+        return self._options.get("validation_error_mode", "fail_fast")
+
+    @property
+    def max_validation_errors(self):
+        # type: () -> int
+        """
+        Maximum number of errors reported for the parameters, and for the body, of a request
+        in the "collect_all" validation error mode.
+        Default: 10
+        """
+        return self._options.get("max_validation_errors", 10)
+
+    @property
+    def max_validation_error_length(self):
+        # type: () -> Optional[int]
+        """
+        Length validation error messages are cut to, as they may quote large request values.
+        Default: None
+        """
+        return self._options.get("max_validation_error_length", None)
+
+    @property
+    def stream_json_bodies(self):
+        # type: () -> bool
+        """
+        Parse JSON request bodies from the input stream as they are read, instead of buffering
+        them. The items of a top-level array are validated one at a time, and the request is
+        rejected on the first invalid one.
+        Default: False
+        """
+        return self._options.get("stream_json_bodies", False)
+
+    @property
+    def max_json_body_bytes(self):
+        # type: () -> Optional[int]
+        """
+        Size from which JSON request bodies are rejected with a 413 when they are streamed.
+        Default: None
+        """
+        return self._options.get("max_json_body_bytes", None)
+
+    @property
+    def auditor(self):
+        # type: () -> Optional[firetail.aio_auditor.AsyncAuditor]
+        """
+        Asyncio audit pipeline capturing every request handled by an AioHttpApi.
+        Default: None
+        """
+        return self._options.get("auditor", None)
+
+    @property
+    def metrics(self):
+        # type: () -> Optional[firetail.audit_metrics.PipelineMetrics]
+        """
+        Audit pipeline metrics to serve under `metrics_path`, in the Prometheus text format or as
+        JSON when asked for with `?format=json` or an Accept header.
+        Default: None
+        """
+        return self._options.get("metrics", None)
+
+    @property
+    def metrics_path(self):
+        # type: () -> str
+        """
+        Path to mount the audit pipeline metrics endpoint.
+
+        Default: /metrics
+        """
+        return self._options.get("metrics_path", "/metrics")
+
 
 def filter_values(dictionary):
     # type: (dict) -> dict
@@ -0,0 +1,126 @@
+"""
+This module defines the encoder writing audit records straight to bytes, without building the
+intermediate payload dictionaries.
+
+orjson is used when installed, the standard library json module otherwise.
+"""
+
+import functools
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+RECORD_VERSION = "1.0.0-alpha"
+
+
+if orjson is not None:
+    dumps = orjson.dumps
+else:  # pragma: no cover
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=256)
+def _environ_header_name(key):
+    if key.startswith("HTTP_"):
+        key = key[5:]
+    return key.replace("_", "-").title()
+
+
+def environ_headers(environ):
+    """
+    Request headers of a WSGI environ, as (name, value) pairs.
+
+    The same pairs as iterating over werkzeug's `EnvironHeaders`, without rebuilding every
+    header name on every request.
+
+    :rtype: list[tuple[str, str]]
+    """
+    headers = []
+    for key, value in environ.items():
+        if key.startswith("HTTP_"):
+            if key != "HTTP_CONTENT_TYPE" and key != "HTTP_CONTENT_LENGTH":
+                headers.append((_environ_header_name(key), value))
+        elif (key == "CONTENT_TYPE" or key == "CONTENT_LENGTH") and value:
+            headers.append((_environ_header_name(key), value))
+    return headers
+
+
+def _header_items(headers):
+    return headers.items() if hasattr(headers, "items") else headers
+
+
+class RecordEncoder:
+    """
+    Encodes a `CapturedExchange` as a JSON audit record, scrubbing it on the way.
+
+    The record is identical to the scrubbed `cloud_logger.build_payload`: headers are grouped into
+    lists of values, then the sensitive ones are replaced by their hash, in the same pass.
+    """
+
+    _REQUEST = b',"request":{"httpProtocol":'
+
+    def __init__(self, redactor):
+        """
+        :type redactor: firetail.redaction.Redactor
+        """
+        self.redactor = redactor
+
+    def encode_headers(self, headers):
+        """
+        :param headers: Mapping of header names to values, or list of (name, value) pairs.
+        :rtype: bytes
+        """
+        grouped = {}
+        for name, value in _header_items(headers):
+            values = grouped.get(name)
+            if values is None:
+                grouped[name] = [value]
+            else:
+                values.append(value)
+        return dumps(self.redactor.redact_headers(grouped))
+
+    def encode(self, exchange, oauth=None):
+        """
+        :type exchange: firetail.auditor.CapturedExchange
+        :param oauth: OAuth enrichment of the record, if any.
+        :type oauth: dict | None
+        :rtype: bytes
+        """
+        redact_body = self.redactor.redact_body
+        parts = [
+            b'{"version":"' + RECORD_VERSION.encode() + b'","dateCreated":',
+            dumps(exchange.date_created),
+            b',"executionTime":',
+            dumps(exchange.execution_time),
+            self._REQUEST,
+            dumps(exchange.http_protocol),
+            b',"uri":',
+            dumps(exchange.uri),
+            b',"headers":',
+            self.encode_headers(exchange.request_headers),
+            b',"resource":',
+            dumps(exchange.resource),
+            b',"method":',
+            dumps(exchange.method),
+            b',"body":',
+            dumps(exchange.request_body.render(redact=redact_body)),
+            b',"ip":',
+            dumps(exchange.ip),
+            b'},"response":{"statusCode":',
+            dumps(exchange.status_code),
+            b',"body":',
+            dumps(exchange.response_body.render(strict=True, redact=redact_body)),
+            b',"headers":',
+            self.encode_headers(exchange.response_headers),
+            b"}",
+        ]
+        if oauth is not None:
+            parts.append(b',"oauth":')
+            parts.append(dumps(oauth))
+        parts.append(b"}")
+        return b"".join(parts)
@@ -0,0 +1,153 @@
+"""
+This module defines the retry and circuit breaking policies used when uploading logs.
+"""
+
+import email.utils
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+SUCCESS = "success"
+RETRY = "retry"
+FATAL = "fatal"
+
+# Statuses worth trying again: the backend is overloaded or temporarily unavailable.
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+def classify_status(status_code):
+    """
+    Classify the status code of a bulk upload response.
+
+    :rtype: str
+    :return: SUCCESS for 2xx, RETRY for transient failures and FATAL for everything else.
+    """
+    if 200 <= status_code < 300:
+        return SUCCESS
+    if status_code in RETRYABLE_STATUS_CODES:
+        return RETRY
+    return FATAL
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either as seconds or as an HTTP date.
+
+    :return: Delay in seconds, or None if the header is missing or invalid.
+    :rtype: float | None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, base_delay=2, max_delay=60):
+        """
+        :param base_delay: Delay ceiling of the first retry, in seconds.
+        :type base_delay: float
+        :param max_delay: Upper bound of any delay, in seconds.
+        :type max_delay: float
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Delay before retrying after the given (zero based) attempt failed.
+
+        A Retry-After given by the server is honored, up to `max_delay`.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Stops uploads to an endpoint that keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens and requests are refused. Once
+    `reset_timeout` seconds have passed a single trial request is let through: the circuit closes
+    again if it succeeds and re-opens otherwise.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Whether requests are currently refused, without using up the trial request."""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let a single trial request through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def _reset_locks_after_fork():
+    # A thread of the parent may have held these locks when it forked
+    global _circuit_breakers_lock
+    _circuit_breakers_lock = threading.Lock()
+    for circuit_breaker in _circuit_breakers.values():
+        circuit_breaker._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def get_circuit_breaker(url, failure_threshold=5, reset_timeout=30):
+    """
+    Circuit breaker of an endpoint, shared by every sender and upload worker of the process.
+    """
+    with _circuit_breakers_lock:
+        if url not in _circuit_breakers:
+            _circuit_breakers[url] = CircuitBreaker(failure_threshold, reset_timeout)
+        return _circuit_breakers[url]
@@ -0,0 +1,107 @@
+"""
+This module defines the sampling and rate limiting policy deciding which requests are audited.
+"""
+
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` events per second on average, and bursts of up to `burst` events.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self):
+        """
+        Take a token from the bucket.
+
+        :return: False if the bucket is empty.
+        :rtype: bool
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class SamplingPolicy:
+    """
+    Decides whether a request gets an audit record, from its method, route and status code only, so
+    that requests left out cost no more than this decision.
+
+    The sample rate of a request is looked up in `route_rates`, first as "METHOD /route" then as
+    "/route", then in `method_rates`, and defaults to `sample_rate`. Routes are the rules requests
+    matched, e.g. "/pets/<pet_id>" on Flask or "/pets/{pet_id}" on aiohttp. Error responses
+    (status 400 and above) are always kept when `keep_errors` is set, without counting against
+    `max_records_per_second`.
+    """
+
+    def __init__(
+        self,
+        sample_rate=1.0,
+        route_rates=None,
+        method_rates=None,
+        keep_errors=True,
+        max_records_per_second=None,
+        burst=None,
+    ):
+        """
+        :param sample_rate: Fraction of requests audited, between 0 and 1.
+        :type sample_rate: float
+        :param route_rates: Sample rates by route, or by method and route.
+        :type route_rates: dict[str, float] | None
+        :param method_rates: Sample rates by HTTP method.
+        :type method_rates: dict[str, float] | None
+        :param keep_errors: Always audit 4xx and 5xx responses.
+        :type keep_errors: bool
+        :param max_records_per_second: Cap on the sampled records per second, None for no cap.
+        :type max_records_per_second: float | None
+        :param burst: Records allowed in a burst above the cap, defaults to one second worth.
+        :type burst: int | None
+        """
+        self.sample_rate = sample_rate
+        self.route_rates = dict(route_rates or {})
+        self.method_rates = {method.upper(): rate for method, rate in (method_rates or {}).items()}
+        self.keep_errors = keep_errors
+        self.bucket = TokenBucket(max_records_per_second, burst) if max_records_per_second is not None else None
+
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self._keep_all = sample_rate >= 1 and not self.route_rates and not self.method_rates and self.bucket is None
+
+    def rate_for(self, method, route):
+        rates = self.route_rates
+        if rates:
+            rate = rates.get("{} {}".format(method, route))
+            if rate is None:
+                rate = rates.get(route)
+            if rate is not None:
+                return rate
+        return self.method_rates.get(method, self.sample_rate)
+
+    def should_sample(self, method, route, status_code):
+        """
+        :rtype: bool
+        """
+        if self._keep_all or (self.keep_errors and status_code >= 400):
+            return True
+        rate = self.rate_for(method, route)
+        if rate < 1 and (rate <= 0 or random.random() >= rate):
+            self.sampled_out += 1
+            return False
+        if self.bucket is not None and not self.bucket.consume():
+            self.rate_limited += 1
+            return False
+        return True
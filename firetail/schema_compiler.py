@@ -0,0 +1,355 @@
+"""
+This module defines the compiler turning JSON schemas into specialized Python checks, used as a
+fast path in front of the jsonschema validators.
+
+A compiled check only answers whether an instance is valid. It is conservative: it returns True
+only when the jsonschema validator would accept the instance, and False whenever it is invalid or
+the check cannot tell, e.g. for keywords it does not support. The jsonschema validator then runs as
+usual, so invalid instances are reported with exactly the same errors as without compilation.
+"""
+
+import logging
+import numbers
+import re
+
+from jsonschema import Draft4Validator
+
+from .json_schema import Draft4RequestValidator, Draft4ResponseValidator
+
+logger = logging.getLogger("firetail.schema_compiler")
+
+REQUEST = "request"
+RESPONSE = "response"
+
+# Validator classes whose semantics the compiler reproduces, with the OpenAPI extensions they add
+COMPILABLE_VALIDATORS = {Draft4Validator: None, Draft4RequestValidator: REQUEST, Draft4ResponseValidator: RESPONSE}
+
+TYPE_CHECKS = {
+    "string": "isinstance(x, str)",
+    "integer": "(isinstance(x, int) and not isinstance(x, bool))",
+    "number": "(isinstance(x, Number) and not isinstance(x, bool))",
+    "boolean": "isinstance(x, bool)",
+    "object": "isinstance(x, dict)",
+    "array": "isinstance(x, list)",
+    "null": "x is None",
+}
+
+# Keywords of the Draft 4 validators the generated code checks itself
+SUPPORTED_KEYWORDS = frozenset(
+    {
+        "type",
+        "enum",
+        "format",
+        "minLength",
+        "maxLength",
+        "pattern",
+        "minimum",
+        "maximum",
+        "multipleOf",
+        "minItems",
+        "maxItems",
+        "uniqueItems",
+        "items",
+        "additionalItems",
+        "minProperties",
+        "maxProperties",
+        "required",
+        "properties",
+        "additionalProperties",
+        "allOf",
+        "anyOf",
+    }
+)
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def _enum_key(value):
+    return (type(value), value)
+
+
+def _unique_scalars(items):
+    # 1 and 1.0 are the same JSON number, share a key so that they are never reported unique
+    seen = set()
+    for item in items:
+        if type(item) not in _SCALAR_TYPES:
+            return False
+        key = ("number", item) if type(item) in (int, float) else (type(item), item)
+        if key in seen:
+            return False
+        seen.add(key)
+    return True
+
+
+class SchemaCompiler:
+    """
+    Generates the source of one function per schema, then executes it once.
+    """
+
+    def __init__(self, validator_class=Draft4Validator, format_checker=None):
+        """
+        :param validator_class: jsonschema validator class whose semantics are reproduced.
+        :param format_checker: Format checker used by the validator, None if formats are not checked.
+        :type format_checker: jsonschema.FormatChecker | None
+        """
+        if validator_class not in COMPILABLE_VALIDATORS:
+            raise ValueError("Cannot compile schemas for {!r}".format(validator_class))
+        self.validator_class = validator_class
+        self.mode = COMPILABLE_VALIDATORS[validator_class]
+        self.format_checker = format_checker
+        self._functions = {}
+        self._sources = []
+        self._namespace = {"Number": numbers.Number, "SCALAR_TYPES": _SCALAR_TYPES, "unique": _unique_scalars}
+
+    def compile(self, schema):
+        """
+        :type schema: dict
+        :return: Function telling whether an instance is valid.
+        :rtype: types.FunctionType
+        """
+        name = self._function(schema)
+        code = compile("\n\n".join(self._sources), "<firetail compiled schema>", "exec")
+        exec(code, self._namespace)
+        return self._namespace[name]
+
+    def _constant(self, value):
+        name = "C{}".format(len(self._namespace))
+        self._namespace[name] = value
+        return name
+
+    def _function(self, schema):
+        # Schemas are memoized by identity, which also ends recursion through cyclic schemas
+        key = id(schema)
+        name = self._functions.get(key)
+        if name is not None:
+            return name
+        name = self._functions[key] = "check_{}".format(len(self._functions))
+        # Keep the schema alive, so that its id is not reused while compiling
+        self._constant(schema)
+
+        lines = self._body(schema)
+        self._sources.append("def {}(x):\n    ".format(name) + "\n    ".join(lines + ["return True"]))
+        return name
+
+    def _unsupported(self, schema):
+        if not isinstance(schema, dict):
+            return True
+        for keyword in schema:
+            if keyword in self.validator_class.VALIDATORS and keyword not in SUPPORTED_KEYWORDS:
+                # $ref, oneOf, not, readOnly in requests, writeOnly in responses...
+                return True
+        return False
+
+    def _nullable(self, schema):
+        return self.mode is not None and (schema.get("x-nullable") is True or bool(schema.get("nullable")))
+
+    def _body(self, schema):
+        if self._unsupported(schema):
+            return ["return False"]
+
+        lines = []
+        nullable = self._nullable(schema)
+        types = schema.get("type")
+        if types is not None:
+            types = [types] if isinstance(types, str) else types
+            if not all(isinstance(t, str) and t in TYPE_CHECKS for t in types):
+                return ["return False"]
+            check = " or ".join(TYPE_CHECKS[t] for t in types) or "False"
+            if nullable:
+                check = "x is None or " + check
+            lines.append("if not ({}): return False".format(check))
+
+        if "enum" in schema:
+            enum = schema["enum"]
+            if not isinstance(enum, list):
+                return ["return False"]
+            # Only scalars that compare equal and have the same type are matched, anything else is
+            # left to jsonschema and its own notion of equality
+            values = frozenset(_enum_key(v) for v in enum if type(v) in _SCALAR_TYPES and v == v)
+            check = "type(x) in SCALAR_TYPES and (type(x), x) in {}".format(self._constant(values))
+            if nullable:
+                check = "x is None or " + check
+            lines.append("if not ({}): return False".format(check))
+
+        if "format" in schema and self.format_checker is not None:
+            conforms = self._constant(self.format_checker.conforms)
+            lines.append("if not {}(x, {!r}): return False".format(conforms, schema["format"]))
+
+        lines += self._indent("if isinstance(x, str):", self._string(schema))
+        lines += self._indent("if isinstance(x, Number) and not isinstance(x, bool):", self._number(schema))
+        lines += self._indent("if isinstance(x, list):", self._array(schema))
+        lines += self._indent("if isinstance(x, dict):", self._object(schema))
+
+        for subschema in schema.get("allOf", ()):
+            lines.append("if not {}(x): return False".format(self._function(subschema)))
+        if schema.get("anyOf"):
+            check = " or ".join("{}(x)".format(self._function(subschema)) for subschema in schema["anyOf"])
+            lines.append("if not ({}): return False".format(check))
+        return lines
+
+    @staticmethod
+    def _indent(condition, lines):
+        if not lines:
+            return []
+        return [condition] + ["    " + line for line in lines]
+
+    def _string(self, schema):
+        lines = []
+        if "minLength" in schema:
+            lines.append("if len(x) < {!r}: return False".format(schema["minLength"]))
+        if "maxLength" in schema:
+            lines.append("if len(x) > {!r}: return False".format(schema["maxLength"]))
+        if "pattern" in schema:
+            try:
+                pattern = re.compile(schema["pattern"])
+            except (re.error, TypeError):
+                return ["return False"]
+            lines.append("if {}.search(x) is None: return False".format(self._constant(pattern)))
+        return lines
+
+    def _number(self, schema):
+        lines = []
+        for keyword, exclusive, operator, exclusive_operator in (
+            ("minimum", "exclusiveMinimum", "<", "<="),
+            ("maximum", "exclusiveMaximum", ">", ">="),
+        ):
+            if keyword in schema:
+                if not isinstance(schema[keyword], numbers.Number):
+                    return ["return False"]
+                operator = exclusive_operator if schema.get(exclusive, False) else operator
+                lines.append("if x {} {!r}: return False".format(operator, schema[keyword]))
+        if "multipleOf" in schema:
+            multiple_of = schema["multipleOf"]
+            if isinstance(multiple_of, int) and not isinstance(multiple_of, bool) and multiple_of > 0:
+                lines.append("if not isinstance(x, int) or x % {!r}: return False".format(multiple_of))
+            else:
+                # Float divisions are left to jsonschema and its rounding
+                lines.append("return False")
+        return lines
+
+    def _array(self, schema):
+        lines = []
+        if "minItems" in schema:
+            lines.append("if len(x) < {!r}: return False".format(schema["minItems"]))
+        if "maxItems" in schema:
+            lines.append("if len(x) > {!r}: return False".format(schema["maxItems"]))
+        if schema.get("uniqueItems"):
+            lines.append("if not unique(x): return False")
+        items = schema.get("items")
+        if isinstance(items, dict):
+            lines.append("for item in x:")
+            lines.append("    if not {}(item): return False".format(self._function(items)))
+        elif isinstance(items, list):
+            for index, subschema in enumerate(items):
+                lines.append(
+                    "if len(x) > {0} and not {1}(x[{0}]): return False".format(index, self._function(subschema))
+                )
+            additional = schema.get("additionalItems", True)
+            if isinstance(additional, dict):
+                lines.append("for item in x[{}:]:".format(len(items)))
+                lines.append("    if not {}(item): return False".format(self._function(additional)))
+            elif not additional:
+                lines.append("if len(x) > {}: return False".format(len(items)))
+        elif items is not None:
+            lines.append("return False")
+        return lines
+
+    def _object(self, schema):
+        lines = []
+        if "minProperties" in schema:
+            lines.append("if len(x) < {!r}: return False".format(schema["minProperties"]))
+        if "maxProperties" in schema:
+            lines.append("if len(x) > {!r}: return False".format(schema["maxProperties"]))
+
+        properties = schema.get("properties", {})
+        required = schema.get("required", [])
+        if not isinstance(properties, dict) or not isinstance(required, list):
+            return ["return False"]
+        required = [name for name in required if not self._exempt(properties.get(name))]
+        if required:
+            lines.append("for name in {}:".format(self._constant(tuple(required))))
+            lines.append("    if name not in x: return False")
+
+        for name, subschema in properties.items():
+            lines.append("if {0!r} in x and not {1}(x[{0!r}]): return False".format(name, self._function(subschema)))
+
+        additional = schema.get("additionalProperties", True)
+        if isinstance(additional, dict):
+            lines.append("for name, value in x.items():")
+            lines.append(
+                "    if name not in {} and not {}(value): return False".format(
+                    self._constant(frozenset(properties)), self._function(additional)
+                )
+            )
+        elif not additional:
+            lines.append("for name in x:")
+            lines.append("    if name not in {}: return False".format(self._constant(frozenset(properties))))
+        return lines
+
+    def _exempt(self, subschema):
+        """
+        Whether a missing required property is accepted, see `json_schema.validate_required`.
+        """
+        if not isinstance(subschema, dict):
+            return False
+        if self.mode == REQUEST:
+            return bool(subschema.get("readOnly"))
+        if self.mode == RESPONSE:
+            return bool(subschema.get("writeOnly")) or subschema.get("x-writeOnly") is True
+        return False
+
+
+class CompiledValidator:
+    """
+    Wraps a jsonschema validator with the compiled check of its schema.
+
+    Valid instances are accepted by the compiled check alone, anything else is validated again by
+    the wrapped validator, which raises its usual errors.
+    """
+
+    def __init__(self, validator, check):
+        """
+        :type validator: jsonschema.IValidator
+        :type check: types.FunctionType
+        """
+        self.validator = validator
+        self.check = check
+
+    def _accepts(self, instance):
+        try:
+            return self.check(instance)
+        except Exception:
+            # e.g. RecursionError on deeply nested instances
+            return False
+
+    def validate(self, instance):
+        if not self._accepts(instance):
+            self.validator.validate(instance)
+
+    def is_valid(self, instance):
+        return self._accepts(instance) or self.validator.is_valid(instance)
+
+    def iter_errors(self, instance):
+        if self._accepts(instance):
+            return iter(())
+        return self.validator.iter_errors(instance)
+
+    def __getattr__(self, name):
+        return getattr(self.validator, name)
+
+
+def compile_validator(validator):
+    """
+    Compile the schema of a validator.
+
+    :type validator: jsonschema.IValidator
+    :return: A `CompiledValidator`, or the validator itself if its class is not compilable.
+    """
+    if isinstance(validator, CompiledValidator) or type(validator) not in COMPILABLE_VALIDATORS:
+        return validator
+    try:
+        check = SchemaCompiler(type(validator), validator.format_checker).compile(validator.schema)
+    except (RecursionError, SyntaxError, TypeError, ValueError) as e:
+        logger.debug("Could not compile schema, validating it with jsonschema. Exception: %s", e)
+        return validator
+    return CompiledValidator(validator, check)
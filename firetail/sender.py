@@ -1,16 +1,39 @@
 # This class is responsible for handling all asynchronous firetail's
 # communication
+import atexit
 import json
 import logging as loger4
+import os
 import queue
-import sys
-from datetime import datetime
-from threading import Thread, enumerate
-from time import sleep
-
-import requests
+import weakref
+from threading import Event, Thread
+from time import monotonic
 
+from .audit_metrics import PipelineMetrics
+from .audit_queue import (
+    DEFAULT_MAX_QUEUE_BYTES,
+    DEFAULT_MAX_QUEUE_RECORDS,
+    DROP_NEWEST,
+    SPILL,
+    AuditQueue,
+)
+from .compression import BatchEncoder
 from .logger import get_stdout_logger
+from .retry import (
+    FATAL,
+    SUCCESS,
+    RetryPolicy,
+    classify_status,
+    get_circuit_breaker,
+    parse_retry_after,
+)
+from .sinks import HttpSink
+from .spill import (
+    DEFAULT_MAX_SPILL_BYTES,
+    DEFAULT_SPILL_DIRECTORY,
+    FSYNC_INTERVAL,
+    SpillQueue,
+)
 
 # loger4.basicConfig(filename="here.log",
 #                             filemode='a',
@@ -21,12 +44,24 @@ from .logger import get_stdout_logger
 
 MAX_BULK_SIZE_IN_BYTES = 1 * 1024 * 1024  # 1 MB
 
+# Live senders, reset in the children of pre-fork servers
+_senders = weakref.WeakSet()
+
+
+def _reset_senders_after_fork():
+    for sender in list(_senders):
+        sender._after_fork_in_child()
+
 
-def backup_logs(logs, logger):
-    timestamp = datetime.now().strftime("%d%m%Y-%H%M%S")
-    logger.info("Backing up your logs to firetail-failures-%s.txt", timestamp)
-    with open("firetail-failures-{}.txt".format(timestamp), "a") as f:
-        f.writelines("\n".join(logs))
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_senders_after_fork)
+
+
+@atexit.register
+def _close_senders_at_exit():
+    # Upload workers are daemon threads, so they are still running when atexit handlers are called
+    for sender in list(_senders):
+        sender.close(sender.logs_drain_timeout)
 
 
 class FiretailSender:
@@ -40,55 +75,296 @@ class FiretailSender:
         network_timeout=10.0,
         number_of_retries=4,
         retry_timeout=2,
+        max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES,
+        max_queue_records=DEFAULT_MAX_QUEUE_RECORDS,
+        overflow_policy=DROP_NEWEST,
+        queue_block_timeout=1.0,
+        compression=None,
+        compression_level=None,
+        max_batch_bytes=MAX_BULK_SIZE_IN_BYTES,
+        max_batch_records=None,
+        upload_workers=1,
+        flush_linger=None,
+        max_retry_delay=60,
+        circuit_breaker_threshold=5,
+        circuit_breaker_reset_timeout=30,
+        spill_directory=DEFAULT_SPILL_DIRECTORY,
+        max_spill_bytes=DEFAULT_MAX_SPILL_BYTES,
+        spill_fsync=FSYNC_INTERVAL,
+        metrics=None,
+        sink=None,
     ):
         self.token = token
         self.url = url
+        # Where batches are written, FireTail's bulk endpoint unless another sink is given
+        self.sink = sink if sink is not None else HttpSink(url, token, network_timeout, pool_size=upload_workers)
         self.logs_drain_timeout = logs_drain_timeout
         self.stdout_logger = get_stdout_logger(debug)
         self.backup_logs = backup_logs
         self.network_timeout = network_timeout
-        self.requests_session = requests.Session()
+        self.upload_workers = upload_workers
         self.number_of_retries = number_of_retries
         self.retry_timeout = retry_timeout
+        self.retry_policy = RetryPolicy(base_delay=retry_timeout, max_delay=max_retry_delay)
+        self.circuit_breaker = get_circuit_breaker(
+            self.sink.name, circuit_breaker_threshold, circuit_breaker_reset_timeout
+        )
+        self.compression = compression
+        self.compression_level = compression_level
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_records = max_batch_records
+        # How long a partial batch may wait for more records before it is sent
+        self.flush_linger = logs_drain_timeout if flush_linger is None else flush_linger
+        # Fail early on an unknown or unavailable compression
+        BatchEncoder(compression, compression_level)
+
+        # Set by `close`, stops the upload workers and cuts their waits short
+        self._closing = Event()
 
-        # Function to see if the main thread is alive
-        self.is_main_thread_active = lambda: any((i.name == "MainThread") and i.is_alive() for i in enumerate())
+        # Batches that could not be sent are spilled to disk and replayed later
+        self.spill_directory = spill_directory
+        self.max_spill_bytes = max_spill_bytes
+        self.spill_fsync = spill_fsync
+        self.spill_queue = SpillQueue(spill_directory, max_bytes=max_spill_bytes, fsync=spill_fsync)
+        self._replay_event = Event()
+        self.replay_thread = None
 
-        # Create a queue to hold logs
-        self.queue = queue.Queue()
+        # Create a bounded queue to hold logs
+        self.max_queue_bytes = max_queue_bytes
+        self.max_queue_records = max_queue_records
+        self.overflow_policy = overflow_policy
+        self.queue_block_timeout = queue_block_timeout
+        self.queue = self._create_queue()
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self._register_metrics()
+
+        self.pid = os.getpid()
+        _senders.add(self)
+
+        self.sending_threads = []
         self._initialize_sending_thread()
 
+    def _create_queue(self):
+        return AuditQueue(
+            max_bytes=self.max_queue_bytes,
+            max_records=self.max_queue_records,
+            overflow_policy=self.overflow_policy,
+            block_timeout=self.queue_block_timeout,
+            spill_handler=self._spill,
+        )
+
+    def _after_fork_in_child(self):
+        """
+        Give a forked child its own pipeline. Its threads did not survive the fork, and the queue,
+        sink, spill queue and their locks are shared with the parent or may have been held by one
+        of its threads. Upload workers are started again by the next `append`.
+        """
+        self.pid = os.getpid()
+        # Records queued before the fork are the parent's to send
+        self.queue = self._create_queue()
+        self.sink.after_fork()
+        # Each process spills to its own directory, adopted by the next sender started once it exited
+        self.spill_queue = SpillQueue(self.spill_directory, max_bytes=self.max_spill_bytes, fsync=self.spill_fsync)
+        self._replay_event = Event()
+        self.replay_thread = None
+        self.sending_threads = []
+        self._closing = Event()
+        self.metrics.after_fork()
+
     def __del__(self):
         del self.stdout_logger
         del self.backup_logs
         del self.queue
 
+    def _register_metrics(self):
+        metrics = self.metrics
+        metrics.gauge("queue_records", lambda: self.queue.qsize(), "Audit records waiting in the queue.")
+        metrics.gauge("queue_bytes", lambda: self.queue.nbytes, "Bytes of audit records waiting in the queue.")
+        metrics.gauge("spill_bytes", lambda: self.spill_queue.nbytes, "Bytes of audit records spilled to disk.")
+        metrics.gauge(
+            "circuit_open", lambda: int(self.circuit_breaker.is_open()), "Whether uploads are currently refused."
+        )
+        metrics.gauge("upload_workers", lambda: sum(t.is_alive() for t in self.sending_threads), "Live upload workers.")
+        metrics.counter("records_dropped", lambda: self.queue.dropped, "Audit records dropped by the full queue.")
+        metrics.counter(
+            "records_overflowed", lambda: self.queue.spilled, "Audit records spilled to disk by the full queue."
+        )
+        metrics.counter(
+            "records_dropped_on_disk",
+            lambda: self.spill_queue.dropped,
+            "Audit records dropped by the full spill queue.",
+        )
+
     def _initialize_sending_thread(self):
-        self.sending_thread = Thread(target=self._drain_queue)
-        self.sending_thread.daemon = False
-        self.sending_thread.name = "firetail-sending-thread"
-        self.sending_thread.start()
+        # (Re)start any upload worker that is not running
+        self.sending_threads = [thread for thread in self.sending_threads if thread.is_alive()]
+        while len(self.sending_threads) < max(self.upload_workers, 1):
+            thread = Thread(target=self._drain_queue)
+            # Daemon threads do not hold up the interpreter exit, they are drained and joined by
+            # `close`, registered with atexit
+            thread.daemon = True
+            thread.name = "firetail-sending-thread"
+            if self.upload_workers > 1:
+                thread.name += "-{}".format(len(self.sending_threads))
+            thread.start()
+            self.sending_threads.append(thread)
+        self.sending_thread = self.sending_threads[0]
+
+        if not self.spill_queue.empty():
+            self._initialize_replay_thread()
+
+    def _initialize_replay_thread(self):
+        if self.replay_thread is not None and self.replay_thread.is_alive():
+            return
+        # Spilled logs are safe on disk, the replay does not need to hold up the interpreter exit
+        self.replay_thread = Thread(target=self._replay_spilled)
+        self.replay_thread.daemon = True
+        self.replay_thread.name = "firetail-replay-thread"
+        self.replay_thread.start()
 
     def append(self, logs_message):
+        self.append_encoded(json.dumps(logs_message).encode("utf-8"))
+
+    def append_encoded(self, logs_message):
+        """
+        Queue a log record that is already serialized to JSON, skipping the
+        encoding done by `append`.
+        """
+        if self._closing.is_set():
+            self.stdout_logger.debug("Sender is closed, dropped log")
+            return
         if not self.sending_thread.is_alive():
             self._initialize_sending_thread()
 
-        # Queue lib is thread safe, no issue here
-        self.queue.put(json.dumps(logs_message))
+        # Records are kept as UTF-8 so batches can be sized by their exact wire length
+        if isinstance(logs_message, str):
+            logs_message = logs_message.encode("utf-8")
+
+        # Queue is thread safe, no issue here
+        if self.queue.put(logs_message):
+            self.metrics.inc("records_enqueued")
+            self.metrics.inc("bytes_enqueued", len(logs_message))
+        elif self.queue.overflow_policy != SPILL:
+            self.stdout_logger.debug("Audit queue is full, dropped log (%s dropped so far)", self.queue.dropped)
+
+    @property
+    def dropped_records(self):
+        """Number of records dropped because the queue was full."""
+        return self.queue.dropped
+
+    def _spill(self, logs):
+        if not self.spill_queue.append(logs):
+            raise OverflowError("Spill queue is full")
+        self._initialize_replay_thread()
+        self._replay_event.set()
+
+    def _backup(self, logs_list):
+        self.stdout_logger.error(
+            "Could not send logs to firetail after %s tries, " "backing up to local file system",
+            self.number_of_retries,
+        )
+        try:
+            self._spill(logs_list)
+            self.metrics.inc("records_backed_up", len(logs_list))
+        except Exception as e:
+            self.stdout_logger.error("Could not back up %s logs, dropping them. Exception: %s", len(logs_list), e)
+
+    def _replay_spilled(self):
+        while not self._closing.is_set():
+            self._replay_event.clear()
+            segment = self.spill_queue.oldest_segment()
+            if segment is None:
+                self._replay_event.wait(self.logs_drain_timeout)
+                continue
+
+            if self.circuit_breaker.is_open():
+                # Wait for the backend to recover before replaying anything
+                self._closing.wait(self.circuit_breaker.reset_timeout)
+                continue
+
+            if not self._replay_segment(segment):
+                self._closing.wait(self.retry_policy.max_delay)
+
+    def _replay_segment(self, segment):
+        try:
+            logs = self.spill_queue.read_segment(segment)
+        except FileNotFoundError:
+            # Deleted from under the queue, move on to the next segment
+            self.stdout_logger.debug("Spilled logs %s are gone, skipping them", segment)
+            self.spill_queue.remove(segment)
+            return True
+
+        try:
+            # Batches the backend rejects for good are dropped along with the segment
+            delivered = all(self._send_batch(logs_list, body) for logs_list, body in self._batches(logs))
+            if delivered:
+                self.spill_queue.remove(segment)
+        except Exception as e:
+            self.stdout_logger.debug("Unexpected exception while replaying spilled logs. Exception: %s", e)
+            return False
+
+        if delivered:
+            self.metrics.inc("records_replayed", len(logs))
+            self.stdout_logger.debug("Replayed %s spilled logs to firetail", len(logs))
+        return delivered
+
+    def _batches(self, logs):
+        logs_list = []
+        batch = BatchEncoder(self.compression, self.compression_level)
+        for log in logs:
+            if logs_list and (
+                batch.size + len(log) + 1 > self.max_batch_bytes
+                or (self.max_batch_records is not None and batch.records >= self.max_batch_records)
+            ):
+                yield logs_list, batch.finish()
+                logs_list = []
+                batch = BatchEncoder(self.compression, self.compression_level)
+            batch.write(log)
+            logs_list.append(log)
+        if logs_list:
+            yield logs_list, batch.finish()
 
     def flush(self):
         self._flush_queue()
 
-    def _drain_queue(self):
-        last_try = False
+    def close(self, timeout=None):
+        """
+        Stop the sender: send the queued records, then join the upload workers.
+
+        Records still queued once `timeout` seconds have passed are backed up to disk if
+        `backup_logs` is set, and dropped otherwise. Retries are cut short once the sender is
+        closing. Records appended after `close` are dropped.
+
+        :param timeout: Maximum number of seconds to wait, None to wait until everything is sent.
+        :type timeout: float | None
+        :return: True if every queued record was sent.
+        :rtype: bool
+        """
+        if self._closing.is_set() and not any(thread.is_alive() for thread in self.sending_threads):
+            return self.queue.empty()
+        deadline = None if timeout is None else monotonic() + timeout
+        self._closing.set()
+        self.queue.close()
+        self._replay_event.set()
 
-        while not last_try:
-            # If main is exited, we should run one last time and try to remove
-            # all logs
-            if not self.is_main_thread_active():
-                self.stdout_logger.debug("Identified quit of main thread, sending logs one " "last time")
-                last_try = True
+        for thread in self.sending_threads + [self.replay_thread]:
+            if thread is not None and thread.is_alive():
+                thread.join(None if deadline is None else max(deadline - monotonic(), 0))
 
+        leftover = self.queue.drain()
+        if leftover:
+            self.stdout_logger.debug("Could not send %s logs before closing", len(leftover))
+            if self.backup_logs:
+                self._backup(leftover)
+            else:
+                self.metrics.inc("batches_failed")
+        self.spill_queue.close()
+        self.sink.close()
+        _senders.discard(self)
+        return not leftover
+
+    def _drain_queue(self):
+        while not self._closing.is_set():
             try:
                 self._flush_queue()
             except Exception as e:
@@ -96,97 +372,130 @@ class FiretailSender:
                     "Unexpected exception while draining queue to firetail, " "swallowing. Exception: %s", e
                 )
 
-            if not last_try:
-                sleep(self.logs_drain_timeout)
+            # Wake up as soon as a full batch is queued, when the oldest record
+            # has lingered long enough, or when the sender is closed.
+            self.queue.wait_for_batch(
+                self.max_batch_bytes,
+                self.max_batch_records,
+                linger=self.flush_linger,
+                idle_timeout=self.logs_drain_timeout,
+            )
+
+        # Last pass, sending what is left before `close` gives up
+        try:
+            self._flush_queue()
+        except Exception as e:
+            self.stdout_logger.debug("Unexpected exception while draining queue to firetail. Exception: %s", e)
 
     def _flush_queue(self):
         # Sending logs until queue is empty
         loger4.info(self.url)
         while not self.queue.empty():
-            logs_list = self._get_messages_up_to_max_allowed_size()
-            self.stdout_logger.debug("Starting to drain %s logs to firetail", len(logs_list))
-
-            # Not configurable from the outside
-            sleep_between_retries = self.retry_timeout
-            self.number_of_retries = self.number_of_retries
-
-            should_backup_to_disk = True
-            headers = {"Content-type": "application/x-ndjson", "x-ft-api-key": self.token}
-
-            for current_try in range(self.number_of_retries):
-                should_retry = False
-                try:
-                    response = self.requests_session.post(
-                        self.url, headers=headers, data="\n".join(logs_list), timeout=self.network_timeout
-                    )
-                    # loger4.info(response.text)
-                    # self.stdout_logger.info(str(response.status_code))
-                    if response.status_code != 200:
-                        if response.status_code == 400:
-                            self.stdout_logger.debug(
-                                "Got 400 code from firetail. This means that "
-                                "some of your logs are too big, or badly "
-                                "formatted. response: %s",
-                                response.text,
-                            )
-                            should_backup_to_disk = False
-                            should_retry = False
-                            break
-
-                        if response.status_code == 401:
-                            self.stdout_logger.debug(
-                                "You are not authorized with firetail! Token " "OK? dropping logs..."
-                            )
-                            should_backup_to_disk = False
-                            break
-                        else:
-                            self.stdout_logger.debug(
-                                "Got %s while sending logs to firetail, " "Try (%s/%s). Response: %s",
-                                response.status_code,
-                                current_try + 1,
-                                self.number_of_retries,
-                                response.status_code,
-                            )
-                            should_retry = False
+            logs_list, body = self._get_messages_up_to_max_allowed_size()
+            if logs_list and not self._send_batch(logs_list, body) and self.backup_logs:
+                self._backup(logs_list)
+
+    def _send_batch(self, logs_list, body):
+        """
+        Send a batch, retrying transient failures.
+
+        :return: False if the batch could not be delivered and should be backed up, True if it was
+            delivered or rejected for good by the backend.
+        :rtype: bool
+        """
+        self.stdout_logger.debug("Starting to drain %s logs to firetail", len(logs_list))
+
+        should_backup_to_disk = True
+        delivered = False
+        for current_try in range(self.number_of_retries):
+            if not self.circuit_breaker.allow_request():
+                self.stdout_logger.debug("Circuit to firetail is open, not sending %s logs", len(logs_list))
+                break
+
+            retry_after = None
+            started_at = monotonic()
+            try:
+                response = self.sink.send(body, logs_list, self.compression)
+            except Exception as e:
+                self.metrics.inc("upload_errors")
+                self.stdout_logger.warning(
+                    "Got exception while sending logs to firetail, " "Try (%s/%s). Message: %s",
+                    current_try + 1,
+                    self.number_of_retries,
+                    e,
+                )
+                self.circuit_breaker.record_failure()
+            else:
+                self.metrics.observe_response(response.status_code, monotonic() - started_at)
+                outcome = classify_status(response.status_code)
+                if outcome == SUCCESS:
+                    self.stdout_logger.debug("Successfully sent bulk of %s logs to " "firetail", len(logs_list))
+                    self.circuit_breaker.record_success()
+                    should_backup_to_disk = False
+                    delivered = True
+                    break
+
+                if outcome == FATAL:
+                    # The backend is up and answering, retrying will not help. Neither would backing
+                    # the batch up, its replay would be rejected again and hold up every later one.
+                    self.circuit_breaker.record_success()
+                    should_backup_to_disk = False
+                    if response.status_code == 400:
+                        self.stdout_logger.debug(
+                            "Got 400 code from firetail. This means that "
+                            "some of your logs are too big, or badly "
+                            "formatted. response: %s",
+                            response.text,
+                        )
+                    elif response.status_code == 401:
+                        self.stdout_logger.debug("You are not authorized with firetail! Token " "OK? dropping logs...")
                     else:
-                        self.stdout_logger.debug("Successfully sent bulk of %s logs to " "firetail", len(logs_list))
-                        should_backup_to_disk = False
-                        break
-                except Exception as e:
-                    self.stdout_logger.warning(
-                        "Got exception while sending logs to firetail, " "Try (%s/%s). Message: %s",
-                        current_try + 1,
-                        self.number_of_retries,
-                        e,
-                    )
-                    should_retry = True
-
-                if should_retry:
-                    sleep(sleep_between_retries)
-
-            if should_backup_to_disk and self.backup_logs:
-                # Write to file
-                self.stdout_logger.error(
-                    "Could not send logs to firetail after %s tries, " "backing up to local file system",
+                        self.stdout_logger.debug(
+                            "Got %s while sending logs to firetail, dropping them. Response: %s",
+                            response.status_code,
+                            response.text,
+                        )
+                    break
+
+                self.stdout_logger.debug(
+                    "Got %s while sending logs to firetail, " "Try (%s/%s). Response: %s",
+                    response.status_code,
+                    current_try + 1,
                     self.number_of_retries,
+                    response.text,
                 )
-                backup_logs(logs_list, self.stdout_logger)
+                self.circuit_breaker.record_failure()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
 
-            del logs_list
+            if current_try + 1 < self.number_of_retries:
+                # Closing cuts the backoff short, the batch is then backed up
+                if self._closing.wait(self.retry_policy.backoff(current_try, retry_after)):
+                    break
+                self.metrics.inc("retries")
+
+        if delivered:
+            self.metrics.inc("batches_sent")
+            self.metrics.inc("records_sent", len(logs_list))
+            self.metrics.inc("bytes_sent", len(body))
+        else:
+            self.metrics.inc("batches_failed")
+        return not should_backup_to_disk
 
     def _get_messages_up_to_max_allowed_size(self):
         logs_list = []
-        current_size = 0
-        while not self.queue.empty():
-            current_log = self.queue.get()
-
+        # The size limit applies to the body as sent, so after compression
+        batch = BatchEncoder(self.compression, self.compression_level)
+        while self.max_batch_records is None or batch.records < self.max_batch_records:
+            # A record always makes it into an empty batch, even if it is
+            # bigger than the limit on its own. The extra byte is the newline.
+            max_size = self.max_batch_bytes - batch.size - 1 if batch.records else None
             try:
-                current_size += sys.getsizeof(current_log)
-            except TypeError:
-                # pypy do not support sys.getsizeof
-                current_size += len(current_log) * 4
+                current_log = self.queue.get_up_to(max_size)
+            except queue.Empty:
+                break
+            if current_log is None:
+                break
 
+            batch.write(current_log)
             logs_list.append(current_log)
-            if current_size >= MAX_BULK_SIZE_IN_BYTES:
-                break
-        return logs_list
+        return logs_list, batch.finish()
@@ -0,0 +1,221 @@
+"""
+This module defines the sinks audit record batches are written to.
+
+Senders batch, compress and retry the same way whatever the sink, a sink only writes one batch.
+Use `HttpSink` to upload to FireTail, `FileSink` or `StdoutSink` to keep the records locally, and
+`MemorySink` to look at them in tests and benchmarks.
+"""
+
+import abc
+import collections
+import os
+import sys
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .compression import GZIP, ZSTD, compress
+
+
+class SinkResponse:
+    """
+    Outcome of a write to a sink, with the attributes of the `requests` response the senders read.
+    """
+
+    def __init__(self, status_code=200, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class Sink(metaclass=abc.ABCMeta):
+    """
+    Base class of the sinks.
+
+    `send` either returns a response, whose status code is classified like an HTTP upload, or
+    raises an exception, which is retried like a network error.
+    """
+
+    #: Key of the circuit breaker guarding the sink, shared by the senders writing to the same place.
+    name = None
+
+    @abc.abstractmethod
+    def send(self, body, records, encoding=None):
+        """
+        Write a batch.
+
+        :param body: Newline delimited records, compressed with `encoding`.
+        :type body: bytes
+        :param records: The records of the batch, before compression.
+        :type records: list[bytes]
+        :param encoding: Compression of the body, None, "gzip" or "zstd".
+        :type encoding: str | None
+        :rtype: SinkResponse | requests.Response
+        """
+
+    def after_fork(self):
+        """
+        Reset the state that must not be shared with the parent process, called in forked children.
+        """
+
+    def close(self):
+        pass
+
+
+class HttpSink(Sink):
+    """
+    Uploads batches to the FireTail bulk endpoint, or any endpoint accepting NDJSON.
+    """
+
+    def __init__(self, url, token=None, network_timeout=10.0, pool_size=1):
+        """
+        :param url: Bulk endpoint the batches are posted to.
+        :type url: str
+        :param token: FireTail API token, sent in the x-ft-api-key header.
+        :type token: str | None
+        :param network_timeout: Timeout of each request, in seconds.
+        :type network_timeout: float
+        :param pool_size: Connections kept open, one per upload worker.
+        :type pool_size: int
+        """
+        self.name = url
+        self.url = url
+        self.token = token
+        self.network_timeout = network_timeout
+        self.pool_size = max(pool_size, 1)
+        self.session = self._create_session()
+
+    def _create_session(self):
+        # All upload workers share one session, its pool keeps a connection per worker
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def send(self, body, records, encoding=None):
+        headers = {"Content-type": "application/x-ndjson", "x-ft-api-key": self.token}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return self.session.post(self.url, headers=headers, data=body, timeout=self.network_timeout)
+
+    def after_fork(self):
+        self.session = self._create_session()
+
+    def close(self):
+        self.session.close()
+
+
+class _StreamSink(Sink):
+    # Batches are written one after the other, each ended by a newline. A compressed batch is a
+    # complete gzip member or zstd frame, and both formats allow them to be concatenated.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._newlines = {}
+
+    def _newline(self, encoding):
+        newline = self._newlines.get(encoding)
+        if newline is None:
+            newline = self._newlines[encoding] = compress(b"\n", encoding)
+        return newline
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+
+class FileSink(_StreamSink):
+    """
+    Appends batches to an NDJSON file, rotated once it reaches `max_bytes`.
+
+    Rotation works like `logging.handlers.RotatingFileHandler`: the file is renamed with a ".1"
+    suffix, the previous ".1" becomes ".2" and so on, up to `backup_count` files. Compressed batches
+    are written to a file named after the compression, e.g. "audit.ndjson.gz".
+    """
+
+    EXTENSIONS = {GZIP: ".gz", ZSTD: ".zst"}
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backup_count=5):
+        """
+        :param path: Path of the file, created with its directory if needed.
+        :type path: str
+        :param max_bytes: Size from which the file is rotated, 0 to never rotate it.
+        :type max_bytes: int
+        :param backup_count: Number of rotated files kept.
+        :type backup_count: int
+        """
+        super().__init__()
+        self.name = "file:" + os.path.abspath(path)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, encoding=None):
+        return self.path + self.EXTENSIONS.get(encoding, "")
+
+    def send(self, body, records, encoding=None):
+        path = self.path_for(encoding)
+        data = body + self._newline(encoding)
+        with self._lock:
+            if self.max_bytes and os.path.exists(path) and os.path.getsize(path) + len(data) > self.max_bytes:
+                self._rotate(path)
+            with open(path, "ab") as f:
+                f.write(data)
+        return SinkResponse()
+
+    def _rotate(self, path):
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = "{}.{}".format(path, index)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(path, index + 1))
+        os.replace(path, path + ".1")
+
+
+class StdoutSink(_StreamSink):
+    """
+    Writes batches to the standard output, or any binary stream, for log shippers to pick up.
+    """
+
+    name = "stdout"
+
+    def __init__(self, stream=None):
+        """
+        :param stream: Binary stream written to, the standard output when None.
+        """
+        super().__init__()
+        self.stream = stream
+
+    def send(self, body, records, encoding=None):
+        stream = self.stream if self.stream is not None else sys.stdout.buffer
+        with self._lock:
+            stream.write(body + self._newline(encoding))
+            stream.flush()
+        return SinkResponse()
+
+
+class MemorySink(Sink):
+    """
+    Keeps the last `max_records` records in memory, for tests and benchmarks.
+    """
+
+    def __init__(self, max_records=10000):
+        self.name = "memory:{}".format(id(self))
+        self.records = collections.deque(maxlen=max_records)
+        self.batches = 0
+
+    def send(self, body, records, encoding=None):
+        # deque.extend is atomic, upload workers can share the sink
+        self.records.extend(records)
+        self.batches += 1
+        return SinkResponse()
+
+    def clear(self):
+        self.records.clear()
+        self.batches = 0
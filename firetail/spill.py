@@ -0,0 +1,283 @@
+"""
+This module defines the on-disk queue where audit records are spilled when they cannot be sent.
+"""
+
+import os
+import re
+import threading
+import time
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+DEFAULT_SPILL_DIRECTORY = "firetail-spill"
+DEFAULT_MAX_SPILL_BYTES = 256 * 1024 * 1024  # 256 MB
+DEFAULT_SEGMENT_BYTES = 8 * 1024 * 1024  # 8 MB
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson"
+WORKER_PREFIX = "worker-"
+
+SEGMENT_PATTERN = re.compile(r"^{}(\d+){}$".format(re.escape(SEGMENT_PREFIX), re.escape(SEGMENT_SUFFIX)))
+WORKER_PATTERN = re.compile(r"^{}(\d+)(-\d+)?$".format(re.escape(WORKER_PREFIX)))
+
+# Directories written by the live queues of this process
+_directories = set()
+_directories_lock = threading.Lock()
+
+
+def worker_spill_directory(directory, pid):
+    """Spill directory of a process, inside the spill directory shared by all processes."""
+    return os.path.join(directory, "{}{}".format(WORKER_PREFIX, pid))
+
+
+def _claim_directory(directory):
+    # Every queue writes to its own directory: processes sharing the spill directory would
+    # otherwise append to and replay the same segment files
+    with _directories_lock:
+        path = worker_spill_directory(directory, os.getpid())
+        suffix = 0
+        while path in _directories:
+            suffix += 1
+            path = "{}-{}".format(worker_spill_directory(directory, os.getpid()), suffix)
+        _directories.add(path)
+        return path
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SpillQueue:
+    """
+    Append-only queue of newline delimited records, stored in a directory of segment files.
+
+    Each queue writes to its own `worker-<pid>` directory inside the spill directory, which may be
+    shared by several processes. Records are appended to the active segment of the queue, which is
+    rolled over once it reaches `segment_bytes`.
+    Segments are consumed oldest first with `oldest_segment`/`read_segment` and deleted by `remove`
+    once their records have been delivered, so a crash at any point loses at most the data not yet
+    synced to disk, and replays at worst a segment twice.
+
+    Segments left over by processes that have exited are adopted when the queue is created. Each of
+    them is claimed by renaming it into the directory of the queue, so that when several processes
+    start at once, every orphan segment is replayed by only one of them.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_SPILL_DIRECTORY,
+        max_bytes=DEFAULT_MAX_SPILL_BYTES,
+        segment_bytes=DEFAULT_SEGMENT_BYTES,
+        fsync=FSYNC_INTERVAL,
+        fsync_interval=1.0,
+    ):
+        """
+        :param directory: Spill directory holding the segment files, created on first use.
+        :type directory: str
+        :param max_bytes: Maximum size of all segments. Records that would exceed it are dropped.
+        :type max_bytes: int
+        :param segment_bytes: Size at which the active segment is rolled over.
+        :type segment_bytes: int
+        :param fsync: When appended data is synced to disk: "always", "interval" or "never".
+        :type fsync: str
+        :param fsync_interval: Minimum number of seconds between syncs with the "interval" policy.
+        :type fsync_interval: float
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy {!r}, expected one of {}".format(fsync, ", ".join(FSYNC_POLICIES)))
+
+        self.spill_directory = directory
+        self.directory = _claim_directory(directory)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+        self._active_size = 0
+        self._last_fsync = 0.0
+        self._next_sequence = 0
+        self._segments = self._existing_segments()
+        self._bytes = self._size_of(self._segments)
+
+    @staticmethod
+    def _segments_in(directory):
+        if not os.path.isdir(directory):
+            return []
+        names = sorted(name for name in os.listdir(directory) if SEGMENT_PATTERN.match(name))
+        return [os.path.join(directory, name) for name in names]
+
+    @staticmethod
+    def _size_of(segments):
+        size = 0
+        for path in segments:
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _orphan_directories(self):
+        orphans = []
+        for name in sorted(os.listdir(self.spill_directory)):
+            path = os.path.join(self.spill_directory, name)
+            match = WORKER_PATTERN.match(name)
+            if match is None or not os.path.isdir(path):
+                continue
+            pid = int(match.group(1))
+            if pid == os.getpid():
+                # Left by an earlier process with the same pid, unless a live queue of this one writes to it
+                with _directories_lock:
+                    if path not in _directories:
+                        orphans.append(path)
+            elif not _is_running(pid):
+                orphans.append(path)
+        return orphans
+
+    def _existing_segments(self):
+        segments = self._segments_in(self.directory)
+        self._next_sequence = max([self._sequence(path) for path in segments], default=-1) + 1
+        if not os.path.isdir(self.spill_directory):
+            return segments
+
+        orphans = self._orphan_directories()
+        # Segments written straight to the spill directory, before queues had their own directories
+        for directory in orphans + [self.spill_directory]:
+            for path in self._segments_in(directory):
+                adopted = self._new_segment_path()
+                os.makedirs(self.directory, exist_ok=True)
+                try:
+                    os.rename(path, adopted)
+                except FileNotFoundError:
+                    # Claimed by another process
+                    continue
+                segments.append(adopted)
+        for directory in orphans:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        return segments
+
+    @staticmethod
+    def _sequence(path):
+        return int(SEGMENT_PATTERN.match(os.path.basename(path)).group(1))
+
+    def _new_segment_path(self):
+        name = "{}{:020d}{}".format(SEGMENT_PREFIX, self._next_sequence, SEGMENT_SUFFIX)
+        self._next_sequence += 1
+        return os.path.join(self.directory, name)
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._active_path = self._new_segment_path()
+        self._active = open(self._active_path, "ab")
+        self._active_size = 0
+        self._segments.append(self._active_path)
+
+    def _close_segment(self):
+        if self._active is not None:
+            self._sync(force=True)
+            self._active.close()
+            self._active = None
+            self._active_path = None
+
+    def _sync(self, force=False):
+        self._active.flush()
+        if self.fsync == FSYNC_NEVER and not force:
+            return
+        now = time.monotonic()
+        if force or self.fsync == FSYNC_ALWAYS or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._active.fileno())
+            self._last_fsync = now
+
+    def append(self, records):
+        """
+        Append encoded records to the queue.
+
+        :type records: list[bytes]
+        :return: False if the records were dropped because the queue is full.
+        :rtype: bool
+        """
+        data = b"".join(record + b"\n" for record in records)
+        with self._lock:
+            if self._bytes + len(data) > self.max_bytes:
+                self.dropped += len(records)
+                return False
+            if self._active is None or self._active_size >= self.segment_bytes:
+                self._close_segment()
+                self._open_segment()
+            self._active.write(data)
+            self._active_size += len(data)
+            self._bytes += len(data)
+            self._sync()
+        return True
+
+    def oldest_segment(self):
+        """
+        Path of the oldest segment, closing the active segment if it is the only one left.
+
+        :rtype: str | None
+        """
+        with self._lock:
+            if not self._segments:
+                return None
+            if self._segments[0] == self._active_path:
+                self._close_segment()
+            return self._segments[0]
+
+    @staticmethod
+    def read_segment(path):
+        """
+        :rtype: list[bytes]
+        """
+        with open(path, "rb") as f:
+            return [line for line in f.read().split(b"\n") if line]
+
+    def remove(self, path):
+        """Delete a segment whose records have been delivered, or that was deleted from under the queue."""
+        with self._lock:
+            if path == self._active_path:
+                self._close_segment()
+            if path in self._segments:
+                self._segments.remove(path)
+                try:
+                    self._bytes -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    self._bytes = self._size_of(self._segments)
+                if not self._segments:
+                    # Created again with the next segment
+                    try:
+                        os.rmdir(self.directory)
+                    except OSError:
+                        pass
+
+    def empty(self):
+        with self._lock:
+            return not self._segments
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return self._bytes
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+        with _directories_lock:
+            _directories.discard(self.directory)
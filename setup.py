@@ -52,6 +52,9 @@ tests_require.append("aiohttp-remotes")
 
 docs_require = ["sphinx-autoapi==1.8.1"]
 
+zstd_require = "zstandard>=0.18"
+orjson_require = "orjson>=3.6"
+
 
 class PyTest(TestCommand):
     user_options = [("cov-html=", None, "Generate junit html report")]
@@ -102,6 +105,8 @@ setup(
         "flask": flask_require,
         "swagger-ui": swagger_ui_require,
         "docs": docs_require,
+        "zstd": zstd_require,
+        "orjson": orjson_require,
     },
     cmdclass={"test": PyTest},
     test_suite="tests",
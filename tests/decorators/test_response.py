@@ -0,0 +1,35 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from firetail.decorators.response import ResponseValidator
+from firetail.exceptions import NonConformingResponseBody, NonConformingResponseHeaders
+
+
+def make_operation():
+    operation = MagicMock()
+    operation.response_definition.return_value = {"headers": {"X-Rate": {"required": True}, "X-Other": {}}}
+    operation.response_schema.return_value = {"type": "object", "required": ["id"]}
+    operation.json_loads = json.loads
+    return operation
+
+
+def test_responses_are_compiled_once_per_status_and_content_type():
+    operation = make_operation()
+    validator = ResponseValidator(operation, "application/json")
+
+    for _ in range(3):
+        assert validator.validate_response('{"id": 1}', 200, {"X-Rate": "1"}, "/pets")
+    validator.validate_response('{"id": 1}', 201, {"X-Rate": "1", "Content-Type": "application/json"}, "/pets")
+
+    assert operation.response_schema.call_count == 2
+    assert set(validator.compiled) == {("200", "application/json"), ("201", "application/json")}
+    assert validator.compiled["200", "application/json"].required_headers == {"X-Rate"}
+
+
+def test_compiled_responses_still_validate():
+    validator = ResponseValidator(make_operation(), "application/json")
+    with pytest.raises(NonConformingResponseBody):
+        validator.validate_response("{}", 200, {"X-Rate": "1"}, "/pets")
+    with pytest.raises(NonConformingResponseHeaders):
+        validator.validate_response('{"id": 1}', 200, {}, "/pets")
@@ -1,8 +1,11 @@
+import io
+import json
 from unittest.mock import MagicMock
 
 import pytest
 from firetail.apis.flask_api import FlaskApi
-from firetail.decorators.validation import ParameterValidator
+from firetail.decorators.validation import ParameterValidator, RequestBodyValidator
+from firetail.exceptions import BadRequestProblem, PayloadTooLargeProblem
 from firetail.json_schema import Draft4RequestValidator, Draft4ResponseValidator
 from jsonschema import ValidationError
 
@@ -197,3 +200,89 @@ def test_formdata_extra_parameter_strict():
     validator = ParameterValidator([{"in": "formData", "name": "param"}], FlaskApi, strict_validation=True)
     errors = validator.validate_formdata_parameter_list(request)
     assert errors
+
+
+def test_parameters_are_compiled_once(monkeypatch):
+    param = {"in": "query", "name": "limit", "type": "integer", "maximum": 10, "required": True}
+    validator = ParameterValidator([param], FlaskApi)
+    compiled = validator.compiled["query", id(param)]
+    assert "required" not in compiled.schema
+    assert param["required"]
+
+    # Validating a request only looks the compiled parameter up
+    monkeypatch.setattr("firetail.decorators.validation.Draft4Validator", MagicMock(side_effect=AssertionError))
+    assert validator.validate_query_parameter(param, MagicMock(query={"limit": "5"})) is None
+    assert "is greater than the maximum" in validator.validate_query_parameter(param, MagicMock(query={"limit": "50"}))
+    assert validator.validate_query_parameter(param, MagicMock(query={})) == "Missing query parameter 'limit'"
+
+
+def test_custom_validate_parameter_is_called():
+    class CustomParameterValidator(ParameterValidator):
+        @staticmethod
+        def validate_parameter(parameter_type, value, param, param_name=None):
+            return None
+
+    param = {"in": "query", "name": "limit", "type": "integer"}
+    assert ParameterValidator([param], FlaskApi).validate_query_parameter(param, MagicMock(query={"limit": "x"}))
+    validator = CustomParameterValidator([param], FlaskApi)
+    assert validator.validate_query_parameter(param, MagicMock(query={"limit": "x"})) is None
+
+
+def test_fail_fast_stops_at_the_first_invalid_parameter():
+    params = [{"in": "query", "name": name, "type": "integer", "required": True} for name in ("a", "b", "c")]
+    request = MagicMock(query={"a": "x", "b": "y"})
+    validator = ParameterValidator(params, FlaskApi)
+    validator.validate_query_parameter = MagicMock(wraps=validator.validate_query_parameter)
+    view = validator(lambda request: "OK")
+
+    with pytest.raises(BadRequestProblem) as exc_info:
+        view(request)
+    assert exc_info.value.detail == "Wrong type, expected 'integer' for query parameter 'a'"
+    assert validator.validate_query_parameter.call_count == 1
+
+    validator.limit_errors(2, max_error_length=30)
+    validator.validate_query_parameter.reset_mock()
+    with pytest.raises(BadRequestProblem) as exc_info:
+        view(request)
+    assert exc_info.value.detail == ["Wrong type, expected 'integer'..."] * 2
+    assert validator.validate_query_parameter.call_count == 2
+
+
+def test_body_errors_are_capped_and_truncated():
+    validator = RequestBodyValidator({"type": "array", "items": {"type": "integer"}}, ["application/json"], FlaskApi)
+    data = ["x" * 100] * 1000
+
+    with pytest.raises(BadRequestProblem) as exc_info:
+        validator.validate_schema(data, "/numbers")
+    assert exc_info.value.detail == "'{}' is not of type 'integer' - '0'".format("x" * 100)
+
+    validator.limit_errors(3, max_error_length=20)
+    with pytest.raises(BadRequestProblem) as exc_info:
+        validator.validate_schema(data, "/numbers")
+    assert exc_info.value.detail == ["'{}...".format("x" * 19)] * 3
+
+    assert validator.validate_schema([1, 2], "/numbers") is None
+
+
+def test_streamed_body_is_rejected_on_its_first_invalid_item():
+    schema = {"type": "array", "items": {"type": "object", "properties": {"id": {"type": "integer"}}}}
+    validator = RequestBodyValidator(schema, ["application/json"], FlaskApi)
+    validator.stream_json(max_body_bytes=10000, chunk_size=1024)
+    view = validator(lambda request: request.json)
+
+    def request(items):
+        stream = io.BytesIO(json.dumps(items).encode())
+        return MagicMock(url="/bulk", headers={"Content-Type": "application/json"}, stream=stream)
+
+    assert view(request([{"id": 1}, {"id": 2}])) == [{"id": 1}, {"id": 2}]
+
+    invalid = request([{"id": "x"}] + [{"id": 1}] * 500)
+    with pytest.raises(BadRequestProblem) as exc_info:
+        view(invalid)
+    assert exc_info.value.detail == "'x' is not of type 'integer' - '0.id'"
+    # The rest of the body is left unread
+    assert invalid.stream.tell() == 1024
+
+    # The limit applies to bodies without a Content-Length too
+    with pytest.raises(PayloadTooLargeProblem):
+        view(request([{"id": 1}] * 2000))
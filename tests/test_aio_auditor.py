@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from firetail import AioHttpApp
+from firetail.aio_auditor import AsyncAuditor
+
+
+def make_auditor(**kwargs):
+    auditor = AsyncAuditor(url="http://localhost/aio", token="token", flush_linger=0, **kwargs)
+    auditor.captured = []
+    auditor.capture = auditor.captured.append
+    return auditor
+
+
+def test_aiohttp_middleware():
+    auditor = make_auditor()
+
+    async def hello(request):
+        await request.read()
+        return web.Response(text="Hello " + request.match_info["name"])
+
+    async def run():
+        app = web.Application(middlewares=[auditor.aiohttp_middleware])
+        app.router.add_post("/hello/{name}", hello)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post(
+                "/hello/jsmith", data=b"ping", headers={"Authorization": "secret", "Content-Type": "text/plain"}
+            )
+            assert response.status == 200
+
+    asyncio.run(run())
+
+    (exchange,) = auditor.captured
+    assert exchange.resource == "/hello/{name}"
+    assert exchange.request_body.data == b"ping"
+    assert exchange.response_body.data == b"Hello jsmith"
+    assert exchange.authorization == "secret"
+    assert exchange.status_code == 200
+
+
+def test_asgi_middleware():
+    auditor = make_auditor()
+
+    async def app(scope, receive, send):
+        message = await receive()
+        await send({"type": "http.response.start", "status": 201, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": message["body"].upper()})
+
+    async def run():
+        messages = [{"type": "http.request", "body": b"ping", "more_body": False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "scheme": "http",
+            "server": ("localhost", 80),
+            "path": "/hello",
+            "query_string": b"",
+            "headers": [(b"host", b"localhost"), (b"authorization", b"secret")],
+            "client": ("127.0.0.1", 1234),
+        }
+        await auditor.asgi_middleware(app)(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+
+    assert sent[1]["body"] == b"PING"
+    (exchange,) = auditor.captured
+    assert exchange.uri == "http://localhost/hello"
+    assert exchange.request_body.data == b"ping"
+    assert exchange.response_body.data == b"PING"
+    assert exchange.status_code == 201
+    assert exchange.authorization == "secret"
+
+
+def test_upload_batches():
+    auditor = AsyncAuditor(url="http://localhost/aio", token="token", flush_linger=0)
+    sent = []
+
+    async def send_batch(session, logs_list, body):
+        sent.append(body)
+        return True
+
+    auditor._send_batch = send_batch
+
+    async def hello(request):
+        return web.Response(text="Hello")
+
+    async def run():
+        app = web.Application(middlewares=[auditor.aiohttp_middleware])
+        app.router.add_get("/hello", hello)
+        async with TestClient(TestServer(app)) as client:
+            await client.get("/hello")
+            await client.get("/hello")
+        await auditor.close(timeout=5)
+
+    asyncio.run(run())
+
+    records = [json.loads(line) for body in sent for line in body.split(b"\n")]
+    assert [record["response"]["body"] for record in records] == ["Hello", "Hello"]
+    assert records[0]["request"]["resource"] == "/hello"
+
+
+def test_batches_stay_within_their_size_limit():
+    auditor = AsyncAuditor(url="http://localhost/aio", token="token", flush_linger=60, max_batch_bytes=20)
+    auditor.encode = lambda exchange: exchange
+
+    async def run():
+        auditor._queue = asyncio.Queue()
+        for log in (b"a" * 8, b"b" * 8, b"c" * 8, b"d" * 30):
+            auditor._queue.put_nowait(log)
+        return [await auditor._next_batch() for _ in range(3)]
+
+    batches = asyncio.run(run())
+
+    assert [(logs_list, done) for logs_list, body, done in batches] == [
+        ([b"a" * 8, b"b" * 8], 2),
+        ([b"c" * 8], 1),
+        ([b"d" * 30], 1),
+    ]
+    assert all(len(body) <= 20 for logs_list, body, done in batches[:2])
+
+
+def test_auditor_option_flushes_on_cleanup(json_validation_spec_dir):
+    auditor = AsyncAuditor(url="http://localhost/aio", token="token", flush_linger=60, logs_drain_timeout=5)
+    sent = []
+
+    async def send_batch(session, logs_list, body):
+        sent.extend(logs_list)
+        return True
+
+    auditor._send_batch = send_batch
+    app = AioHttpApp(__name__, specification_dir=json_validation_spec_dir)
+    app.add_api("openapi.yaml", options={"auditor": auditor})
+
+    async def run():
+        async with TestClient(TestServer(app.app)) as client:
+            res = await client.post("/v1.0/bulk", json=[{"id": 1}])
+            assert res.status == 200
+            assert not sent
+
+    started_at = time.monotonic()
+    asyncio.run(run())
+
+    assert time.monotonic() - started_at < 5
+    (record,) = [json.loads(log) for log in sent]
+    assert record["request"]["resource"] == "/v1.0/bulk"
+
+
+def test_aiohttp_middleware_records_unhandled_errors():
+    auditor = make_auditor()
+
+    async def fail(request):
+        raise ValueError("boom")
+
+    async def run():
+        app = web.Application(middlewares=[auditor.aiohttp_middleware])
+        app.router.add_get("/fail", fail)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/fail")
+            assert response.status == 500
+
+    asyncio.run(run())
+
+    (exchange,) = auditor.captured
+    assert exchange.status_code == 500
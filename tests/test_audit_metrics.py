@@ -0,0 +1,73 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from conftest import build_app_from_fixture
+from firetail.apis.abstract import AbstractAPI
+from firetail.audit_metrics import (
+    JSON_CONTENT_TYPE,
+    PROMETHEUS_CONTENT_TYPE,
+    PipelineMetrics,
+)
+
+
+def make_metrics():
+    metrics = PipelineMetrics()
+    metrics.inc("records_enqueued", 3)
+    metrics.inc("bytes_enqueued", 300)
+    metrics.gauge("queue_records", lambda: 2, "Audit records waiting in the queue.")
+    metrics.counter("records_dropped", lambda: 1, "Audit records dropped by the full queue.")
+    metrics.gauge("broken", lambda: 1 / 0)
+    metrics.observe_response(200, 0.02)
+    metrics.observe_response(503, 2)
+    return metrics
+
+
+def test_snapshot():
+    snapshot = make_metrics().snapshot()
+    assert snapshot["counters"]["records_enqueued"] == 3
+    assert snapshot["counters"]["records_dropped"] == 1
+    assert snapshot["counters"]["batches_sent"] == 0
+    assert snapshot["gauges"] == {"queue_records": 2, "broken": None}
+    assert snapshot["status_codes"] == {"200": 1, "503": 1}
+    latency = snapshot["upload_latency_seconds"]
+    assert latency["count"] == 2
+    assert latency["buckets"]["0.025"] == 1
+    assert latency["buckets"]["2.5"] == 2
+    assert latency["buckets"]["+Inf"] == 2
+
+
+def test_prometheus():
+    text = make_metrics().to_prometheus()
+    assert "# TYPE firetail_audit_records_enqueued_total counter\nfiretail_audit_records_enqueued_total 3\n" in text
+    assert "firetail_audit_records_dropped_total 1\n" in text
+    assert "# HELP firetail_audit_queue_records Audit records waiting in the queue.\n" in text
+    assert "firetail_audit_queue_records 2\n" in text
+    assert "broken" not in text
+    assert 'firetail_audit_responses_total{code="503"} 1\n' in text
+    assert 'firetail_audit_upload_latency_seconds_bucket{le="0.025"} 1\n' in text
+    assert "firetail_audit_upload_latency_seconds_count 2\n" in text
+
+
+def test_metrics_endpoint():
+    metrics = make_metrics()
+    app = build_app_from_fixture("simple", options={"metrics": metrics})
+    client = app.app.test_client()
+
+    response = client.get("/v1.0/metrics")
+    assert response.status_code == 200
+    assert response.content_type == PROMETHEUS_CONTENT_TYPE
+    assert b"firetail_audit_records_enqueued_total 3" in response.data
+
+    response = client.get("/v1.0/metrics", headers={"Accept": "application/json"})
+    assert response.content_type == JSON_CONTENT_TYPE
+    assert json.loads(response.data)["counters"]["records_enqueued"] == 3
+
+    response = client.get("/v1.0/metrics?format=json")
+    assert response.content_type == JSON_CONTENT_TYPE
+
+
+def test_metrics_endpoint_is_optional_for_apis():
+    assert "add_metrics" not in AbstractAPI.__abstractmethods__
+    with pytest.raises(NotImplementedError):
+        AbstractAPI.add_metrics(MagicMock())
@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+
+import pytest
+from firetail.audit_queue import AuditQueue
+
+
+def test_drop_newest():
+    q = AuditQueue(max_bytes=10, max_records=100, overflow_policy="drop_newest")
+    assert q.put("aaaa")
+    assert q.put("bbbb")
+    assert not q.put("cccc")
+    assert q.dropped == 1
+    assert q.nbytes == 8
+    assert [q.get_nowait(), q.get_nowait()] == ["aaaa", "bbbb"]
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+
+
+def test_drop_oldest():
+    q = AuditQueue(max_bytes=100, max_records=2, overflow_policy="drop_oldest")
+    for record in ("a", "b", "c"):
+        assert q.put(record)
+    assert q.dropped == 1
+    assert q.qsize() == 2
+    assert q.get_nowait() == "b"
+
+
+def test_block_times_out():
+    q = AuditQueue(max_bytes=100, max_records=1, overflow_policy="block", block_timeout=0.01)
+    assert q.put("a")
+    assert not q.put("b")
+    assert q.dropped == 1
+
+
+def test_spill():
+    spilled = []
+    q = AuditQueue(max_bytes=100, max_records=1, overflow_policy="spill", spill_handler=spilled.extend)
+    assert q.put("a")
+    assert not q.put("b")
+    assert spilled == ["b"]
+    assert q.spilled == 1
+    assert q.dropped == 0
+
+
+def test_oversized_record_is_accepted_when_empty():
+    q = AuditQueue(max_bytes=2, max_records=10)
+    assert q.put("abcdef")
+    assert not q.put("a")
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        AuditQueue(overflow_policy="nope")
+    with pytest.raises(ValueError):
+        AuditQueue(overflow_policy="spill")
+
+
+def test_wait_for_batch_wakes_up_on_full_batch():
+    q = AuditQueue()
+    producer = threading.Timer(0.05, lambda: [q.put(b"x") for _ in range(3)])
+    producer.start()
+
+    start = time.monotonic()
+    assert q.wait_for_batch(max_bytes=1000, max_records=3, linger=10, idle_timeout=10)
+    assert time.monotonic() - start < 5
+    assert q.qsize() == 3
+
+
+def test_wait_for_batch_linger():
+    q = AuditQueue()
+    q.put(b"x")
+
+    start = time.monotonic()
+    assert q.wait_for_batch(max_bytes=1000, linger=0.05)
+    assert 0.04 <= time.monotonic() - start < 5
+
+
+def test_wait_for_batch_idle_timeout():
+    q = AuditQueue()
+    assert not q.wait_for_batch(max_bytes=1000, linger=10, idle_timeout=0.01)
+
+
+def test_close_wakes_up_waiting_consumers():
+    q = AuditQueue()
+    q.put(b"x")
+    closer = threading.Timer(0.05, q.close)
+    closer.start()
+
+    start = time.monotonic()
+    assert q.wait_for_batch(max_bytes=1000, linger=10)
+    assert time.monotonic() - start < 5
+    assert q.drain() == [b"x"]
+    assert q.empty()
+    assert not q.wait_for_batch(max_bytes=1000, linger=10, idle_timeout=10)
@@ -0,0 +1,208 @@
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import flask
+import jwt
+from firetail.auditor import CapturedExchange, cloud_logger
+
+
+def make_app():
+    app = flask.Flask(__name__)
+
+    @app.route("/hello/<name>", methods=["POST"])
+    def hello(name):
+        return f"Hello {name}"
+
+    return app
+
+
+def test_create_sync():
+    app = make_app()
+    cl = cloud_logger(app, token="token")
+    cl.sender = MagicMock()
+
+    app.test_client().post("/hello/jsmith", data="ping", headers={"Authorization": "secret"})
+
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["request"]["resource"] == "/hello/<name>"
+    assert payload["request"]["body"] == "ping"
+    assert payload["request"]["headers"]["Authorization"] == ["{SANITIZED_HEADER:" + cl.sha_hash("secret") + "}"]
+    assert payload["response"]["statusCode"] == 200
+    assert payload["response"]["body"] == "Hello jsmith"
+
+
+def test_create_background_capture():
+    app = make_app()
+    cl = cloud_logger(app, token="token", background_capture=True)
+    cl.sender = MagicMock()
+
+    app.test_client().post("/hello/jsmith", data="ping", headers={"Authorization": "secret"})
+    assert cl.close_captures(timeout=5)
+
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["request"]["uri"] == "http://localhost/hello/jsmith"
+    assert payload["request"]["body"] == "ping"
+    assert payload["request"]["headers"]["Authorization"] == ["{SANITIZED_HEADER:" + cl.sha_hash("secret") + "}"]
+    assert payload["response"]["body"] == "Hello jsmith"
+
+
+def test_create_logging_handler():
+    app = make_app()
+    cl = cloud_logger(app, token="token", use_logging_handler=True)
+    cl.logger = MagicMock()
+
+    app.test_client().post("/hello/jsmith", data="ping")
+
+    payload = json.loads(cl.logger.info.call_args[0][0])
+    assert payload["request"]["body"] == "ping"
+    assert payload["response"]["body"] == "Hello jsmith"
+
+
+def test_create_return_values():
+    app = make_app()
+
+    def create(**kwargs):
+        cl = cloud_logger(app, **kwargs)
+        cl.sender = MagicMock()
+        cl.logger = MagicMock()
+        with app.test_request_context("/hello/jsmith", method="POST", data="ping"):
+            return cl, cl.create(app.make_response("Hello jsmith"), kwargs.get("token"))
+
+    # The record as it is shipped
+    cl, record = create(token="token")
+    assert record == cl.sender.append_encoded.call_args[0][0]
+    cl, payload = create(token="token", use_logging_handler=True)
+    assert json.loads(cl.logger.info.call_args[0][0]) == payload
+    # Nothing when the record is built later, not recorded or not shipped
+    cl, record = create(token="token", background_capture=True)
+    assert record is None
+    assert cl.close_captures(timeout=5)
+    assert json.loads(cl.sender.append_encoded.call_args[0][0])["request"]["body"] == "ping"
+    assert create(token="token", method_sample_rates={"POST": 0})[1] is None
+    assert create()[1] is None
+
+
+def test_background_capture_queue_is_bounded():
+    app = make_app()
+    cl = cloud_logger(app, token="token", background_capture=True, capture_workers=1)
+    cl.sender_options = {"max_queue_records": 1}
+    cl.sender = MagicMock()
+    release = threading.Event()
+    processed = []
+
+    def process(exchange):
+        release.wait(5)
+        processed.append(exchange)
+
+    cl.process = process
+    client = app.test_client()
+    for _ in range(4):
+        client.post("/hello/jsmith", data="ping")
+    # One exchange is being processed, one is queued, the others did not fit
+    assert cl._capture_queue.dropped >= 2
+
+    release.set()
+    assert cl.close_captures(timeout=5)
+    assert len(processed) + cl._capture_queue.dropped == 4
+
+
+def test_body_caps():
+    app = flask.Flask(__name__)
+
+    @app.route("/echo", methods=["POST"])
+    def echo():
+        return "x" * 100
+
+    @app.route("/stream")
+    def stream():
+        def generate():
+            yield "chunk"
+
+        return app.response_class(generate(), mimetype="text/plain")
+
+    cl = cloud_logger(app, token="token", max_request_body_bytes=4, max_response_body_bytes=10)
+    cl.sender = MagicMock()
+    client = app.test_client()
+
+    client.post("/echo", data="abcdefgh", content_type="text/plain")
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["request"]["body"] == "abcd{TRUNCATED_BODY:8 bytes}"
+    assert payload["response"]["body"] == "x" * 10 + "{TRUNCATED_BODY:100 bytes}"
+
+    client.post("/echo", data=b"\x00\x01", content_type="application/octet-stream")
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["request"]["body"] == "{OMITTED_BODY:application/octet-stream}"
+
+    response = client.get("/stream")
+    assert response.data == b"chunk"
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["response"]["body"] == "{OMITTED_BODY:streamed}"
+
+
+def test_allowed_content_types():
+    app = make_app()
+    cl = cloud_logger(app, token="token", allowed_content_types=["application/json"])
+    cl.sender = MagicMock()
+
+    app.test_client().post("/hello/jsmith", data="ping", content_type="text/plain")
+
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["request"]["body"] == "{OMITTED_BODY:text/plain}"
+    assert payload["response"]["body"] == "{OMITTED_BODY:text/html}"
+
+
+def test_sampled_out_requests_are_not_captured():
+    app = make_app()
+    cl = cloud_logger(app, token="token", route_sample_rates={"/hello/<name>": 0})
+    cl.sender = MagicMock()
+
+    with patch.object(CapturedExchange, "from_flask") as from_flask:
+        app.test_client().post("/hello/jsmith", data="ping")
+    from_flask.assert_not_called()
+    cl.sender.append_encoded.assert_not_called()
+    assert cl.sampling.sampled_out == 1
+
+
+def test_redact_body():
+    app = make_app()
+    cl = cloud_logger(app, token="token", redact_body_paths=["$.password"])
+    cl.sender = MagicMock()
+
+    app.test_client().post("/hello/jsmith", json={"password": "hunter2"})
+
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert json.loads(payload["request"]["body"]) == {"password": "{SANITIZED_FIELD:" + cl.sha_hash("hunter2") + "}"}
+
+
+def test_redact_body_larger_than_its_cap():
+    app = flask.Flask(__name__)
+    app.route("/echo", methods=["POST"])(lambda: flask.request.get_data())
+    cl = cloud_logger(
+        app, token="token", redact_body_paths=["$.password"], max_request_body_bytes=100, max_response_body_bytes=100
+    )
+    cl.sender = MagicMock()
+    client = app.test_client()
+
+    body = json.dumps({"comment": "x" * 200, "password": "hunter2"})
+    client.post("/echo", data=body, content_type="application/json")
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert "hunter2" not in payload["request"]["body"]
+    assert payload["request"]["body"].startswith('{"comment": "xxx')
+    assert payload["request"]["body"].endswith("{TRUNCATED_BODY:%s bytes}" % len(body))
+    # Not kept whole, so the cut body cannot be parsed and is left out rather than sent unredacted
+    assert payload["response"]["body"] == "{OMITTED_BODY:unparsable JSON}"
+
+
+def test_oauth_enrichment():
+    app = make_app()
+    cl = cloud_logger(app, token="token", oauth_claims=["client_id", "scope"])
+    cl.sender = MagicMock()
+    token = jwt.encode({"sub": "jsmith", "client_id": "app", "scope": "read write"}, "secret")
+
+    for _ in range(2):
+        app.test_client().post("/hello/jsmith", headers={"Authorization": "Bearer " + token})
+
+    payload = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert payload["oauth"] == {"subject": "jsmith", "client_id": "app", "scope": "read write"}
+    assert cl.claims_cache.hits == 1
@@ -0,0 +1,47 @@
+import time
+from unittest.mock import MagicMock
+
+import jwt
+from firetail.claims import ClaimsCache
+
+
+def test_claims_are_cached():
+    token = jwt.encode({"sub": "jsmith", "scope": "read", "aud": "api"}, "secret")
+    decode = MagicMock(wraps=lambda t: jwt.decode(t, options={"verify_signature": False}))
+    cache = ClaimsCache(claims=["sub", "scope"], decode=decode)
+
+    assert cache.get(token) == {"sub": "jsmith", "scope": "read"}
+    assert cache.get(token) == {"sub": "jsmith", "scope": "read"}
+    assert decode.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_invalid_tokens_are_cached():
+    cache = ClaimsCache()
+    assert cache.get("not-a-jwt") is None
+    assert cache.get("not-a-jwt") is None
+    assert cache.hits == 1
+
+
+def test_expiry_respects_exp():
+    now = time.time()
+    soon = jwt.encode({"sub": "a", "exp": int(now) + 1}, "secret")
+    expired = jwt.encode({"sub": "b", "exp": int(now) - 10}, "secret")
+    cache = ClaimsCache(ttl=300)
+
+    assert cache.get(expired) == {"sub": "b"}
+    assert len(cache) == 0
+
+    assert cache.get(soon) == {"sub": "a"}
+    ((_, expires_at),) = cache._entries.values()
+    assert expires_at == int(now) + 1
+
+
+def test_lru_eviction():
+    cache = ClaimsCache(max_size=2)
+    tokens = [jwt.encode({"sub": str(i)}, "secret") for i in range(3)]
+    for token in tokens:
+        cache.get(token)
+    assert len(cache) == 2
+    cache.get(tokens[0])
+    assert cache.misses == 4
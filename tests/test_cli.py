@@ -256,3 +256,32 @@ def test_run_with_incompatible_server_and_framework(mock_app_run, spec_file):
     result = runner.invoke(main, ["run", spec_file, "-s", "flask", "-f", "aiohttp"], catch_exceptions=False)
     assert "Invalid server 'flask' for app-framework 'aiohttp'" in result.output
     assert result.exit_code == 2
+
+
+def test_collector(monkeypatch):
+    sender_cls = MagicMock()
+    collector_cls = MagicMock()
+    monkeypatch.setattr("firetail.cli.FiretailSender", sender_cls)
+    monkeypatch.setattr("firetail.cli.Collector", collector_cls)
+    monkeypatch.setattr("firetail.cli.signal.signal", MagicMock())
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        ["collector", "--token", "secret", "--socket", "/tmp/ft.sock", "--socket-mode", "600"],
+        catch_exceptions=False,
+    )
+
+    assert result.exit_code == 0
+    assert sender_cls.call_args[1]["token"] == "secret"
+    collector_cls.assert_called_once_with(sender_cls.return_value, socket_path="/tmp/ft.sock", socket_mode=0o600)
+    server = collector_cls.return_value
+    server.serve_forever.assert_called_once_with()
+    server.close.assert_called_once_with(10.0)
+
+
+def test_collector_requires_token(monkeypatch):
+    monkeypatch.delenv("FIRETAIL_API_TOKEN", raising=False)
+    result = CliRunner().invoke(main, ["collector"])
+    assert result.exit_code == 2
+    assert "token is required" in result.output
@@ -0,0 +1,87 @@
+import json
+import threading
+from unittest.mock import MagicMock
+
+import flask
+from firetail.audit_metrics import PipelineMetrics
+from firetail.auditor import cloud_logger
+from firetail.collector import MAX_DATAGRAM_BYTES, Collector, CollectorClient
+
+
+def make_sender():
+    sender = MagicMock()
+    sender.metrics = PipelineMetrics()
+    sender.close.return_value = True
+    return sender
+
+
+def test_records_reach_the_collector_sender(tmp_path):
+    socket_path = str(tmp_path / "collector.sock")
+    sender = make_sender()
+    received = threading.Event()
+    sender.append_encoded.side_effect = lambda record: received.set()
+    server = Collector(sender, socket_path=socket_path)
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    client = CollectorClient(socket_path)
+    client.append_encoded(b'{"a":1}')
+    assert received.wait(5)
+    assert server.close(timeout=1)
+    thread.join(5)
+
+    assert not thread.is_alive()
+    sender.append_encoded.assert_called_once_with(b'{"a":1}')
+    sender.close.assert_called_once_with(1)
+    assert server.received == 1
+    assert client.metrics.snapshot()["counters"]["records_enqueued"] == 1
+
+
+def test_client_drops_records_without_collector(tmp_path):
+    client = CollectorClient(str(tmp_path / "missing.sock"))
+    client.append_encoded(b"{}")
+    assert client.dropped_records == 1
+    client.close()
+
+
+def test_records_too_big_for_the_collector_are_dropped(tmp_path):
+    socket_path = str(tmp_path / "collector.sock")
+    sender = make_sender()
+    received = threading.Event()
+    sender.append_encoded.side_effect = lambda record: received.set()
+    server = Collector(sender, socket_path=socket_path)
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    client = CollectorClient(socket_path)
+    client.append_encoded(b"x" * (MAX_DATAGRAM_BYTES + 1))
+    assert client.dropped_records == 1
+    # Sent by a client that does not check the size
+    client._socket.sendto(b"x" * (MAX_DATAGRAM_BYTES + 1), socket_path)
+    client.append_encoded(b'{"a":1}')
+    assert received.wait(5)
+    server.close(timeout=1)
+    thread.join(5)
+
+    sender.append_encoded.assert_called_once_with(b'{"a":1}')
+    assert server.discarded == 1
+    assert server.received == 1
+
+
+def test_cloud_logger_sends_to_collector(tmp_path):
+    socket_path = str(tmp_path / "collector.sock")
+    sender = make_sender()
+    server = Collector(sender, socket_path=socket_path)
+    server.bind()
+
+    app = flask.Flask(__name__)
+    app.route("/ping")(lambda: "pong")
+    cl = cloud_logger(app, collector_socket=socket_path)
+    app.test_client().get("/ping")
+
+    assert isinstance(cl.sender, CollectorClient)
+    record = json.loads(server._socket.recv(65536))
+    assert record["request"]["resource"] == "/ping"
+    server.close()
@@ -0,0 +1,29 @@
+import json
+import logging
+from unittest.mock import MagicMock
+
+from firetail.handlers import FiretailHandler
+from firetail.sender import FiretailSender
+from firetail.sinks import MemorySink
+
+
+def test_firetail_handler_ships_one_record_per_line(monkeypatch):
+    monkeypatch.setattr(
+        FiretailSender, "_initialize_sending_thread", lambda self: setattr(self, "sending_thread", MagicMock())
+    )
+    sink = MemorySink()
+    handler = FiretailHandler(None, None, sink=sink)
+    logger = logging.getLogger("test_firetail_handler")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        logger.info('{"a": 1}')
+        logger.info(json.dumps({"b": [1, 2]}, indent=2))
+        logger.info("not json")
+        logger.info({"c": 3})
+    finally:
+        logger.removeHandler(handler)
+    handler.flush()
+
+    assert list(sink.records) == [b'{"a": 1}', b'{"b": [1, 2]}']
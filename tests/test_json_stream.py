@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from firetail.json_stream import BodyTooLarge, JsonStreamParser
+
+DOCUMENTS = [
+    '[1, 2.5, -3e2, "a\\"]b", {"x": [1, {"y": null}]}, [], true, false, null]',
+    "  [ ]  ",
+    '[{"é": "ü"}, 1.5e10]',
+    '{"items": [1, 2]}',
+    '"string"',
+    "12",
+]
+
+
+def parse(data, chunk_size, **kwargs):
+    parser = JsonStreamParser(**kwargs)
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i : i + chunk_size])
+    return parser.close()
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1024])
+def test_parses_like_json_loads(document, chunk_size):
+    assert parse(document.encode(), chunk_size) == json.loads(document)
+
+
+@pytest.mark.parametrize("document", ["[1,]", "[1 2]", "[1]x", "[}", '{"a":', "[1", "[tru]", "[2x]", "[1.]"])
+@pytest.mark.parametrize("chunk_size", [1, 1024])
+def test_rejects_malformed_json(document, chunk_size):
+    with pytest.raises(ValueError):
+        parse(document.encode(), chunk_size)
+
+
+def test_empty_body():
+    assert parse(b"", 1) is None
+    assert parse(b" \n", 1) is None
+
+
+def test_items_are_passed_as_soon_as_they_are_parsed():
+    seen = []
+    parser = JsonStreamParser(on_item=lambda item, index: seen.append((index, item)))
+    parser.feed(b'[{"id": 1}, {"id"')
+    assert seen == [(0, {"id": 1})]
+    parser.feed(b": 2}, 3")
+    assert seen == [(0, {"id": 1}), (1, {"id": 2})]
+    parser.feed(b"]")
+    assert parser.close() == [{"id": 1}, {"id": 2}, 3]
+    assert seen[-1] == (2, 3)
+
+
+def test_body_size_limit():
+    data = json.dumps(list(range(100))).encode()
+    assert parse(data, 10, max_bytes=len(data)) == list(range(100))
+    with pytest.raises(BodyTooLarge) as exc_info:
+        parse(data, 10, max_bytes=len(data) - 1)
+    assert exc_info.value.size == len(data)
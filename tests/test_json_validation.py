@@ -1,9 +1,16 @@
+import asyncio
 import json
 import pathlib
+from unittest.mock import MagicMock
 
+import flask
 import pytest
+from aiohttp.test_utils import TestClient, TestServer
 from conftest import build_app_from_fixture
-from firetail import App
+from fakeapi import hello
+from firetail import AioHttpApp, App
+from firetail.aio_auditor import AsyncAuditor
+from firetail.auditor import cloud_logger
 from firetail.decorators.validation import RequestBodyValidator
 from firetail.json_schema import Draft4RequestValidator
 from firetail.spec import Specification
@@ -177,3 +184,125 @@ def test_multipart_form_json(json_validation_spec_dir, spec):
     assert res.status_code == 200
     assert json.loads(res.data.decode())["name"] == "joe-reply"
     assert json.loads(res.data.decode())["age"] == 30
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_compiled_schemas_report_the_same_errors(json_validation_spec_dir, spec):
+    responses = []
+    for compile_schemas in (False, True):
+        app = build_app_from_fixture(
+            json_validation_spec_dir, spec, validate_responses=True, options={"compile_schemas": compile_schemas}
+        )
+        app_client = app.app.test_client()
+        for data in ({"name": "max", "password": "1234"}, {"user_id": 9, "name": "max"}, {"name": 7}):
+            res = app_client.post("/v1.0/user", data=json.dumps(data), content_type="application/json")
+            responses.append((compile_schemas, res.status_code, json.loads(res.data.decode())))
+        res = app_client.get("/v1.0/user_with_password")
+        responses.append((compile_schemas, res.status_code, json.loads(res.data.decode())))
+
+    plain, compiled = responses[:4], responses[4:]
+    assert [r[1:] for r in plain] == [r[1:] for r in compiled]
+    assert [r[1] for r in compiled] == [200, 400, 400, 500]
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_collect_all_validation_errors(json_validation_spec_dir, spec):
+    data = json.dumps({"user_id": 9, "name": 7})
+    app = build_app_from_fixture(json_validation_spec_dir, spec)
+    res = app.app.test_client().post("/v1.0/user", data=data, content_type="application/json")
+    assert res.status_code == 400
+    assert isinstance(json.loads(res.data.decode())["detail"], str)
+
+    options = {"validation_error_mode": "collect_all", "max_validation_errors": 2}
+    app = build_app_from_fixture(json_validation_spec_dir, spec, options=options)
+    res = app.app.test_client().post("/v1.0/user", data=data, content_type="application/json")
+    assert res.status_code == 400
+    assert len(json.loads(res.data.decode())["detail"]) == 2
+
+
+def test_unknown_validation_error_mode(json_validation_spec_dir):
+    with pytest.raises(ValueError):
+        build_app_from_fixture(json_validation_spec_dir, "openapi.yaml", options={"validation_error_mode": "all"})
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_streamed_json_bodies(json_validation_spec_dir, spec):
+    responses = []
+    for stream_json_bodies in (False, True):
+        options = {"stream_json_bodies": stream_json_bodies}
+        app_client = build_app_from_fixture(json_validation_spec_dir, spec, options=options).app.test_client()
+        for data in ([{"id": 1}, {"id": 2}], [{"id": 1}, {"id": "2"}], [{"id": 1}] * 101, "[{"):
+            data = data if isinstance(data, str) else json.dumps(data)
+            res = app_client.post("/v1.0/bulk", data=data, content_type="application/json")
+            responses.append((res.status_code, json.loads(res.data.decode())))
+
+    buffered, streamed = responses[:4], responses[4:]
+    assert streamed == buffered
+    assert streamed[0] == (200, [{"id": 1}, {"id": 2}])
+    assert streamed[1] == (400, streamed[1][1])
+    assert streamed[1][1]["detail"] == "'2' is not of type 'integer' - '1.id'"
+    assert [status for status, _ in streamed[2:]] == [400, 400]
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_streamed_json_bodies_reach_the_view_and_the_audit_record(json_validation_spec_dir, spec, monkeypatch):
+    # The view reads the body from the Flask request, whose stream the validation consumed
+    monkeypatch.setattr(hello, "forward", lambda body: flask.request.get_json())
+    app = build_app_from_fixture(json_validation_spec_dir, spec, options={"stream_json_bodies": True})
+    cl = cloud_logger(app.app, token="token")
+    cl.sender = MagicMock()
+
+    data = [{"id": 1}, {"id": 2}]
+    res = app.app.test_client().post("/v1.0/bulk", data=json.dumps(data), content_type="application/json")
+    assert res.status_code == 200
+    assert json.loads(res.data.decode()) == data
+    record = json.loads(cl.sender.append_encoded.call_args[0][0])
+    assert json.loads(record["request"]["body"]) == data
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_streamed_json_bodies_size_limit(json_validation_spec_dir, spec):
+    options = {"stream_json_bodies": True, "max_json_body_bytes": 100}
+    app_client = build_app_from_fixture(json_validation_spec_dir, spec, options=options).app.test_client()
+
+    res = app_client.post("/v1.0/bulk", data=json.dumps([{"id": 1}] * 5), content_type="application/json")
+    assert res.status_code == 200
+    res = app_client.post("/v1.0/bulk", data=json.dumps([{"id": 1}] * 50), content_type="application/json")
+    assert res.status_code == 413
+    assert json.loads(res.data.decode())["title"] == "Payload Too Large"
+
+
+def test_streamed_json_bodies_aiohttp(json_validation_spec_dir):
+    app = AioHttpApp(__name__, specification_dir=json_validation_spec_dir)
+    app.add_api("openapi.yaml", options={"stream_json_bodies": True, "max_json_body_bytes": 100})
+    responses = []
+
+    async def run():
+        async with TestClient(TestServer(app.app)) as client:
+            for data in ([{"id": 1}], [{"id": "x"}, {"id": 2}], [{"id": 1}] * 50, "[{"):
+                data = data if isinstance(data, str) else json.dumps(data)
+                res = await client.post("/v1.0/bulk", data=data, headers={"Content-Type": "application/json"})
+                responses.append((res.status, await res.json()))
+
+    asyncio.run(run())
+    assert responses[0] == (200, [{"id": 1}])
+    assert responses[1][1]["detail"] == "'x' is not of type 'integer' - '0.id'"
+    assert [status for status, _ in responses] == [200, 400, 413, 400]
+
+
+def test_streamed_json_bodies_reach_the_aiohttp_audit_record(json_validation_spec_dir):
+    auditor = AsyncAuditor(url="http://localhost/aio", token="token", flush_linger=0)
+    auditor.captured = []
+    auditor.capture = auditor.captured.append
+    app = AioHttpApp(__name__, specification_dir=json_validation_spec_dir)
+    app.add_api("openapi.yaml", options={"stream_json_bodies": True, "auditor": auditor})
+    data = [{"id": 1}, {"id": 2}]
+
+    async def run():
+        async with TestClient(TestServer(app.app)) as client:
+            res = await client.post("/v1.0/bulk", data=json.dumps(data), headers={"Content-Type": "application/json"})
+            assert res.status == 200
+
+    asyncio.run(run())
+    (exchange,) = auditor.captured
+    assert json.loads(exchange.request_body.render()) == data
@@ -0,0 +1,58 @@
+import json
+
+import jwt
+from firetail.auditor import CapturedExchange, cloud_logger
+from firetail.body_capture import CapturedBody
+from firetail.record_encoder import environ_headers
+from werkzeug.datastructures import EnvironHeaders
+
+
+def make_exchange(authorization=None):
+    return CapturedExchange(
+        uri="http://localhost/pets?limit=1",
+        resource="/pets",
+        method="POST",
+        request_headers=[("Accept", "*/*"), ("Cookie", "a=1"), ("Cookie", "b=2"), ("Authorization", authorization)],
+        request_body=b'{"name": "Rex", "password": "hunter2"}',
+        status_code=201,
+        response_headers={"Content-Type": "application/json", "Set-Cookie": "session=abc"},
+        response_body=CapturedBody(b'{"id": 1, "name": "R\xc3\xa9x"}', size=200, truncated=True),
+        ip="127.0.0.1",
+        authorization=authorization,
+        diff=1.5,
+    )
+
+
+def test_encode_matches_payload():
+    cl = cloud_logger(None, token="token", redact_body_paths=["$.password"], oauth_claims=["scope"])
+    exchange = make_exchange("Bearer " + jwt.encode({"sub": "jsmith", "scope": "read"}, "secret"))
+
+    record = json.loads(cl.encode(exchange))
+
+    assert record == cl.clean_pii(cl.build_payload(exchange), exchange.authorization)
+    assert record["request"]["headers"]["Cookie"] == [
+        "{SANITIZED_HEADER:" + cl.sha_hash("a=1") + "}",
+        "{SANITIZED_HEADER:" + cl.sha_hash("b=2") + "}",
+    ]
+    assert record["response"]["body"] == '{"id": 1, "name": "Réx"}{TRUNCATED_BODY:200 bytes}'
+    assert record["oauth"] == {"subject": "jsmith", "scope": "read"}
+
+
+def test_encode_without_oauth():
+    cl = cloud_logger(None, token="token")
+    record = json.loads(cl.encode(make_exchange("Basic dXNlcg==")))
+    assert "oauth" not in record
+    assert record["executionTime"] == 1.5
+    assert record["request"]["ip"] == "127.0.0.1"
+
+
+def test_environ_headers():
+    environ = {
+        "HTTP_ACCEPT": "*/*",
+        "HTTP_X_REQUEST_ID": "abc",
+        "HTTP_CONTENT_TYPE": "ignored",
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": "",
+        "PATH_INFO": "/pets",
+    }
+    assert environ_headers(environ) == list(EnvironHeaders(environ))
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from firetail.redaction import Redactor, parse_path, sha_hash
+
+
+def test_parse_path():
+    assert parse_path("$.user.password") == ["user", "password"]
+    assert parse_path("users[*].email") == ["users", "*", "email"]
+    assert parse_path("$.cards[0]") == ["cards", "0"]
+    assert parse_path("$..password") == ["**", "password"]
+    with pytest.raises(ValueError):
+        parse_path("$..")
+
+
+def test_redact_headers():
+    redactor = Redactor(["Authorization", "cookie"])
+    headers = {"AUTHORIZATION": ["secret"], "Cookie": ["a", "b"], "Accept": ["*/*"]}
+    redactor.redact_headers(headers)
+    assert headers == {
+        "AUTHORIZATION": ["{SANITIZED_HEADER:" + sha_hash("secret") + "}"],
+        "Cookie": ["{SANITIZED_HEADER:" + sha_hash("a") + "}", "{SANITIZED_HEADER:" + sha_hash("b") + "}"],
+        "Accept": ["*/*"],
+    }
+
+
+def test_redact_body_paths():
+    redactor = Redactor(body_paths=["$.user.password", "$.cards[*].number", "$..token", "$.pins[1]"])
+    body = json.dumps(
+        {
+            "user": {"name": "jsmith", "password": "hunter2"},
+            "cards": [{"number": 4111, "cvc": "123"}],
+            "nested": {"deep": {"token": "abc"}},
+            "token": "xyz",
+            "pins": ["1", "2"],
+        }
+    )
+    redacted = json.loads(redactor.redact_body(body))
+    assert redacted["user"] == {"name": "jsmith", "password": "{SANITIZED_FIELD:" + sha_hash("hunter2") + "}"}
+    assert redacted["cards"] == [{"number": "{SANITIZED_FIELD:" + sha_hash("4111") + "}", "cvc": "123"}]
+    assert redacted["nested"]["deep"]["token"] == "{SANITIZED_FIELD:" + sha_hash("abc") + "}"
+    assert redacted["token"] == "{SANITIZED_FIELD:" + sha_hash("xyz") + "}"
+    assert redacted["pins"] == ["1", "{SANITIZED_FIELD:" + sha_hash("2") + "}"]
+
+
+def test_redact_body_untouched():
+    redactor = Redactor(body_paths=["$.password"])
+    body = '{"name":  "jsmith"}'
+    assert redactor.redact_body(body) is body
+    assert redactor.redact_body("not json") == "not json"
+
+
+def test_redact_unparsable_body():
+    redactor = Redactor(body_paths=["$.password"])
+    assert redactor.redact_body('{"password": "hunter2", "na') == "{OMITTED_BODY:unparsable JSON}"
+    assert Redactor().redact_body('{"password": "hunter2", "na') == '{"password": "hunter2", "na'
+
+
+def test_redact_body_patterns():
+    redactor = Redactor(body_patterns=[r"\d{4}-\d{4}-\d{4}-\d{4}", r"[\w.]+@example\.com"])
+    redacted = redactor.redact_body("card 4111-1111-1111-1111 of jsmith@example.com")
+    assert redacted == "card {SANITIZED_VALUE:%s} of {SANITIZED_VALUE:%s}" % (
+        sha_hash("4111-1111-1111-1111"),
+        sha_hash("jsmith@example.com"),
+    )
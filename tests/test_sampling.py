@@ -0,0 +1,52 @@
+from unittest import mock
+
+from firetail.sampling import SamplingPolicy, TokenBucket
+
+
+def test_keep_all_by_default():
+    policy = SamplingPolicy()
+    assert all(policy.should_sample("GET", "/pets", 200) for _ in range(100))
+
+
+def test_route_and_method_rates():
+    policy = SamplingPolicy(route_rates={"GET /health": 0, "/pets": 1}, method_rates={"get": 0})
+    assert policy.rate_for("GET", "/health") == 0
+    assert policy.rate_for("POST", "/health") == 1.0
+    assert policy.rate_for("GET", "/pets") == 1
+    assert policy.rate_for("GET", "/owners") == 0
+
+    assert not policy.should_sample("GET", "/health", 200)
+    assert policy.should_sample("GET", "/pets", 200)
+    assert policy.sampled_out == 1
+
+
+def test_errors_are_always_kept():
+    policy = SamplingPolicy(sample_rate=0, max_records_per_second=0, burst=0)
+    assert policy.should_sample("GET", "/pets", 404)
+    assert policy.should_sample("GET", "/pets", 500)
+    assert not policy.should_sample("GET", "/pets", 200)
+
+    policy = SamplingPolicy(sample_rate=0, keep_errors=False)
+    assert not policy.should_sample("GET", "/pets", 500)
+
+
+def test_partial_rate():
+    policy = SamplingPolicy(sample_rate=0.5)
+    with mock.patch("firetail.sampling.random.random", side_effect=[0.2, 0.7]):
+        assert policy.should_sample("GET", "/pets", 200)
+        assert not policy.should_sample("GET", "/pets", 200)
+
+
+def test_rate_limit():
+    policy = SamplingPolicy(max_records_per_second=1, burst=2)
+    assert [policy.should_sample("GET", "/pets", 200) for _ in range(3)] == [True, True, False]
+    assert policy.rate_limited == 1
+
+
+def test_token_bucket_refills():
+    with mock.patch("firetail.sampling.time.monotonic", side_effect=[0, 0, 0, 0.5, 1.0]):
+        bucket = TokenBucket(rate=2, burst=1)
+        assert bucket.consume()
+        assert not bucket.consume()
+        assert bucket.consume()
+        assert bucket.consume()
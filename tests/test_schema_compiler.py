@@ -0,0 +1,85 @@
+import itertools
+
+import pytest
+from firetail.json_schema import Draft4RequestValidator, Draft4ResponseValidator
+from firetail.schema_compiler import CompiledValidator, compile_validator
+from jsonschema import Draft4Validator, ValidationError, draft4_format_checker
+from jsonschema.validators import extend
+
+SCHEMA = {
+    "type": "object",
+    "required": ["id", "name", "token", "secret"],
+    "additionalProperties": False,
+    "properties": {
+        "id": {"type": "integer", "minimum": 1, "readOnly": True},
+        "name": {"type": "string", "minLength": 1, "maxLength": 5, "pattern": "^[a-z]+$"},
+        "tag": {"type": "string", "x-nullable": True, "enum": ["a", "b"]},
+        "token": {"type": "string", "writeOnly": True},
+        "secret": {"type": "string", "x-writeOnly": True},
+        "tags": {"type": "array", "items": {"type": "string"}, "uniqueItems": True, "maxItems": 3},
+        "ratio": {"type": "number", "maximum": 1, "exclusiveMaximum": True, "nullable": True},
+        "email": {"type": "string", "format": "email"},
+        "either": {"anyOf": [{"type": "integer"}, {"type": "string"}]},
+        "one": {"oneOf": [{"type": "integer"}, {"type": "string"}]},
+    },
+}
+
+VALUES = [None, 0, 1, 1.0, 0.5, True, "", "a", "abc", "ABC", "abcdef", "x@y.z", "nope", [], ["a"], ["a", "a"], {}]
+
+
+def instances():
+    keys = list(SCHEMA["properties"]) + ["extra"]
+    for key, value in itertools.product(keys, VALUES):
+        yield {"name": "ab", key: value}
+        yield {"name": "ab", "token": "t", "secret": "s", key: value}
+        yield {"id": 1, "name": "ab", "token": "t", "secret": "s", key: value}
+
+
+@pytest.mark.parametrize("validator_class", [Draft4Validator, Draft4RequestValidator, Draft4ResponseValidator])
+def test_compiled_checks_agree_with_jsonschema(validator_class):
+    validator = validator_class(SCHEMA, format_checker=draft4_format_checker)
+    compiled = compile_validator(validator)
+    assert isinstance(compiled, CompiledValidator)
+
+    accepted = 0
+    for instance in instances():
+        if compiled.check(instance):
+            accepted += 1
+            assert validator.is_valid(instance), instance
+        assert compiled.is_valid(instance) == validator.is_valid(instance)
+    assert accepted
+
+
+def test_read_and_write_only_properties():
+    request = compile_validator(Draft4RequestValidator(SCHEMA))
+    response = compile_validator(Draft4ResponseValidator(SCHEMA))
+    # read-only properties may be left out of requests, write-only ones out of responses
+    assert request.check({"name": "ab", "token": "t", "secret": "s"})
+    assert response.check({"id": 1, "name": "ab"})
+    assert not request.check({"id": 1, "name": "ab", "token": "t", "secret": "s"})
+
+
+def test_errors_are_those_of_jsonschema():
+    validator = Draft4RequestValidator(SCHEMA)
+    compiled = compile_validator(validator)
+    instance = {"name": "ABC", "token": "t", "secret": "s"}
+
+    with pytest.raises(ValidationError) as expected:
+        validator.validate(instance)
+    with pytest.raises(ValidationError) as actual:
+        compiled.validate(instance)
+    assert actual.value.message == expected.value.message == "'ABC' does not match '^[a-z]+$'"
+
+
+def test_cyclic_schema():
+    schema = {"type": "object", "properties": {"name": {"type": "string"}}}
+    schema["properties"]["child"] = schema
+    compiled = compile_validator(Draft4Validator(schema))
+    assert compiled.check({"name": "a", "child": {"name": "b", "child": {}}})
+    assert not compiled.check({"child": {"name": 1}})
+
+
+def test_custom_validators_are_not_compiled():
+    CustomValidator = extend(Draft4Validator, {})
+    validator = CustomValidator({"type": "string"})
+    assert compile_validator(validator) is validator
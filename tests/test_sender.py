@@ -0,0 +1,257 @@
+import gzip
+import json
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from firetail.exceptions import FiretailException
+from firetail.retry import CircuitBreaker, classify_status
+from firetail.sender import FiretailSender
+
+
+@pytest.fixture
+def no_thread(monkeypatch):
+    monkeypatch.setattr(
+        FiretailSender, "_initialize_sending_thread", lambda self: setattr(self, "sending_thread", MagicMock())
+    )
+
+
+class InstantEvent(threading.Event):
+    """Closing event whose waits return right away, recording how long they would have lasted."""
+
+    def __init__(self):
+        super().__init__()
+        self.waits = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return self.is_set()
+
+
+def make_sender(**kwargs):
+    sender = FiretailSender("token", "http://localhost/logs/bulk", **kwargs)
+    sender.sink.session = MagicMock()
+    sender.sink.session.post.return_value = MagicMock(status_code=200)
+    return sender
+
+
+def test_flush_plain(no_thread):
+    sender = make_sender()
+    sender.append({"a": 1})
+    sender.append_encoded(b'{"b": 2}')
+    sender.flush()
+
+    _, kwargs = sender.sink.session.post.call_args
+    assert kwargs["data"] == b'{"a": 1}\n{"b": 2}'
+    assert "Content-Encoding" not in kwargs["headers"]
+
+
+def test_flush_gzip(no_thread):
+    sender = make_sender(compression="gzip", compression_level=9)
+    sender.append({"a": 1})
+    sender.append({"b": 2})
+    sender.flush()
+
+    _, kwargs = sender.sink.session.post.call_args
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert gzip.decompress(kwargs["data"]) == b'{"a": 1}\n{"b": 2}'
+
+
+def test_unknown_compression(no_thread):
+    with pytest.raises(FiretailException):
+        make_sender(compression="brotli")
+
+
+def test_batches_are_sized_by_encoded_length(no_thread):
+    sender = make_sender(max_batch_bytes=20)
+    for _ in range(5):
+        sender.append_encoded("é" * 3)  # 6 bytes once encoded
+    sender.flush()
+
+    bodies = [kwargs["data"] for _, kwargs in sender.sink.session.post.call_args_list]
+    assert [body.count(b"\n") + 1 for body in bodies] == [3, 2]
+    assert all(len(body) <= 20 for body in bodies)
+
+
+def test_max_batch_records(no_thread):
+    sender = make_sender(max_batch_records=2)
+    for i in range(5):
+        sender.append({"i": i})
+    sender.flush()
+
+    assert sender.sink.session.post.call_count == 3
+
+
+def test_upload_workers_share_one_pool(no_thread):
+    sender = FiretailSender("token", "https://localhost/logs/bulk", upload_workers=3)
+    adapter = sender.sink.session.get_adapter("https://localhost/logs/bulk")
+    assert adapter._pool_maxsize == 3
+    assert sender.sink.session.get_adapter("http://localhost/logs/bulk") is adapter
+
+
+def test_retries_transient_errors(no_thread, monkeypatch):
+    sender = make_sender(backup_logs=False, number_of_retries=3, retry_timeout=1)
+    sender._closing = InstantEvent()
+    sender.url = "http://localhost/retry"
+    sender.circuit_breaker = CircuitBreaker()
+    sender.sink.session.post.side_effect = [
+        MagicMock(status_code=503, headers={"Retry-After": "5"}),
+        MagicMock(status_code=429, headers={}),
+        MagicMock(status_code=200),
+    ]
+    sender.append({"a": 1})
+    sender.flush()
+
+    assert sender.sink.session.post.call_count == 3
+    delays = sender._closing.waits
+    assert delays[0] == 5
+    assert 0 <= delays[1] <= 2
+
+
+def test_does_not_retry_fatal_errors(no_thread, monkeypatch):
+    sender = make_sender(backup_logs=False)
+    sender._closing = InstantEvent()
+    sender.sink.session.post.return_value = MagicMock(status_code=400)
+    sender.append({"a": 1})
+    sender.flush()
+
+    assert sender.sink.session.post.call_count == 1
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    # reset_timeout elapsed: a single trial request goes through
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_classify_status():
+    assert [classify_status(code) for code in (200, 429, 503, 400, 404)] == [
+        "success",
+        "retry",
+        "retry",
+        "fatal",
+        "fatal",
+    ]
+
+
+def test_failed_batches_are_spilled_and_replayed(no_thread, monkeypatch, tmp_path):
+    monkeypatch.setattr(FiretailSender, "_initialize_replay_thread", lambda self: None)
+    sender = make_sender(number_of_retries=2, spill_directory=str(tmp_path))
+    sender._closing = InstantEvent()
+    sender.url = "http://localhost/spill"
+    sender.circuit_breaker = CircuitBreaker()
+    sender.sink.session.post.return_value = MagicMock(status_code=503, headers={})
+    sender.append({"a": 1})
+    sender.flush()
+
+    segment = sender.spill_queue.oldest_segment()
+    assert sender.spill_queue.read_segment(segment) == [b'{"a": 1}']
+
+    sender.sink.session.post.return_value = MagicMock(status_code=200)
+    assert sender._replay_segment(segment)
+    assert sender.sink.session.post.call_args[1]["data"] == b'{"a": 1}'
+    assert sender.spill_queue.empty()
+
+
+def test_metrics(no_thread):
+    sender = make_sender(max_batch_records=2)
+    for i in range(3):
+        sender.append({"i": i})
+    sender.flush()
+
+    snapshot = sender.metrics.snapshot()
+    assert snapshot["counters"]["records_enqueued"] == 3
+    assert snapshot["counters"]["batches_sent"] == 2
+    assert snapshot["counters"]["records_sent"] == 3
+    assert snapshot["status_codes"] == {"200": 2}
+    assert snapshot["gauges"]["queue_records"] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_reset_after_fork(no_thread, tmp_path):
+    sender = make_sender(spill_directory=str(tmp_path))
+    sender.append({"queued": "before fork"})
+    session = sender.sink.session
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child: report the state of the sender, then exit without running pytest teardown
+        state = [
+            sender.pid == os.getpid(),
+            sender.queue.empty(),
+            sender.sink.session is not session,
+            sender.spill_queue.directory == os.path.join(str(tmp_path), "worker-{}".format(os.getpid())),
+        ]
+        os.write(write_end, json.dumps(state).encode())
+        os._exit(0)
+
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        state = json.loads(f.read())
+    os.waitpid(pid, 0)
+    assert state == [True, True, True, True]
+    assert sender.queue.qsize() == 1
+
+
+def test_close_drains_and_joins():
+    sender = make_sender(flush_linger=60, logs_drain_timeout=60)
+    sender.append({"a": 1})
+
+    started_at = time.monotonic()
+    assert sender.close(timeout=5)
+    assert time.monotonic() - started_at < 5
+    assert not any(thread.is_alive() for thread in sender.sending_threads)
+    assert sender.sink.session.post.call_count == 1
+
+    sender.append({"b": 2})
+    assert sender.queue.empty()
+
+
+def test_close_backs_up_what_could_not_be_sent(tmp_path):
+    sender = make_sender(spill_directory=str(tmp_path), number_of_retries=5, retry_timeout=60)
+    sender.sink.session.post.return_value = MagicMock(status_code=503, headers={})
+    sender.append({"a": 1})
+
+    started_at = time.monotonic()
+    sender.close(timeout=2)
+    assert time.monotonic() - started_at < 5
+    assert sender.spill_queue.read_segment(sender.spill_queue.oldest_segment()) == [b'{"a": 1}']
+
+
+def test_replay_skips_deleted_segments(no_thread, monkeypatch, tmp_path):
+    monkeypatch.setattr(FiretailSender, "_initialize_replay_thread", lambda self: None)
+    sender = make_sender(spill_directory=str(tmp_path))
+    sender.spill_queue.append([b'{"a": 1}'])
+    segment = sender.spill_queue.oldest_segment()
+    os.remove(segment)
+
+    assert sender._replay_segment(segment)
+    assert sender.spill_queue.empty()
+    sender.sink.session.post.assert_not_called()
+
+
+def test_batches_rejected_for_good_are_not_spilled(no_thread, monkeypatch, tmp_path):
+    monkeypatch.setattr(FiretailSender, "_initialize_replay_thread", lambda self: None)
+    sender = make_sender(spill_directory=str(tmp_path))
+    sender.circuit_breaker = CircuitBreaker()
+    sender.sink.session.post.return_value = MagicMock(status_code=413, headers={})
+    sender.append({"a": "x" * 200})
+    sender.flush()
+    assert sender.sink.session.post.call_count == 1
+    assert sender.spill_queue.empty()
+
+    # Spilled before the backend started rejecting it
+    sender.spill_queue.append([b'{"a": 1}'])
+    assert sender._replay_segment(sender.spill_queue.oldest_segment())
+    assert sender.sink.session.post.call_count == 2
+    assert sender.spill_queue.empty()
@@ -0,0 +1,104 @@
+import asyncio
+import gzip
+import io
+import json
+from unittest.mock import MagicMock
+
+import flask
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from firetail.aio_auditor import AsyncAuditor
+from firetail.auditor import cloud_logger
+from firetail.sender import FiretailSender
+from firetail.sinks import FileSink, MemorySink, Sink, StdoutSink
+
+
+def test_file_sink_appends_and_rotates(tmp_path):
+    path = str(tmp_path / "logs" / "audit.ndjson")
+    sink = FileSink(path, max_bytes=20, backup_count=2)
+    for batch in (b'{"a":1}\n{"b":2}', b'{"c":3}', b'{"d":4}', b'{"e":5}'):
+        assert sink.send(batch, batch.split(b"\n")).status_code == 200
+
+    with open(path, "rb") as f:
+        assert f.read() == b'{"e":5}\n'
+    with open(path + ".1", "rb") as f:
+        assert f.read() == b'{"c":3}\n{"d":4}\n'
+    with open(path + ".2", "rb") as f:
+        assert f.read() == b'{"a":1}\n{"b":2}\n'
+
+
+def test_file_sink_concatenates_compressed_batches(tmp_path):
+    sink = FileSink(str(tmp_path / "audit.ndjson"))
+    sink.send(gzip.compress(b'{"a":1}\n{"b":2}'), [b'{"a":1}', b'{"b":2}'], "gzip")
+    sink.send(gzip.compress(b'{"c":3}'), [b'{"c":3}'], "gzip")
+
+    with gzip.open(sink.path_for("gzip")) as f:
+        assert f.read() == b'{"a":1}\n{"b":2}\n{"c":3}\n'
+
+
+def test_stdout_sink():
+    stream = io.BytesIO()
+    sink = StdoutSink(stream)
+    sink.send(b'{"a":1}', [b'{"a":1}'])
+    sink.send(b'{"b":2}', [b'{"b":2}'])
+    assert stream.getvalue() == b'{"a":1}\n{"b":2}\n'
+
+
+def test_memory_sink_ring():
+    sink = MemorySink(max_records=2)
+    sink.send(b"1\n2\n3", [b"1", b"2", b"3"])
+    assert list(sink.records) == [b"2", b"3"]
+    assert sink.batches == 1
+
+
+def test_sender_batches_and_compresses_for_any_sink(monkeypatch):
+    monkeypatch.setattr(
+        FiretailSender, "_initialize_sending_thread", lambda self: setattr(self, "sending_thread", MagicMock())
+    )
+    sink = MemorySink()
+    sender = FiretailSender(None, None, sink=sink, max_batch_records=2, compression="gzip")
+    for i in range(3):
+        sender.append({"i": i})
+    sender.flush()
+
+    assert sink.batches == 2
+    assert [json.loads(record) for record in sink.records] == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert sender.metrics.snapshot()["counters"]["batches_sent"] == 2
+
+
+def test_async_auditor_sink():
+    sink = MemorySink()
+    auditor = AsyncAuditor(flush_linger=0, sink=sink)
+
+    async def run():
+        app = web.Application(middlewares=[auditor.aiohttp_middleware])
+        app.router.add_get("/hello", lambda request: web.Response(text="Hello"))
+        async with TestClient(TestServer(app)) as client:
+            await client.get("/hello")
+        await auditor.close(timeout=5)
+
+    asyncio.run(run())
+
+    (record,) = [json.loads(record) for record in sink.records]
+    assert record["response"]["body"] == "Hello"
+
+
+def test_cloud_logger_sink_needs_no_token():
+    sink = MemorySink()
+    app = flask.Flask(__name__)
+    app.route("/ping")(lambda: "pong")
+    cl = cloud_logger(app, sender_options={"sink": sink})
+    app.test_client().get("/ping")
+    cl.sender.close(timeout=5)
+
+    (record,) = [json.loads(record) for record in sink.records]
+    assert record["request"]["resource"] == "/ping"
+
+
+def test_sink_must_implement_send():
+    class IncompleteSink(Sink):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteSink()
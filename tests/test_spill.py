@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from firetail.spill import SpillQueue, worker_spill_directory
+
+
+def test_append_read_remove(tmp_path):
+    spill = SpillQueue(str(tmp_path), segment_bytes=10)
+    assert spill.empty()
+    assert spill.append([b'{"a": 1}', b'{"b": 2}'])
+    assert spill.append([b'{"c": 3}'])
+
+    first = spill.oldest_segment()
+    assert spill.read_segment(first) == [b'{"a": 1}', b'{"b": 2}']
+    spill.remove(first)
+
+    second = spill.oldest_segment()
+    assert second != first
+    assert spill.read_segment(second) == [b'{"c": 3}']
+    spill.remove(second)
+    assert spill.empty()
+    assert spill.nbytes == 0
+
+
+def test_segments_survive_restart(tmp_path):
+    spill = SpillQueue(str(tmp_path), fsync="always")
+    spill.append([b"1"])
+    spill.close()
+
+    reopened = SpillQueue(str(tmp_path))
+    assert reopened.read_segment(reopened.oldest_segment()) == [b"1"]
+    reopened.append([b"2"])
+    assert len(reopened._segments) == 2
+
+
+def test_size_cap(tmp_path):
+    spill = SpillQueue(str(tmp_path), max_bytes=4)
+    assert spill.append([b"abc"])
+    assert not spill.append([b"d", b"e"])
+    assert spill.dropped == 2
+
+
+def test_invalid_fsync_policy(tmp_path):
+    with pytest.raises(ValueError):
+        SpillQueue(str(tmp_path), fsync="sometimes")
+
+
+def write_segment(directory, sequence, *records):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "segment-{:020d}.ndjson".format(sequence)), "wb") as f:
+        f.write(b"".join(record + b"\n" for record in records))
+
+
+def test_exited_worker_segments_are_adopted(tmp_path):
+    write_segment(worker_spill_directory(str(tmp_path), 99999999), 0, b"from worker")
+    write_segment(worker_spill_directory(str(tmp_path), os.getppid()), 0, b"from running worker")
+
+    spill = SpillQueue(str(tmp_path))
+    segment = spill.oldest_segment()
+    assert spill.read_segment(segment) == [b"from worker"]
+    spill.remove(segment)
+    assert spill.empty()
+    assert sorted(os.listdir(tmp_path)) == ["worker-{}".format(os.getppid())]
+
+
+def test_orphan_segments_are_adopted_once(tmp_path):
+    write_segment(worker_spill_directory(str(tmp_path), 99999999), 0, b"from worker")
+    write_segment(worker_spill_directory(str(tmp_path), os.getpid()) + "-7", 0, b"from earlier process")
+    write_segment(str(tmp_path), 3, b"from older version")
+
+    first = SpillQueue(str(tmp_path))
+    second = SpillQueue(str(tmp_path))
+    segments = list(first._segments)
+    assert sorted(first.read_segment(path)[0] for path in segments) == [
+        b"from earlier process",
+        b"from older version",
+        b"from worker",
+    ]
+    assert all(os.path.dirname(path) == first.directory for path in segments)
+    assert second.empty()
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(first.directory)]
+
+    first.append([b"new"])
+    assert first.read_segment(first._segments[-1]) == [b"new"]
+
+
+def test_queues_sharing_a_directory_write_their_own_segments(tmp_path):
+    first = SpillQueue(str(tmp_path))
+    second = SpillQueue(str(tmp_path))
+    assert first.directory == worker_spill_directory(str(tmp_path), os.getpid())
+    assert second.directory != first.directory
+
+    first.append([b"1"])
+    second.append([b"2"])
+    assert first.read_segment(first.oldest_segment()) == [b"1"]
+    assert second.read_segment(second.oldest_segment()) == [b"2"]
+
+
+def test_segment_deleted_from_under_the_queue(tmp_path):
+    spill = SpillQueue(str(tmp_path))
+    spill.append([b"1"])
+    segment = spill.oldest_segment()
+    os.remove(segment)
+
+    spill.remove(segment)
+    assert spill.empty()
+    assert spill.nbytes == 0